@@ -1,5 +1,6 @@
 # Import necessary packages and modules
 import os  # For interacting with the operating system
+import json  # For decoding worker statistics
 import math  # For mathematical operations
 import traceback  # To provide details of exceptions
 import redis  # Redis database interface
@@ -19,6 +20,7 @@ os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'
 logging.getLogger('tensorflow').setLevel(logging.ERROR)
 
 from process.wrapper.Database import MongoDBWrapper  # MongoDB database wrapper
+from process.wrapper.ChunkQueue import ChunkQueue  # Redis queue of the chunks to process
 from utils.Dataset import DatasetModel  # Dataset utility model
 from utils.Table import TableModel  # Table utility model
 
@@ -31,6 +33,7 @@ API_TOKEN = os.environ["ALLIGATOR_TOKEN"]  # API token for authentication
 
 # Initialize Redis client for tracking active jobs
 job_active = redis.Redis(host=REDIS_ENDPOINT, db=REDIS_JOB_DB)
+chunk_queue = ChunkQueue(job_active)
 
 # Initialize MongoDB wrapper and get collections for different data models
 mongoDBWrapper = MongoDBWrapper()
@@ -56,6 +59,9 @@ api = Api(app, version="1.0", title="Alligator", description=description)
 # Define a namespace for dataset related operations
 ds = api.namespace("dataset", description="Dataset namespace")
 
+# Define a namespace for computation workers
+wk = api.namespace("worker", description="Worker namespace")
+
 # Initialize a parser for file uploads
 upload_parser = api.parser()
 upload_parser.add_argument("file", location="files",
@@ -202,7 +208,7 @@ class CreateWithArray(Resource):
             dataset.store_datasets()
             tables = table.get_data()
             mongoDBWrapper.get_collection("row").insert_many(tables)
-            job_active.delete("STOP")
+            chunk_queue.push([table["_id"] for table in tables])  # dispatch the chunks to the workers
             out = [{"id": str(table["_id"]), "datasetName": table["datasetName"], "tableName": table["tableName"]} for table in tables]
         except Exception as e:
             print({"traceback": traceback.format_exc()}, flush=True)
@@ -489,7 +495,7 @@ class DatasetTable(Resource):
             dataset.store_datasets()
             tables = table.get_data()
             row_c.insert_many(tables)    
-            job_active.delete("STOP")
+            chunk_queue.push([table["_id"] for table in tables])  # dispatch the chunks to the workers
             out = [{"id": str(table["_id"]),  "datasetName": table["datasetName"], "tableName": table["tableName"]} for table in tables]
             return {"status": "Ok", "tables": out}, 202
         except pymongo.errors.DuplicateKeyError as e:
@@ -767,5 +773,47 @@ class TableID(Resource):
         candidate_scored_c.delete_many(query)
        
 
+@wk.route("/stats")
+@wk.doc(
+    description="Throughput of the computation workers.",
+    responses={
+        200: "OK - Returns the statistics published by every worker.",
+        403: "Forbidden - Access denied due to invalid token."
+    },
+    params={
+        "token": {"description": "API key token for authentication.", "type": "string"}
+    }
+)
+class WorkerStats(Resource):
+    def get(self):
+        """
+            Retrieves the number of chunks processed by each worker and its chunks per second.
+            Parameters:
+                token (str): API token for authentication.
+            Returns:
+                Dict: The statistics of every worker and the overall chunks per second.
+        """
+        parser = reqparse.RequestParser()
+        parser.add_argument("token", type=str, help="variable 1", location="args")
+        args = parser.parse_args()
+        token = args["token"]
+
+        if not validate_token(token):
+            return {"Error": "Invalid Token"}, 403
+
+        try:
+            workers = {
+                worker_id.decode(): json.loads(stats)
+                for worker_id, stats in job_active.hgetall("WORKERS").items()
+            }
+            return {
+                "workers": workers,
+                "chunksPerSecond": round(sum(w["recentChunksPerSecond"] for w in workers.values()), 4)
+            }, 200
+        except Exception as e:
+            print({"traceback": traceback.format_exc()}, flush=True)
+            return {"status": "Error", "message": str(e)}, 400
+
+
 if __name__ == "__main__":
     app.run(debug=True)
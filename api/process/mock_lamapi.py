@@ -0,0 +1,270 @@
+"""
+Stand-in LamAPI server, to run and load-test the workers without LamAPI,
+Elasticsearch and the LamAPI MongoDB.
+
+It implements the routes used by Alligator (lookup/entity-retrieval, entity/*,
+classify/literal-recognizer, sti/column-analysis) from a synthetic entity corpus,
+deterministic for a given seed, or from a recorded corpus (a JSON file with a
+dictionary mention/entity id -> response for every endpoint). Latency, error
+rate and response size can be configured globally or per endpoint.
+
+    python ./process/mock_lamapi.py --port 5000 --latency lognormal:50:0.5 --error-rate 0.01
+    LAMAPI_ENDPOINT=http://localhost:5000/ python ./process/supervisor.py 4
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import math
+import random
+
+from aiohttp import web
+
+import utils.utils as utils
+
+ENDPOINTS = ["lookup", "labels", "objects", "predicates", "types", "literals", "literal_recognizer", "column_analysis"]
+DEFAULT_SIZES = {"lookup": 20, "objects": 20, "literals": 10, "types": 5, "predicates": 20, "labels": 3}
+SYLLABLES = ["al", "be", "ca", "do", "el", "fa", "gi", "ho", "ir", "ju", "ka", "lo", "mi", "no", "or", "pa", "qu", "ro",
+             "sa", "te", "ul", "vi", "wa", "xe", "yo", "za"]
+
+
+def parse_latency(spec):
+    """
+    Parse a latency distribution, in milliseconds: "fixed:MS", "uniform:MIN:MAX"
+    or "lognormal:MEDIAN:SIGMA".
+
+    :return: Function returning a latency in seconds.
+    """
+    kind, *values = spec.split(":")
+    values = [float(value) for value in values]
+    if kind == "fixed":
+        return lambda rng: values[0] / 1000
+    if kind == "uniform":
+        return lambda rng: rng.uniform(values[0], values[1]) / 1000
+    if kind == "lognormal":
+        return lambda rng: rng.lognormvariate(math.log(values[0]), values[1]) / 1000
+    raise ValueError(f"Unknown latency distribution: {spec}")
+
+
+class EndpointProfile:
+    def __init__(self, latency="fixed:0", error_rate=0.0, size=None):
+        self.latency = parse_latency(latency)
+        self.error_rate = error_rate
+        self.size = size
+
+
+class SyntheticCorpus:
+    """
+    Entities, their relations and literals generated from the seed and the
+    requested ids or mentions, so the same request always gets the same answer.
+    Entity popularity is skewed, so candidates are shared between mentions the
+    way they are in a real KG.
+    """
+    def __init__(self, seed, n_entities, n_predicates=50):
+        self._seed = seed
+        self._n_entities = n_entities
+        self._n_predicates = n_predicates
+
+    def _rng(self, *key):
+        digest = hashlib.md5(":".join([str(self._seed), *map(str, key)]).encode()).hexdigest()
+        return random.Random(int(digest, 16))
+
+    def _entity(self, rng):
+        # Pareto distributed ids, small ids are popular
+        return f"Q{min(int(rng.paretovariate(1.2)), self._n_entities)}"
+
+    def _name(self, entity):
+        rng = self._rng("name", entity)
+        return " ".join("".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))) for _ in range(rng.randint(1, 3)))
+
+    def _types(self, entity, size):
+        rng = self._rng("types", entity)
+        return [{"id": f"Q{rng.randint(1, 500)}", "name": f"type {i}"} for i in range(rng.randint(1, size))]
+
+    def lookup(self, mention, size, limit):
+        rng = self._rng("lookup", mention)
+        mention_tokens = str(mention).split()
+        candidates = []
+        for rank in range(min(size, limit)):
+            entity = f"Q{int(self._rng('mention', mention).random() * self._n_entities) + 1}" if rank == 0 else self._entity(rng)
+            name = str(mention) if rank == 0 else self._name(entity)
+            ed_score = 1.0 if rank == 0 else round(rng.random(), 3)
+            candidates.append({
+                "id": entity,
+                "name": name,
+                "description": self._name(f"{entity}-description"),
+                "types": self._types(entity, DEFAULT_SIZES["types"]),
+                "ambiguity_mention": round(rng.random(), 3),
+                "corrects_tokens": round(rng.random(), 3),
+                "ntoken_mention": len(mention_tokens),
+                "ntoken_entity": len(name.split()),
+                "length_mention": len(str(mention)),
+                "length_entity": len(name),
+                "popularity": round(rng.random(), 3),
+                "pos_score": round(rank / max(size, 1), 3),
+                "es_score": round(rng.random(), 3),
+                "ed_score": ed_score,
+                "jaccard_score": ed_score if rank == 0 else round(rng.random(), 3),
+                "jaccardNgram_score": ed_score if rank == 0 else round(rng.random(), 3)
+            })
+        return candidates
+
+    def objects(self, entity, size):
+        rng = self._rng("objects", entity)
+        objects = {}
+        for _ in range(rng.randint(0, size)):
+            objects.setdefault(self._entity(rng), []).append(f"P{rng.randint(1, self._n_predicates)}")
+        return {"objects": objects}
+
+    def literals(self, entity, size):
+        rng = self._rng("literals", entity)
+        literals = {"number": {}, "datetime": {}, "string": {}}
+        for _ in range(rng.randint(0, size)):
+            predicate = f"P{rng.randint(1, self._n_predicates)}"
+            datatype = rng.choice(list(literals))
+            if datatype == "number":
+                value = f"+{rng.randint(0, 100000)}"
+            elif datatype == "datetime":
+                value = f"{rng.randint(1800, 2024)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}"
+            else:
+                value = self._name(f"{entity}-{predicate}")
+            literals[datatype].setdefault(predicate, []).append(value)
+        return {"literals": literals}
+
+    def types(self, entity, size):
+        return {"types": self._types(entity, size)}
+
+    def predicates(self, entity, size):
+        rng = self._rng("predicates", entity)
+        return {f"P{rng.randint(1, self._n_predicates)}": [self._entity(rng)] for _ in range(rng.randint(0, size))}
+
+    def labels(self, entity, size):
+        return {"labels": {"en": self._name(entity)}, "aliases": {"en": [self._name(f"{entity}-{i}") for i in range(size - 1)]}}
+
+
+class MockLamAPI:
+    def __init__(self, corpus, profiles, recorded=None, seed=0, kg="wikidata"):
+        """
+        Initialize the MockLamAPI.
+
+        :param corpus: SyntheticCorpus answering the requests missing from the recorded corpus.
+        :param profiles: Dictionary endpoint -> EndpointProfile.
+        :param recorded: Optional dictionary endpoint -> dictionary mention/entity id -> response.
+        :param kg: Key wrapping the responses, as LamAPI does.
+        """
+        self._corpus = corpus
+        self._profiles = profiles
+        self._recorded = recorded or {}
+        self._rng = random.Random(seed)
+        self._kg = kg
+        self.requests = {endpoint: 0 for endpoint in ENDPOINTS}
+
+    async def _simulate(self, endpoint):
+        """
+        :return: An error response, or None after the configured latency.
+        """
+        self.requests[endpoint] += 1
+        profile = self._profiles[endpoint]
+        await asyncio.sleep(profile.latency(self._rng))
+        if self._rng.random() < profile.error_rate:
+            return web.json_response({"error": "simulated error"}, status=500)
+        return None
+
+    def _item(self, endpoint, key, *args):
+        recorded = self._recorded.get(endpoint, {})
+        if key in recorded:
+            return recorded[key]
+        return getattr(self._corpus, endpoint)(key, *args)
+
+    async def lookup(self, request):
+        error = await self._simulate("lookup")
+        if error is not None:
+            return error
+        limit = int(request.query.get("limit", 100))
+        if request.method == "POST":
+            mentions = (await request.json())["json"]
+        else:
+            mentions = [request.query["name"]]
+        size = self._profiles["lookup"].size
+        return web.json_response({self._kg: {mention: self._item("lookup", mention, size, limit) for mention in mentions}})
+
+    def entity_handler(self, endpoint):
+        async def handler(request):
+            error = await self._simulate(endpoint)
+            if error is not None:
+                return error
+            entities = (await request.json())["json"]
+            size = self._profiles[endpoint].size
+            return web.json_response({self._kg: {entity: self._item(endpoint, entity, size) for entity in entities}})
+        return handler
+
+    async def literal_recognizer(self, request):
+        error = await self._simulate("literal_recognizer")
+        if error is not None:
+            return error
+        result = {}
+        for cell in (await request.json())["json"]:
+            datatype = utils.guess_datatype(cell)
+            result[cell] = {"datatype": datatype, "classification": datatype}
+        return web.json_response(result)
+
+    async def column_analysis(self, request):
+        error = await self._simulate("column_analysis")
+        if error is not None:
+            return error
+        result = {}
+        for id_col, column in enumerate((await request.json())["json"]):
+            datatypes = [utils.guess_datatype(cell) for cell in column if str(cell).strip() not in ("", "nan")]
+            datatype = max(set(datatypes), key=datatypes.count) if len(datatypes) > 0 else "STRING"
+            result[str(id_col)] = {"tag": "NE" if datatype == "STRING" else "LIT", "datatype": datatype}
+        return web.json_response(result)
+
+    async def stats(self, request):
+        return web.json_response(self.requests)
+
+    def app(self):
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.router.add_route("GET", "/lookup/entity-retrieval", self.lookup)
+        app.router.add_route("POST", "/lookup/entity-retrieval", self.lookup)
+        for endpoint in ["labels", "objects", "predicates", "types", "literals"]:
+            app.router.add_route("POST", f"/entity/{endpoint}", self.entity_handler(endpoint))
+        app.router.add_route("POST", "/classify/literal-recognizer", self.literal_recognizer)
+        app.router.add_route("POST", "/sti/column-analysis", self.column_analysis)
+        app.router.add_route("GET", "/stats", self.stats)
+        return app
+
+
+def build_profiles(args):
+    overrides = {}
+    if args.profile is not None:
+        with open(args.profile) as f:
+            overrides = json.load(f)
+    profiles = {}
+    for endpoint in ENDPOINTS:
+        settings = {"latency": args.latency, "error_rate": args.error_rate, "size": DEFAULT_SIZES.get(endpoint)}
+        if endpoint == "lookup":
+            settings["size"] = args.lookup_size
+        settings.update(overrides.get(endpoint, {}))
+        profiles[endpoint] = EndpointProfile(**settings)
+    return profiles
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stand-in LamAPI server")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=5000)
+    parser.add_argument("--seed", type=int, default=0, help="seed of the synthetic corpus and of the simulated latency")
+    parser.add_argument("--entities", type=int, default=1000000, help="number of entities of the synthetic corpus")
+    parser.add_argument("--corpus", help="JSON file with the recorded responses of every endpoint")
+    parser.add_argument("--latency", default="fixed:0", help="fixed:MS, uniform:MIN:MAX or lognormal:MEDIAN:SIGMA")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of the requests answered with a 500")
+    parser.add_argument("--lookup-size", type=int, default=DEFAULT_SIZES["lookup"], help="candidates per mention")
+    parser.add_argument("--profile", help='JSON file with per-endpoint settings, e.g. {"lookup": {"latency": "lognormal:80:0.6", "size": 50}}')
+    args = parser.parse_args()
+
+    recorded = None
+    if args.corpus is not None:
+        with open(args.corpus) as f:
+            recorded = json.load(f)
+    mock = MockLamAPI(SyntheticCorpus(args.seed, args.entities), build_profiles(args), recorded, args.seed)
+    web.run_app(mock.app(), host=args.host, port=args.port)
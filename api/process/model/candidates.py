@@ -0,0 +1,215 @@
+import numpy as np
+
+import utils.utils as utils
+
+# Features of a candidate, in the order expected by the neural models
+FEATURES = [
+    "ambiguity_mention",
+    "ncorrects_tokens",
+    "ntoken_mention",
+    "ntoken_entity",
+    "length_mention",
+    "length_entity",
+    "popularity",
+    "pos_score",
+    "es_score",
+    "ed_score",
+    "jaccard_score",
+    "jaccardNgram_score",
+    #"cosine_similarity", deprecated
+    "p_subj_ne",
+    "p_subj_lit_datatype",
+    "p_subj_lit_all_datatype",
+    "p_subj_lit_row",
+    "p_obj_ne",
+    "desc",
+    "descNgram",
+    "cta_t1",
+    "cta_t2",
+    "cta_t3",
+    "cta_t4",
+    "cta_t5",
+    "cpa_t1",
+    "cpa_t2",
+    "cpa_t3",
+    "cpa_t4",
+    "cpa_t5"
+]
+FEATURE_INDEX = {feature: i for i, feature in enumerate(FEATURES)}
+
+# Features copied from the candidates returned by the lookup: feature -> key in the lookup result
+LOOKUP_FEATURES = {
+    "ambiguity_mention": "ambiguity_mention",
+    "ncorrects_tokens": "corrects_tokens",
+    "ntoken_mention": "ntoken_mention",
+    "ntoken_entity": "ntoken_entity",
+    "length_mention": "length_mention",
+    "length_entity": "length_entity",
+    "popularity": "popularity",
+    "pos_score": "pos_score",
+    "es_score": "es_score",
+    "ed_score": "ed_score",
+    "jaccard_score": "jaccard_score",
+    "jaccardNgram_score": "jaccardNgram_score"
+}
+
+
+class CandidateColumn:
+    """
+    Candidates of all the cells of a column of a chunk, stored by column: one
+    feature matrix with a row per candidate, the interned ids and the score
+    arrays, plus the lists of the per-candidate structures. The candidates of
+    a cell are the contiguous range [start, end) of the column.
+
+    Matches and predicates are sparse: None until the first match of the
+    candidate, then a dictionary with the columns that have matches only.
+    """
+    def __init__(self):
+        self._ids = np.zeros(0, dtype=np.int32)
+        self._features = np.zeros((0, len(FEATURES)))
+        self._pending_ids = []
+        self._pending_features = []
+        self.names = []
+        self.descriptions = []
+        self.types = []
+        self.matches = []
+        self.predicates = []
+        self.scores = {}  # score name (e.g. rho) -> array with a value per candidate
+
+    def __len__(self):
+        return len(self.names)
+
+    @property
+    def ids(self):
+        self._flush()
+        return self._ids
+
+    @property
+    def features(self):
+        self._flush()
+        return self._features
+
+    def _flush(self):
+        if len(self._pending_ids) == 0:
+            return
+        self._ids = np.concatenate([self._ids, np.asarray(self._pending_ids, dtype=np.int32)])
+        self._features = np.concatenate([self._features, np.asarray(self._pending_features, dtype=np.float64)])
+        self._pending_ids = []
+        self._pending_features = []
+
+    def append(self, entity, features, name, description, types):
+        self._pending_ids.append(entity)
+        self._pending_features.append(features)
+        self.names.append(name)
+        self.descriptions.append(description)
+        self.types.append(types)
+        self.matches.append(None)
+        self.predicates.append(None)
+
+    def get_scores(self, name):
+        if name not in self.scores:
+            self.scores[name] = np.zeros(len(self))
+        return self.scores[name]
+
+    def permute(self, start, end, order):
+        """
+        Reorders the candidates in [start, end), order holds the positions relative to start.
+        """
+        self._flush()
+        order = np.asarray(order)
+        self._ids[start:end] = self._ids[start:end][order]
+        self._features[start:end] = self._features[start:end][order]
+        for scores in self.scores.values():
+            scores[start:end] = scores[start:end][order]
+        for values in (self.names, self.descriptions, self.types, self.matches, self.predicates):
+            values[start:end] = [values[start + i] for i in order]
+
+
+class DescriptionSimilarity:
+    """
+    Computes the desc (token) and descNgram (character trigram) features of
+    all the candidates of a cell at once, with the values of
+    metrics.compute_similarity_between_string.
+
+    Tokens and trigrams are interned to ints; the ones of a description are
+    computed once per chunk, those of the row once per cell, and the overlaps
+    of all the candidates are counted with a single bincount.
+    """
+    def __init__(self):
+        self._vocabulary = {}
+        self._descriptions = {}  # normalized description -> (token ids, trigram ids)
+
+    def _intern(self, ngrams):
+        return np.fromiter((self._vocabulary.setdefault(ngram, len(self._vocabulary)) for ngram in ngrams), dtype=np.int64, count=len(ngrams))
+
+    def _ngrams(self, text):
+        return self._intern(utils.get_ngrams(text, None)), self._intern(utils.get_ngrams(text, 3))
+
+    def _description_ngrams(self, description):
+        if description not in self._descriptions:
+            self._descriptions[description] = self._ngrams(description)
+        return self._descriptions[description]
+
+    @staticmethod
+    def _overlap_scores(candidate_ngrams, row_ngrams):
+        sizes = np.array([len(ngrams) for ngrams in candidate_ngrams], dtype=np.int64)
+        owners = np.repeat(np.arange(len(candidate_ngrams)), sizes)
+        found = np.isin(np.concatenate(candidate_ngrams), row_ngrams)
+        overlaps = np.bincount(owners, weights=found, minlength=len(candidate_ngrams))
+        scores = overlaps / np.maximum(np.maximum(sizes, len(row_ngrams)), 1)
+        return [round(float(score), 3) for score in scores]
+
+    def scores(self, descriptions, row_content_norm):
+        """
+        :param descriptions: Normalized descriptions of the candidates.
+        :param row_content_norm: Normalized text of the row.
+        :return: The desc and descNgram scores of every description.
+        """
+        if len(descriptions) == 0:
+            return [], []
+        row_tokens, row_trigrams = self._ngrams(row_content_norm)
+        ngrams = [self._description_ngrams(description) for description in descriptions]
+        return (
+            self._overlap_scores([tokens for tokens, _ in ngrams], row_tokens),
+            self._overlap_scores([trigrams for _, trigrams in ngrams], row_trigrams)
+        )
+
+
+class CandidateStore:
+    """
+    Candidates of a chunk: a CandidateColumn for every column and the table of
+    the entity ids, interned to ints.
+    """
+    def __init__(self):
+        self.entities = []
+        self._entity_index = {}
+        self._columns = {}
+        self.description_similarity = DescriptionSimilarity()
+
+    def intern(self, entity):
+        if entity not in self._entity_index:
+            self._entity_index[entity] = len(self.entities)
+            self.entities.append(entity)
+        return self._entity_index[entity]
+
+    def index(self, entity):
+        """
+        :return: The interned id of the entity, None if it is not a candidate of the chunk.
+        """
+        return self._entity_index.get(entity)
+
+    def column(self, id_col):
+        if id_col not in self._columns:
+            self._columns[id_col] = CandidateColumn()
+        return self._columns[id_col]
+
+
+def feature_matrices(rows):
+    """
+    :return: The feature matrix of every column of the rows, candidates in row order.
+    """
+    matrices = [[] for _ in range(len(rows[0]))]
+    for row in rows:
+        for cell in row.get_cells():
+            matrices[cell._id_col].append(cell.features())
+    return [np.concatenate(matrix) if len(matrix) > 0 else np.zeros((0, len(FEATURES))) for matrix in matrices]
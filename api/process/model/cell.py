@@ -1,104 +1,166 @@
-import utils.metrics as metrics
+import numpy as np
+
 import utils.utils as utils
+from model.candidates import CandidateStore, FEATURES, FEATURE_INDEX, LOOKUP_FEATURES
 
 
 class Cell:
-    def __init__(self, content: str, row_content:str, candidates: list, id_col: int, n_cols: int, is_lit_cell=False, is_notag_cell=False, datatype=None):
+    def __init__(self, content: str, row_content:str, candidates: list, id_col: int, n_cols: int, is_lit_cell=False, is_notag_cell=False, datatype=None,
+                 store=None):
         self.content = content
         self._id_col = id_col
+        self._n_cols = n_cols
         self.is_lit_cell = is_lit_cell
         self.is_notag_cell = is_notag_cell
         self.datatype = datatype
-        self._candidates = []
+        self._store = store if store is not None else CandidateStore()
+        self._column = self._store.column(id_col)
         candidates_dict = {}
-        
+
         for candidate in candidates:
             id_candidate = candidate["id"]
-            name_norm = utils.clean_str(candidate["name"]) 
-            desc_norm = utils.clean_str(candidate["description"])
-            row_content_norm = utils.clean_str(row_content)
-            desc_score = round(metrics.compute_similarity_between_string(desc_norm, row_content_norm), 3)
-            desc_score_ngram = round(metrics.compute_similarity_between_string(desc_norm, row_content_norm, 3), 3)
-           
-            features = {
-                "ambiguity_mention": candidate["ambiguity_mention"],
-                "ncorrects_tokens": candidate["corrects_tokens"],
-                "ntoken_mention": candidate["ntoken_mention"],
-                "ntoken_entity": candidate["ntoken_entity"],
-                "length_mention": candidate["length_mention"],
-                "length_entity": candidate["length_entity"],
-                "popularity": candidate["popularity"],
-                "pos_score": candidate["pos_score"],
-                "es_score": candidate["es_score"],
-                "ed_score": candidate["ed_score"],
-                "jaccard_score": candidate["jaccard_score"],
-                "jaccardNgram_score": candidate["jaccardNgram_score"],
-                #"cosine_similarity": candidate["cosine_similarity"], deprecated
-                "p_subj_ne": 0,
-                "p_subj_lit_datatype": 0,
-                "p_subj_lit_all_datatype": 0,
-                "p_subj_lit_row": 0,
-                "p_obj_ne": 0,
-                "desc": desc_score,
-                "descNgram": desc_score_ngram,
-                "cta_t1": 0,
-                "cta_t2": 0,
-                "cta_t3": 0,
-                "cta_t4": 0,
-                "cta_t5": 0,
-                "cpa_t1": 0,
-                "cpa_t2": 0,
-                "cpa_t3": 0,
-                "cpa_t4": 0,
-                "cpa_t5": 0
-            }
-
-           
+            # a candidate returned twice keeps the features of its best matching label
             replace = False
             if id_candidate in candidates_dict:
-                score = candidates_dict[id_candidate]["features"]["ed"] + candidates_dict[id_candidate]["features"]["jaccard"]
-                if (features["ed"] + features["jaccard"]) > score:
+                score = candidate["ed_score"] + candidate["jaccard_score"]
+                if score > candidates_dict[id_candidate]["ed_score"] + candidates_dict[id_candidate]["jaccard_score"]:
                     replace = True
-            
+
             if id_candidate not in candidates_dict or replace:
-                candidates_dict[id_candidate] = { 
-                    "id": id_candidate,
-                    "name": name_norm,
-                    "description": desc_norm, 
-                    "types": candidate["types"], 
-                    "features": features,
-                    "matches": {str(id_col):[] for id_col in range(n_cols)},
-                    "predicates": {str(id_col):{} for id_col in range(n_cols)},
-                    "match": False
-                }
+                candidates_dict[id_candidate] = candidate
+
+        descriptions = [utils.clean_str(candidate["description"]) for candidate in candidates_dict.values()]
+        desc_scores, desc_ngram_scores = self._store.description_similarity.scores(descriptions, utils.clean_str(row_content))
+
+        self._start = len(self._column)
+        for i, (id_candidate, candidate) in enumerate(candidates_dict.items()):
+            features = [0] * len(FEATURES)
+            for feature, key in LOOKUP_FEATURES.items():
+                features[FEATURE_INDEX[feature]] = candidate[key]
+            features[FEATURE_INDEX["desc"]] = desc_scores[i]
+            features[FEATURE_INDEX["descNgram"]] = desc_ngram_scores[i]
+            self._column.append(self._store.intern(id_candidate), features, utils.clean_str(candidate["name"]), descriptions[i], candidate["types"])
+        self._end = len(self._column)
+
+    def n_candidates(self):
+        return self._end - self._start
+
+    def ids(self):
+        """
+        :return: Ids of the candidates, in their current order.
+        """
+        return [self._store.entities[entity] for entity in self._column.ids[self._start:self._end]]
+
+    def entity_ids(self):
+        """
+        :return: Interned ids of the candidates, a view of the store.
+        """
+        return self._column.ids[self._start:self._end]
+
+    def features(self):
+        """
+        :return: Feature matrix of the candidates, a view written in place.
+        """
+        return self._column.features[self._start:self._end]
 
-        self._candidates = list(candidates_dict.values())
-           
+    def types(self, index):
+        return self._column.types[self._start + index]
 
-    def candidates(self):
-        return self._candidates
+    def matches(self, index):
+        """
+        :return: Matches of the candidate, id_col -> list of {"p", "o", "s"}; only columns with matches are present.
+        """
+        return self._column.matches[self._start + index] or {}
 
+    def predicates(self, index):
+        """
+        :return: Predicates of the candidate, id_col -> {predicate: score}; only columns with matches are present.
+        """
+        return self._column.predicates[self._start + index] or {}
+
+    def add_match(self, index, id_col, predicate, value, score):
+        position = self._start + index
+        if self._column.matches[position] is None:
+            self._column.matches[position] = {}
+        self._column.matches[position].setdefault(str(id_col), []).append({"p": predicate, "o": value, "s": score})
+
+    def set_predicate(self, index, id_col, predicate, score):
+        position = self._start + index
+        if self._column.predicates[position] is None:
+            self._column.predicates[position] = {}
+        self._column.predicates[position].setdefault(str(id_col), {})[predicate] = score
+
+    def scores(self, name):
+        """
+        :return: Scores (e.g. rho) of the candidates, a view written in place.
+        """
+        return self._column.get_scores(name)[self._start:self._end]
+
+    def sort_by(self, name):
+        """
+        Sorts the candidates by decreasing score, ties keep their order.
+        """
+        order = np.argsort(-self.scores(name), kind="stable")
+        self._column.permute(self._start, self._end, order)
+
+    def candidate(self, index):
+        """
+        :return: The candidate as a dictionary, as stored in the results, with matches and predicates for every column.
+        """
+        position = self._start + index
+        features = self._column.features[position]
+        matches = {str(id_col): [] for id_col in range(self._n_cols)}
+        matches.update(self._column.matches[position] or {})
+        predicates = {str(id_col): {} for id_col in range(self._n_cols)}
+        predicates.update(self._column.predicates[position] or {})
+        candidate = {
+            "id": self._store.entities[self._column.ids[position]],
+            "name": self._column.names[position],
+            "description": self._column.descriptions[position],
+            "types": self._column.types[position],
+            "features": {feature: float(features[i]) for i, feature in enumerate(FEATURES)},
+            "matches": matches,
+            "predicates": predicates,
+            "match": False
+        }
+        for name, scores in self._column.scores.items():
+            candidate[name] = float(scores[position])
+        return candidate
+
+    def candidates(self, limit=None):
+        """
+        :return: The first limit candidates (all if None) as dictionaries.
+        """
+        n = self.n_candidates() if limit is None else min(limit, self.n_candidates())
+        return [self.candidate(i) for i in range(n)]
+
+    def _index(self, id_entity):
+        ids = self.ids()
+        return ids.index(id_entity) if id_entity in ids else None
 
     def candidates_name(self, id_entity):
-        return self._candidates.get(id_entity, {}).get("name")
+        index = self._index(id_entity)
+        return self._column.names[self._start + index] if index is not None else None
+
 
-    
     def candidates_description(self, id_entity):
-        return self._candidates.get(id_entity, {}).get("description")
+        index = self._index(id_entity)
+        return self._column.descriptions[self._start + index] if index is not None else None
+
 
-    
     def candidates_types(self, id_entity):
-        return self._candidates.get(id_entity, {}).get("types")
+        index = self._index(id_entity)
+        return self.types(index) if index is not None else None
 
 
     def candidates_ed(self, id_entity):
-        return self._candidates.get(id_entity, {}).get("ed")    
+        index = self._index(id_entity)
+        return float(self.features()[index, FEATURE_INDEX["ed_score"]]) if index is not None else None
 
 
     def get_id_candidates_entities(self):
-        return list(self._candidates.keys())    
+        return self.ids()
 
 
     def get_set_id_candidates_entities(self):
-        return set(self._candidates.keys())    
-        
\ No newline at end of file
+        return set(self.ids())
@@ -1,25 +1,26 @@
 from model.cell import Cell
 
 class Row:
-    def __init__(self, id_row, n_cols):
+    def __init__(self, id_row, n_cols, store):
         self._id_row = id_row
         self.subject_cell = None
         self.cells = []
         self._n_cols = n_cols
+        self._store = store  # CandidateStore shared by the rows of a chunk
 
     def add_ne_cell(self, content: str, row_content: str, candidates: list, id_col: int, is_subject=False):
-        cell = Cell(content, row_content, candidates, id_col, self._n_cols)
+        cell = Cell(content, row_content, candidates, id_col, self._n_cols, store=self._store)
         self.cells.append(cell)
 
         if is_subject:
             self.subject_cell = cell
 
     def add_lit_cell(self, content: str,  id_col: int, datatype: str):
-        cell = Cell(content, "", [], id_col, self._n_cols, True, datatype=datatype)
+        cell = Cell(content, "", [], id_col, self._n_cols, True, datatype=datatype, store=self._store)
         self.cells.append(cell)
     
     def add_notag_cell(self, content: str, id_col: int):
-        cell = Cell(content, "", [], id_col, self._n_cols, is_notag_cell=True)
+        cell = Cell(content, "", [], id_col, self._n_cols, is_notag_cell=True, store=self._store)
         self.cells.append(cell)
 
     def get_subject_cell(self):
@@ -0,0 +1,100 @@
+import os
+import random
+import threading
+
+CANDIDATE_TOP_K = int(os.environ.get("CANDIDATE_TOP_K", 0))  # candidates kept for each cell, 0 for the candidateSize of the table
+CANDIDATE_PRUNING_WEIGHTS = os.environ.get(
+    "CANDIDATE_PRUNING_WEIGHTS", "es_score:1,ed_score:1,jaccard_score:1,jaccardNgram_score:1,popularity:0.5"
+)
+CANDIDATE_PRUNING_AUDIT = float(os.environ.get("CANDIDATE_PRUNING_AUDIT", 0.02))  # fraction of the chunks audited
+
+
+def parse_weights(weights):
+    """
+    Parse "feature:weight,feature:weight" into a dictionary.
+    """
+    parsed = {}
+    for item in weights.split(","):
+        if item.strip() == "":
+            continue
+        feature, weight = item.split(":")
+        parsed[feature.strip()] = float(weight)
+    return parsed
+
+
+class CandidatePruning:
+    """
+    Keeps the top-k candidates of a cell by a weighted sum of the cheap scores
+    returned by the lookup, before the cell features are built and the objects
+    and literals of the candidates are fetched.
+
+    The recall given up is measured on a sample of audited chunks, which are
+    processed without pruning: an audited cell is retained if its final winning
+    candidate would have survived the pruning.
+    """
+    def __init__(self, top_k=CANDIDATE_TOP_K, weights=CANDIDATE_PRUNING_WEIGHTS, audit_rate=CANDIDATE_PRUNING_AUDIT):
+        """
+        Initialize the CandidatePruning.
+
+        :param top_k: Candidates kept for each cell, at most the candidate size of the table; 0 to use the candidate size.
+        :param weights: Weights of the lookup scores, as "feature:weight,...".
+        :param audit_rate: Fraction of the chunks processed without pruning to measure the recall.
+        """
+        self._top_k = top_k
+        self._weights = parse_weights(weights)
+        self._audit_rate = audit_rate
+        self._stats = {"candidates": 0, "kept": 0, "auditedCells": 0, "retainedWinners": 0}
+        self._lock = threading.Lock()  # the audits are recorded by the inference thread of the pipelined mode
+
+    def score(self, candidate):
+        return sum(weight * (candidate.get(feature) or 0) for feature, weight in self._weights.items())
+
+    def prune(self, candidates, candidate_size=None):
+        """
+        :param candidates: Candidates of a cell returned by the lookup.
+        :param candidate_size: Candidate size of the table, caps top_k.
+        :return: The kept candidates, in their original order.
+        """
+        top_k = min([k for k in (self._top_k, candidate_size) if k] or [len(candidates)])
+        n_candidates = len(candidates)
+        if len(candidates) > top_k:
+            best = sorted(range(len(candidates)), key=lambda i: self.score(candidates[i]), reverse=True)[:top_k]
+            candidates = [candidates[i] for i in sorted(best)]
+        with self._lock:
+            self._stats["candidates"] += n_candidates
+            self._stats["kept"] += len(candidates)
+        return candidates
+
+    def audit(self):
+        """
+        :return: True if the next chunk should be audited.
+        """
+        return random.random() < self._audit_rate
+
+    def record_audit(self, rows, kept_ids):
+        """
+        Compares the winning candidates of an audited chunk with the candidates the pruning would have kept.
+
+        :param rows: Rows of the chunk, with candidates sorted by final score.
+        :param kept_ids: Dictionary (id_row, id_col) -> set of the ids of the kept candidates.
+        """
+        audited_cells = 0
+        retained_winners = 0
+        for row in rows:
+            for cell in row.get_ne_cells():
+                key = (row._id_row, cell._id_col)
+                if key not in kept_ids or cell.n_candidates() == 0:
+                    continue
+                audited_cells += 1
+                if cell.ids()[0] in kept_ids[key]:
+                    retained_winners += 1
+        with self._lock:
+            self._stats["auditedCells"] += audited_cells
+            self._stats["retainedWinners"] += retained_winners
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats["keptRatio"] = round(stats["kept"] / stats["candidates"], 4) if stats["candidates"] > 0 else None
+        stats["recall"] = round(stats["retainedWinners"] / stats["auditedCells"], 4) if stats["auditedCells"] > 0 else None
+        return stats
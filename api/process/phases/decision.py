@@ -39,9 +39,9 @@ class Decision:
             cea = {}
             rankend_candidates = []
             for cell in row.get_cells():
-                candidates = cell.candidates()
+                candidates = cell.candidates(20)
                 wc = []
-                rank = candidates[0:20] if len(candidates) > 0 else []
+                rank = candidates
                 if len(candidates) > 0:
                     if len(candidates) > 1:
                         candidates[0]["delta"] = round(candidates[0]["rho'"] - candidates[1]["rho'"], 3)
@@ -1,3 +1,6 @@
+from model.candidates import FEATURE_INDEX, feature_matrices
+
+
 class FeaturesExtractionRevision:
     """
     Class for extracting features from rows of data.
@@ -34,23 +37,24 @@ class FeaturesExtractionRevision:
         Returns:
             list: List of features for each column.
         """
-        features = [[] for _ in range(len(self._rows[0]))]
         for row in self._rows:
             for cell in row.get_cells():
                 id_col = str(cell._id_col)
-                for candidate in cell.candidates():
+                features = cell.features()
+                for index in range(cell.n_candidates()):
                     candidate_types_freq = {}
-                    for t in candidate["types"]:
+                    for t in cell.types(index):
                         if t["id"] in self._cta[id_col]:
                             candidate_types_freq[t["id"]] = self._cta[id_col][t["id"]]
 
                     predicates = {}
-                    for id_col_pred in candidate["predicates"]:
-                        for id_predicate in candidate["predicates"][id_col_pred]:
+                    candidate_predicates = cell.predicates(index)
+                    for id_col_pred in candidate_predicates:
+                        for id_predicate in candidate_predicates[id_col_pred]:
                             if id_predicate not in predicates:
                                 predicates[id_predicate] = 0
-                            if candidate["predicates"][id_col_pred][id_predicate] > predicates[id_predicate]:
-                                predicates[id_predicate] = candidate["predicates"][id_col_pred][id_predicate]
+                            if candidate_predicates[id_col_pred][id_predicate] > predicates[id_predicate]:
+                                predicates[id_predicate] = candidate_predicates[id_col_pred][id_predicate]
 
                     candidate_predicates_freq = {}
                     for id_predicate in predicates:
@@ -64,17 +68,15 @@ class FeaturesExtractionRevision:
                         freq = 0
                         if i < len(candidate_types_freq):
                             freq = candidate_types_freq[i][1]
-                        candidate["features"][f"cta_t{i+1}"] = round(freq, 3)
+                        features[index, FEATURE_INDEX[f"cta_t{i+1}"]] = round(freq, 3)
 
                     for i in range(0, 5):
                         freq = 0
                         if i < len(candidate_predicates_freq):
                             freq = candidate_predicates_freq[i][1]
-                        candidate["features"][f"cpa_t{i+1}"] = round(freq, 3)
-
-                    features[int(id_col)].append(list(candidate["features"].values()))
+                        features[index, FEATURE_INDEX[f"cpa_t{i+1}"]] = round(freq, 3)
 
-        return features
+        return feature_matrices(self._rows)
 
     def _compute_cta_and_cpa_freq(self):
         """
@@ -84,8 +86,12 @@ class FeaturesExtractionRevision:
             for cell in row.get_cells():
                 id_col = str(cell._id_col)
                 history = set()
-                for candidate in cell.candidates()[0:3]:
-                    types = candidate["types"]
+                if cell.n_candidates() > 0:
+                    # predicates are sparse, the pairs keep an entry for every column as the candidates used to
+                    for id_col_rel in self._cpa_pair:
+                        self._cpa_pair[id_col].setdefault(id_col_rel, {})
+                for index in range(min(3, cell.n_candidates())):
+                    types = cell.types(index)
                     for t in types:
                         id_type = t["id"]
                         if id_type in history:
@@ -95,7 +101,7 @@ class FeaturesExtractionRevision:
                         self._cta[id_col][id_type] += 1
                         history.add(id_type)
 
-                    predicates = candidate["predicates"]
+                    predicates = cell.predicates(index)
                     for id_col_rel in predicates:
                         if id_col_rel not in self._cpa_pair[id_col]:
                             self._cpa_pair[id_col][id_col_rel] = {}
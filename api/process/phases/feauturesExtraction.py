@@ -1,125 +1,185 @@
 import asyncio
+import os
+import numpy as np
+import scipy.sparse as sparse
 import utils.metrics as metrics
 import utils.utils as utils
+from model.candidates import FEATURE_INDEX, feature_matrices
+
+PREFETCH_BATCH_SIZE = int(os.environ.get("PREFETCH_BATCH_SIZE", 500))  # candidate ids of each objects/literals request
+
+STRING_SIMILARITY = [FEATURE_INDEX[f] for f in ["ed_score", "jaccard_score", "jaccardNgram_score"]]
 
 class FeauturesExtraction:
-    def __init__(self, rows, lamAPI):
+    def __init__(self, rows, lamAPI, batch_size=PREFETCH_BATCH_SIZE):
         self._rows = rows
         self._lamAPI = lamAPI
-        self._cache_obj = {}
-        self._cache_lit = {}
-        self._lock_obj = asyncio.Lock()  # Lock for cache_obj
-        self._lock_lit = asyncio.Lock()  # Lock for cache_lit
-        
+        self._batch_size = batch_size
+        self._cache_obj = {}  # id -> objects of the candidate, filled by the prefetch
+        self._cache_lit = {}  # id -> literals of the candidate, filled by the prefetch
+        self._ne_matches = {}  # (subject cell, object column) -> matches of the subject candidates, by index
 
-    # async def compute_feautures(self):
-    #     for row in self._rows:
-    #         ne_cells = row.get_ne_cells()
-    #         lit_cells = row.get_lit_cells()
-    #         cells = row.get_cells()
-    #         tasks = []
-    #         for ne_cell in ne_cells:
-    #             for cell in cells:
-    #                 if cell == ne_cell:
-    #                     continue
-    #                 elif cell.is_lit_cell:
-    #                     tasks.append(asyncio.create_task(self._match_lit_cells(ne_cell, cell, row, len(lit_cells))))
-    #                     #self._match_lit_cells(ne_cell, cell, row, len(lit_cells))
-    #                 else:
-    #                     tasks.append(asyncio.create_task(self._compute_similarity_between_ne_cells(ne_cell, cell, len(ne_cells))))
-    #                     #self._compute_similarity_between_ne_cells(ne_cell, cell, len(ne_cells))
-    #         await asyncio.gather(*tasks)    
-    #     return self._extract_features()
-        
     async def compute_feautures(self):
-        tasks = []
+        await self._prefetch()
+        self._compute_ne_relations()
         for row in self._rows:
             ne_cells = row.get_ne_cells()
             lit_cells = row.get_lit_cells()
             cells = row.get_cells()
-            tasks.append(asyncio.create_task(self._compute_rows(ne_cells, lit_cells, cells, row)))
-            
-        await asyncio.gather(*tasks)    
-        
+            self._compute_rows(ne_cells, lit_cells, cells, row)
         return self._extract_features()
 
-    async def _compute_rows(self, ne_cells, lit_cells, cells, row):
-        tasks = []
+    async def _prefetch(self):
+        """
+        Fetches the objects and the literals of all the candidates of the chunk that
+        are matched against other cells, in concurrent batches of at most batch_size
+        ids, so the matching of the cells runs in memory.
+        """
+        objects_ids = {}
+        literals_ids = {}
+        for row in self._rows:
+            ne_cells = row.get_ne_cells()
+            has_lit_cells = len(row.get_lit_cells()) > 0
+            for ne_cell in ne_cells:
+                ids = dict.fromkeys(ne_cell.ids())
+                if len(ne_cells) > 1:
+                    objects_ids.update(ids)
+                if has_lit_cells:
+                    literals_ids.update(ids)
+
+        objects, literals = await asyncio.gather(
+            self._fetch(self._lamAPI.objects, list(objects_ids)),
+            self._fetch(self._lamAPI.literals, list(literals_ids))
+        )
+        self._cache_obj = {id_entity: (objects.get(id_entity) or {}).get("objects", {}) for id_entity in objects_ids}
+        self._cache_lit = {id_entity: (literals.get(id_entity) or {}).get("literals", {}) for id_entity in literals_ids}
+
+    async def _fetch(self, endpoint, ids):
+        batches = [ids[i:i + self._batch_size] for i in range(0, len(ids), self._batch_size)]
+        results = {}
+        for result in await asyncio.gather(*[endpoint(batch) for batch in batches]):
+            results.update(result)
+        return results
+
+    def _compute_rows(self, ne_cells, lit_cells, cells, row):
         for ne_cell in ne_cells:
             for cell in cells:
                 if cell == ne_cell:
                     continue
                 elif cell.is_lit_cell:
-                    await self._match_lit_cells(ne_cell, cell, row, len(lit_cells))
-                    #tasks.append(asyncio.create_task(self._match_lit_cells(ne_cell, cell, row, len(lit_cells))))
+                    self._match_lit_cells(ne_cell, cell, row, len(lit_cells))
                 else:
-                    await self._compute_similarity_between_ne_cells(ne_cell, cell, len(ne_cells))
-                    #tasks.append(asyncio.create_task(self._compute_similarity_between_ne_cells(ne_cell, cell, len(ne_cells))))
-        #await asyncio.gather(*tasks)                         
+                    self._add_ne_matches(ne_cell, cell)
 
     def _extract_features(self):
-        features = [[] for _ in range(len(self._rows[0]))]
+        return feature_matrices(self._rows)
+
+
+    @staticmethod
+    def _similarity(cell):
+        """
+        Mean of the string similarities of every candidate, the relatedness score of its matches.
+        """
+        similarity = cell.features()[:, STRING_SIMILARITY].sum(axis=1) / len(STRING_SIMILARITY)
+        return [round(float(score), 3) for score in similarity]
+
+    def _relations_matrix(self, store):
+        """
+        Sparse entity x entity matrix of the chunk, 1 where the object is in the
+        objects of the subject; entities are the interned ids of the candidates.
+        """
+        subjects, objects = [], []
+        for id_subject, subject_objects in self._cache_obj.items():
+            subject = store.index(id_subject)
+            for id_object in subject_objects:
+                obj = store.index(id_object)
+                if subject is not None and obj is not None:
+                    subjects.append(subject)
+                    objects.append(obj)
+        n_entities = len(store.entities)
+        return sparse.csr_matrix((np.ones(len(subjects)), (subjects, objects)), shape=(n_entities, n_entities))
+
+    def _compute_ne_relations(self):
+        """
+        Relatedness features (p_subj_ne, p_obj_ne) of the candidates of every pair of
+        NE columns, from the subject x object candidates adjacency of the whole chunk.
+        The matches are kept to be added to the candidates in cell order.
+        """
+        pairs = {}  # (subject column, object column) -> (subject cell, object cell, NE cells of the row) of every row
         for row in self._rows:
-            for cell in row.get_cells():
-                for candidate in cell.candidates():
-                    features[cell._id_col].append(list(candidate["features"].values()))
-        return features    
-
-
-    async def _compute_similarity_between_ne_cells(self, subj_cell, obj_cell, nNE_cells):
-        async with self._lamAPI.semaphore:
-
-            subj_id_candidates = [candidate["id"] for candidate in subj_cell.candidates() if candidate["id"] not in self._cache_obj]
-
-            if len(subj_id_candidates) > 0:
-                subjects_objects = await self._lamAPI.objects(subj_id_candidates)
-
-            object_rel_score_buffer = {}
-            for subj_candidate in subj_cell.candidates():
-                id_subject = subj_candidate["id"]
-
-                async with self._lock_obj:
-                    if id_subject not in self._cache_obj:
-                        subj_candidates_objects = subjects_objects.get(id_subject, {}).get("objects", {})
-                        self._cache_obj[id_subject] = subj_candidates_objects
-                    else:    
-                        subj_candidates_objects = self._cache_obj.get(id_subject, {})
-                        
-                objects_set = set(subj_candidates_objects.keys())
-                obj_score_max = 0
-                objects_itersection = objects_set.intersection(set([candidate["id"] for candidate in obj_cell.candidates()]))
-                for obj_candidate in obj_cell.candidates():
-                    id_object = obj_candidate["id"] 
-                    if id_object not in objects_itersection:
-                        continue
-                    
-                    string_similarity_features = [obj_candidate["features"][f] for f in ["ed_score", "jaccard_score", "jaccardNgram_score"]]
-                    p_subj_ne = round(sum(string_similarity_features) / len(string_similarity_features), 3)
-
-                    if p_subj_ne > obj_score_max:
-                        obj_score_max = p_subj_ne
-                    
-                    if id_object not in object_rel_score_buffer:
-                        object_rel_score_buffer[id_object] = 0
-                    
-                    string_similarity_features = [subj_candidate["features"][f] for f in ["ed_score", "jaccard_score", "jaccardNgram_score"]]
-                    score_rel = round(sum(string_similarity_features) / len(string_similarity_features), 3)
-                    if score_rel > object_rel_score_buffer[id_object]:
-                        object_rel_score_buffer[id_object] = score_rel
-                    for predicate in subj_candidates_objects[id_object]:
-                        subj_candidate["matches"][str(obj_cell._id_col)].append({
-                            "p": predicate,
-                            "o": id_object,
-                            "s": round(p_subj_ne, 3)
-                        })
-                        subj_candidate["predicates"][str(obj_cell._id_col)][predicate] = p_subj_ne
-                subj_candidate["features"]["p_subj_ne"] += round(obj_score_max/ nNE_cells, 3)
-            
-            for obj_candidate in obj_cell.candidates():
-                id_object = obj_candidate["id"]  
-                if id_object not in object_rel_score_buffer:
+            ne_cells = row.get_ne_cells()
+            for subj_cell in ne_cells:
+                for obj_cell in ne_cells:
+                    if obj_cell != subj_cell:
+                        pairs.setdefault((subj_cell._id_col, obj_cell._id_col), []).append((subj_cell, obj_cell, len(ne_cells)))
+        if len(pairs) == 0:
+            return
+        store = self._rows[0].get_cells()[0]._store
+        if any(cell._store is not store for row in self._rows for cell in row.get_cells()):
+            raise ValueError("The rows of a chunk must share one CandidateStore")
+        relations = self._relations_matrix(store)
+        for cells in pairs.values():
+            self._relate_columns(store, relations, cells)
+
+    def _relate_columns(self, store, relations, cells):
+        """
+        :param cells: (subject cell, object cell, NE cells of the row) of every row.
+        """
+        n_entities = len(store.entities)
+        subj_sizes = np.array([subj_cell.n_candidates() for subj_cell, _, _ in cells], dtype=np.int64)
+        obj_sizes = np.array([obj_cell.n_candidates() for _, obj_cell, _ in cells], dtype=np.int64)
+        if subj_sizes.sum() == 0 or obj_sizes.sum() == 0:
+            return
+        subj_entities = np.concatenate([subj_cell.entity_ids() for subj_cell, _, _ in cells])
+        obj_entities = np.concatenate([obj_cell.entity_ids() for _, obj_cell, _ in cells])
+        subj_similarity = np.array([score for subj_cell, _, _ in cells for score in self._similarity(subj_cell)])
+        obj_similarity = np.array([score for _, obj_cell, _ in cells for score in self._similarity(obj_cell)])
+        subj_rows = np.repeat(np.arange(len(cells)), subj_sizes)
+        obj_rows = np.repeat(np.arange(len(cells)), obj_sizes)
+
+        # objects of every subject candidate, keyed by (row, entity) so only the candidates of the same row match
+        subj_objects = relations[subj_entities]
+        keys = subj_objects.indices + np.repeat(subj_rows * n_entities, np.diff(subj_objects.indptr))
+        subj_objects = sparse.csr_matrix((subj_objects.data, keys, subj_objects.indptr), shape=(len(subj_entities), len(cells) * n_entities))
+        obj_keys = sparse.csr_matrix(
+            (np.ones(len(obj_entities)), (np.arange(len(obj_entities)), obj_rows * n_entities + obj_entities)),
+            shape=(len(obj_entities), len(cells) * n_entities)
+        )
+        adjacency = (subj_objects @ obj_keys.T).tocsr()  # subject candidates x object candidates of the same row
+        adjacency.sort_indices()
+
+        obj_score_max = adjacency.multiply(obj_similarity[np.newaxis, :]).tocsr().max(axis=1).toarray().ravel()
+        subj_score_max = adjacency.multiply(subj_similarity[:, np.newaxis]).tocsc().max(axis=0).toarray().ravel()
+        subj_offsets = np.concatenate([[0], np.cumsum(subj_sizes)])
+        obj_offsets = np.concatenate([[0], np.cumsum(obj_sizes)])
+        for k, (subj_cell, obj_cell, nNE_cells) in enumerate(cells):
+            subj_range = range(subj_offsets[k], subj_offsets[k + 1])
+            obj_range = range(obj_offsets[k], obj_offsets[k + 1])
+            if len(subj_range) > 0:
+                subj_cell.features()[:, FEATURE_INDEX["p_subj_ne"]] += [round(float(obj_score_max[i]) / nNE_cells, 3) for i in subj_range]
+            if len(obj_range) > 0:
+                obj_cell.features()[:, FEATURE_INDEX["p_obj_ne"]] += [round(float(subj_score_max[j]) / nNE_cells, 3) for j in obj_range]
+
+            subj_ids = subj_cell.ids()
+            matches = {}
+            for i in subj_range:
+                related = adjacency.indices[adjacency.indptr[i]:adjacency.indptr[i + 1]]
+                if len(related) == 0:
                     continue
-                obj_candidate["features"]["p_obj_ne"] += round(object_rel_score_buffer[id_object]/nNE_cells, 3)  
+                id_subject = subj_ids[i - subj_offsets[k]]
+                matches[i - subj_offsets[k]] = [
+                    (store.entities[obj_entities[j]], float(obj_similarity[j]), self._cache_obj[id_subject][store.entities[obj_entities[j]]])
+                    for j in related
+                ]
+            self._ne_matches[(subj_cell, obj_cell._id_col)] = matches
+
+    def _add_ne_matches(self, subj_cell, obj_cell):
+        matches = self._ne_matches.get((subj_cell, obj_cell._id_col), {})
+        for subj_index, related in matches.items():
+            for id_object, p_subj_ne, predicates in related:
+                for predicate in predicates:
+                    subj_cell.add_match(subj_index, obj_cell._id_col, predicate, id_object, round(p_subj_ne, 3))
+                    subj_cell.set_predicate(subj_index, obj_cell._id_col, predicate, p_subj_ne)
 
     
     def _get_literal_values_string(self, subj_literals):
@@ -133,71 +193,55 @@ class FeauturesExtraction:
         return " ".join(lit_strings)
 
 
-    async def _match_lit_cells(self, subj_cell, obj_cell, row, nLIT_cells):
-        async with self._lamAPI.semaphore:
-
-            def get_score_based_on_datatype(valueInCell, valueFromKG, datatype):
-                score = 0
-                valueFromKG = str(valueFromKG)
-                if datatype == "NUMBER":
-                    score = metrics.compute_similarty_between_numbers(valueInCell, valueFromKG.lower())
-                elif datatype == "DATETIME":
-                    score = metrics.compute_similarity_between_dates(valueInCell, valueFromKG.lower())
-                elif datatype == "STRING":
-                    score = metrics.compute_similarity_between_string(valueInCell, valueFromKg.lower())
-                return score
+    def _match_lit_cells(self, subj_cell, obj_cell, row, nLIT_cells):
+        def get_score_based_on_datatype(valueInCell, valueFromKG, datatype):
+            score = 0
+            valueFromKG = str(valueFromKG)
+            if datatype == "NUMBER":
+                score = metrics.compute_similarty_between_numbers(valueInCell, valueFromKG.lower())
+            elif datatype == "DATETIME":
+                score = metrics.compute_similarity_between_dates(valueInCell, valueFromKG.lower())
+            elif datatype == "STRING":
+                score = metrics.compute_similarity_between_string(valueInCell, valueFromKg.lower())
+            return score
 
+    
+        subj_ids = subj_cell.ids()
+        # no literal for any of the candidates (or LamAPI did not answer)
+        if all(len(self._cache_lit.get(id_subject, {})) == 0 for id_subject in subj_ids):
+            return
+            
+        datatype = obj_cell.datatype
+        subj_features = subj_cell.features()
+        row_text_all = utils.clean_str(row.get_text())
+        row_text_lit = utils.clean_str(row.get_text({"LIT"}))
         
-            subj_id_candidates = [candidate["id"] for candidate in subj_cell.candidates() if candidate["id"] not in self._cache_lit]
-            if len(subj_id_candidates) > 0:
-                subjects_literals = await self._lamAPI.literals(subj_id_candidates)
-                if len(subjects_literals) == 0:
-                    return
-                
-            datatype = obj_cell.datatype
+        for subj_index, id_subject in enumerate(subj_ids):
+            subj_literals = self._cache_lit.get(id_subject, {})
+            lit_string = self._get_literal_values_string(subj_literals)
+            p_subj_lit_all_datatype = metrics.compute_similarity_between_string_token_based(lit_string, row_text_lit)
+            p_subj_lit_row = metrics.compute_similarity_between_string_token_based(lit_string, row_text_all)
+            subj_features[subj_index, FEATURE_INDEX["p_subj_lit_all_datatype"]] = round(p_subj_lit_all_datatype, 3)
+            subj_features[subj_index, FEATURE_INDEX["p_subj_lit_row"]] = round(p_subj_lit_row, 3)
+
+            new_datatype = datatype
+
+            if datatype.lower() in subj_literals:
+                new_datatype = datatype.lower()
             
-            for subj_candidate in subj_cell.candidates():
-                id_subject = subj_candidate["id"]
-
-                async with self._lock_lit:            
-                    if id_subject not in self._cache_lit:
-                        subj_literals = subjects_literals.get(id_subject, {}).get("literals", {})
-                        self._cache_lit[id_subject] = subj_literals
-                    else:   
-                        subj_literals = self._cache_lit.get(id_subject, {})
-                    
-                lit_string = self._get_literal_values_string(subj_literals)
-                row_text_all = utils.clean_str(row.get_text())
-                row_text_lit = utils.clean_str(row.get_text({"LIT"}))
-                p_subj_lit_all_datatype = metrics.compute_similarity_between_string_token_based(lit_string, row_text_lit)
-                p_subj_lit_row = metrics.compute_similarity_between_string_token_based(lit_string, row_text_all)
-                subj_candidate["features"]["p_subj_lit_all_datatype"] = round(p_subj_lit_all_datatype, 3)
-                subj_candidate["features"]["p_subj_lit_row"] = round(p_subj_lit_row, 3)
-
-                new_datatype = datatype
-
-                if datatype.lower() in subj_literals:
-                    new_datatype = datatype.lower()
-                
-                if new_datatype not in subj_literals or len(subj_literals[new_datatype]) == 0:
-                    continue
-
-                max_score = 0
-                for predicate in subj_literals[new_datatype]:
-                    for valueFromKg in subj_literals[new_datatype][predicate]:
-                        p_subj_lit = get_score_based_on_datatype(obj_cell.content, valueFromKg, datatype)
-                        p_subj_lit = round(p_subj_lit, 3)
-                        if p_subj_lit > 0:
-                            subj_candidate["matches"][str(obj_cell._id_col)].append({
-                                "p": predicate,
-                                "o": valueFromKg,
-                                "s": p_subj_lit
-                            })  
-                            if p_subj_lit > max_score:
-                                max_score = p_subj_lit
-                            if predicate not in subj_candidate["predicates"][str(obj_cell._id_col)]:
-                                subj_candidate["predicates"][str(obj_cell._id_col)][predicate] = 0
-                            if p_subj_lit > subj_candidate["predicates"][str(obj_cell._id_col)][predicate]:
-                                subj_candidate["predicates"][str(obj_cell._id_col)][predicate] = p_subj_lit    
-                                
-                subj_candidate["features"]["p_subj_lit_datatype"] += round(max_score/nLIT_cells, 3)
+            if new_datatype not in subj_literals or len(subj_literals[new_datatype]) == 0:
+                continue
+
+            max_score = 0
+            for predicate in subj_literals[new_datatype]:
+                for valueFromKg in subj_literals[new_datatype][predicate]:
+                    p_subj_lit = get_score_based_on_datatype(obj_cell.content, valueFromKg, datatype)
+                    p_subj_lit = round(p_subj_lit, 3)
+                    if p_subj_lit > 0:
+                        subj_cell.add_match(subj_index, obj_cell._id_col, predicate, valueFromKg, p_subj_lit)
+                        if p_subj_lit > max_score:
+                            max_score = p_subj_lit
+                        if p_subj_lit > subj_cell.predicates(subj_index).get(str(obj_cell._id_col), {}).get(predicate, 0):
+                            subj_cell.set_predicate(subj_index, obj_cell._id_col, predicate, p_subj_lit)
+                            
+            subj_features[subj_index, FEATURE_INDEX["p_subj_lit_datatype"]] += round(max_score/nLIT_cells, 3)
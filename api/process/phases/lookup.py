@@ -1,10 +1,14 @@
 import asyncio
 import traceback
 from model.row import Row
+from model.candidates import CandidateStore
+
+LOOKUP_LIMIT = 100  # candidates requested for each mention
 
  
 class Lookup:
-    def __init__(self, data:object, lamAPI, target, log_c, kg_ref="wikidata", limit=100):
+    def __init__(self, data:object, lamAPI, target, log_c, kg_ref="wikidata", limit=100, cache=None, pruning=None, audit=False,
+                 constraints=None, constrained_limit=20):
         self._header = data.get("header", [])
         self._dataset_name = data["datasetName"]
         self._table_name = data["tableName"]
@@ -16,31 +20,101 @@ class Lookup:
         self._limit = limit
         self._rows_data = data["rows"]
         self._rows = []
-        self._cache = {}
+        self.store = CandidateStore()  # candidates of all the rows, by column
+        self._cache = cache if cache is not None else {}  # can be shared by the chunks of a batch
+        self._pruning = pruning  # CandidatePruning applied to the candidates of every cell, optional
+        self._audit = audit  # if True candidates are not pruned, the ones that would be kept are recorded
+        self.pruning_audit = {}  # (id_row, id_col) -> ids of the candidates kept by the pruning
+        self._constraints = constraints or {}  # id_col -> types the lookups of the column are restricted to
+        self._constrained_limit = constrained_limit
+        self.constraint_stats = {"typedMentions": 0, "fallbacks": 0}
        
     async def generate_candidates(self):
-        tasks = []
+        await self._fetch_candidates()
         for row in self._rows_data:
-            tasks.append(asyncio.create_task(self._build_row(row["data"], row["idRow"])))
-        results = await asyncio.gather(*tasks)
-        for row in results:
-            self._rows.append(row)
+            self._rows.append(self._build_row(row["data"], row["idRow"]))
+
+    def _cache_key(self, cell, id_col):
+        types = self._constraints.get(str(id_col))
+        return cell if types is None else (cell, " ".join(types))
+
+    async def _lookup_many(self, mentions, types=None, limit=LOOKUP_LIMIT):
+        try:
+            return await self._lamAPI.lookup_many(mentions, types=types, limit=limit), None, None
+        except Exception as e:
+            return {}, str(e), traceback.format_exc()
+
+    async def _fetch_candidates(self):
+        """
+        Looks up every distinct NE mention of the chunk not in the cache with batched requests.
+        Mentions of a constrained column are looked up restricted to the types of the column
+        first, and without restrictions if no typed candidate is found.
+        """
+        mentions = {}
+        typed = {}  # types -> mentions of the columns constrained to them
+        for row in self._rows_data:
+            for i, cell in enumerate(row["data"]):
+                key = self._cache_key(cell, i)
+                if i not in self._target["NE"] or key in self._cache or key in mentions:
+                    continue
+                if len(str(cell)) > 0 and str(cell).lower() != "nan":
+                    mentions[key] = (row["idRow"], self._types.get(str(i)))
+                    if isinstance(key, tuple):
+                        typed.setdefault(key[1], []).append(cell)
+                else:
+                    self._cache[key] = []
+
+        if len(mentions) == 0:
+            return
 
-    async def _build_row(self, cells, id_row):
-        row = Row(id_row, len(cells))
+        typed_results = await asyncio.gather(
+            *[self._lookup_many(cells, types.split(" "), self._constrained_limit) for types, cells in typed.items()]
+        )
+        for (types, cells), (result, _, _) in zip(typed.items(), typed_results):
+            self.constraint_stats["typedMentions"] += len(cells)
+            for cell in cells:
+                if len(result.get(cell) or []) > 0:
+                    self._cache[(cell, types)] = result[cell]
+                    del mentions[(cell, types)]
+                else:
+                    self.constraint_stats["fallbacks"] += 1
+
+        untyped = list(dict.fromkeys(key[0] if isinstance(key, tuple) else key for key in mentions))
+        if len(untyped) == 0:
+            return
+        result, error, stack_trace = await self._lookup_many(untyped)
+        error = error or "Error from lamAPI"
+
+        for key, (id_row, types) in mentions.items():
+            cell = key[0] if isinstance(key, tuple) else key
+            if cell in result:
+                self._cache[key] = result[cell]
+                continue
+            self._log_c.insert_one({
+                'datasetName': self._dataset_name,
+                'tableName': self._table_name,
+                'idRow': id_row,
+                'cell': cell,
+                'types': types,
+                'error': error, 
+                'stackTrace': stack_trace,
+                'result': None
+            })
+            self._cache[key] = []
+
+    def _build_row(self, cells, id_row):
+        row = Row(id_row, len(cells), self.store)
         cells_as_strings = [str(cell) for cell in cells]
         row_text = " ".join(cells_as_strings)
         for i, cell in enumerate(cells):
             if i in self._target["NE"]:
-                types = self._types.get(str(i))
-                description = " ".join(list(set(cells_as_strings) - set([cell]))) # unused
-
-                if cell in self._cache:
-                    candidates = self._cache.get(cell, [])
-                else:
-                    candidates = await self._get_candidates(cell, id_row, types)
-                    self._cache[cell] = candidates
-                
+                candidates = self._cache.get(self._cache_key(cell, i), [])
+                if self._pruning is not None:
+                    kept = self._pruning.prune(candidates, self._limit)
+                    if self._audit:
+                        self.pruning_audit[(id_row, i)] = {candidate["id"] for candidate in kept}
+                    else:
+                        candidates = kept
                 is_subject = i == self._target["SUBJ"]
                 row.add_ne_cell(cell, row_text, candidates, i, is_subject)
             elif i in self._target["LIT"]:
@@ -50,30 +124,5 @@ class Lookup:
         return row
 
     
-    async def _get_candidates(self, cell, id_row, types):
-        candidates = []
-        result = None
-        try:
-            if len(str(cell)) > 0 and str(cell).lower() != "nan":
-                result = await self._lamAPI.lookup(cell, limit=100)
-                if cell not in result:
-                    raise Exception("Error from lamAPI")
-                candidates = result[cell]    
-        except Exception as e:
-            self._log_c.insert_one({
-                'datasetName': self._dataset_name,
-                'tableName': self._table_name,
-                'idRow': id_row,
-                'cell': cell,
-                'types': types,
-                'error': str(e), 
-                'stackTrace': traceback.format_exc(),
-                'result': result
-            })
-            return []
-            
-        return candidates
-
-    
     def get_rows(self):
         return self._rows
\ No newline at end of file
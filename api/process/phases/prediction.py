@@ -1,3 +1,4 @@
+import numpy as np
 import tensorflow as tf
 
 class Prediction:
@@ -7,25 +8,39 @@ class Prediction:
         self._features = feautures
         
     def compute_prediction(self, feature_name):
-        prediction = []
-        indexes = []
-        for column_features in self._features:
-            pred = [] 
-            if len(column_features) > 0:
-                pred = self._model.predict(tf.convert_to_tensor(column_features))
-            prediction.append(pred)
-            indexes.append(0)
-        
+        """
+        Prediction of a single chunk, a batch of one.
+        """
+        Prediction.compute_batch_prediction([self], self._model, feature_name)
+
+    @staticmethod
+    def compute_batch_prediction(predictions, model, feature_name):
+        """
+        Runs a single model.predict over the features of several chunks
+        and assigns every chunk its own slice of the output.
+        """
+        batch = np.concatenate([column_features for p in predictions for column_features in p._features])
+        output = []
+        if len(batch) > 0:
+            output = model.predict(tf.convert_to_tensor(batch, dtype=tf.float32))
+
+        offset = 0
+        for p in predictions:
+            prediction = []
+            for column_features in p._features:
+                prediction.append(output[offset:offset + len(column_features)])
+                offset += len(column_features)
+            p._assign_prediction(prediction, feature_name)
+
+    def _assign_prediction(self, prediction, feature_name):
+        indexes = [0 for _ in prediction]
         for row in self._rows:
             cells = row.get_cells()
             for cell in cells:
-                candidates = cell.candidates()
-                for candidate in candidates:
-                    index = indexes[cell._id_col]
-                    indexes[cell._id_col] += 1
-                    feature = round(float(prediction[cell._id_col][index][1]), 3)
-                    candidate[feature_name] = feature
-                
-                candidates.sort(key=lambda x:x[feature_name], reverse=True)       
-            
-            
\ No newline at end of file
+                n_candidates = cell.n_candidates()
+                if n_candidates == 0:
+                    continue
+                index = indexes[cell._id_col]
+                indexes[cell._id_col] += n_candidates
+                cell.scores(feature_name)[:] = np.round(np.asarray(prediction[cell._id_col][index:index + n_candidates, 1], dtype=np.float64), 3)
+                cell.sort_by(feature_name)
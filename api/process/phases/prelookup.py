@@ -0,0 +1,83 @@
+import asyncio
+import os
+import time
+
+from pymongo import ReturnDocument
+
+import utils.utils as utils
+from phases.lookup import LOOKUP_LIMIT
+
+PRELOOKUP_LEASE = int(os.environ.get("PRELOOKUP_LEASE", 1800))  # seconds a worker owns the pre-lookup of a table
+PRELOOKUP_BATCH_SIZE = int(os.environ.get("PRELOOKUP_BATCH_SIZE", 1000))  # mentions resolved by each lookup_many call
+
+
+class PreLookup:
+    """
+    Resolves once, in bulk, the distinct normalized mentions of the NE columns of a
+    whole table, filling the shared lookup cache read by the Lookup of every chunk,
+    so a mention repeated on many pages is looked up once.
+
+    The first worker processing a chunk of the table claims its pre-lookup through
+    the preLookup field of the table document; the claim expires after
+    PRELOOKUP_LEASE seconds, so a crashed worker does not block it.
+    """
+    def __init__(self, table_c, row_c, lamAPI, worker_id, lease=PRELOOKUP_LEASE, batch_size=PRELOOKUP_BATCH_SIZE):
+        self._table_c = table_c
+        self._row_c = row_c
+        self._lamAPI = lamAPI
+        self._worker_id = worker_id
+        self._lease = lease
+        self._batch_size = batch_size
+
+    def claim(self, dataset_name, table_name):
+        """
+        :return: True if the pre-lookup of the table was not done nor being done by another worker.
+        """
+        table = self._table_c.find_one_and_update(
+            {
+                "datasetName": dataset_name,
+                "tableName": table_name,
+                "$or": [
+                    {"preLookup": {"$exists": False}},
+                    {"preLookup.status": "DOING", "preLookup.expiresAt": {"$lt": time.time()}}
+                ]
+            },
+            {"$set": {"preLookup": {"status": "DOING", "worker": self._worker_id, "expiresAt": time.time() + self._lease}}},
+            {"_id": 1},
+            return_document=ReturnDocument.AFTER
+        )
+        return table is not None
+
+    def get_mentions(self, dataset_name, table_name, ne_columns):
+        """
+        Distinct normalized mentions of the NE columns over all the chunks of the table.
+        """
+        mentions = set()
+        for chunk in self._row_c.find({"datasetName": dataset_name, "tableName": table_name}, {"rows.data": 1}):
+            for row in chunk["rows"]:
+                for id_col in ne_columns:
+                    if id_col >= len(row["data"]):
+                        continue
+                    cell = utils.clean_str(row["data"][id_col])
+                    if len(cell) > 0 and cell != "nan":
+                        mentions.add(cell)
+        return list(mentions)
+
+    async def run(self, dataset_name, table_name, ne_columns):
+        """
+        Claims and runs the pre-lookup of a table.
+
+        :return: Number of distinct mentions resolved, None if the table was already claimed.
+        """
+        if not await asyncio.to_thread(self.claim, dataset_name, table_name):
+            return None
+        start = time.time()
+        mentions = await asyncio.to_thread(self.get_mentions, dataset_name, table_name, ne_columns)
+        for i in range(0, len(mentions), self._batch_size):
+            await self._lamAPI.lookup_many(mentions[i:i + self._batch_size], limit=LOOKUP_LIMIT)
+        await asyncio.to_thread(
+            self._table_c.update_one,
+            {"datasetName": dataset_name, "tableName": table_name, "preLookup.worker": self._worker_id},
+            {"$set": {"preLookup": {"status": "DONE", "mentions": len(mentions), "time": round(time.time() - start, 2)}}}
+        )
+        return len(mentions)
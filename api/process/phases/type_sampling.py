@@ -0,0 +1,145 @@
+import os
+import threading
+
+SAMPLE_CONSTRAIN = os.environ.get("SAMPLE_CONSTRAIN", "0") == "1"  # type-constrain the lookups of a table after a sample
+SAMPLE_CHUNKS = int(os.environ.get("SAMPLE_CHUNKS", 1))  # first chunks of a table annotated with untyped lookups
+SAMPLE_TYPE_SUPPORT = float(os.environ.get("SAMPLE_TYPE_SUPPORT", 0.6))  # fraction of the sampled rows a column type must cover
+SAMPLE_MAX_TYPES = int(os.environ.get("SAMPLE_MAX_TYPES", 3))  # types a column lookup is constrained to
+SAMPLE_DEFER_DELAY = float(os.environ.get("SAMPLE_DEFER_DELAY", 1))  # seconds a worker waits after deferring all its claims
+CONSTRAINED_LOOKUP_LIMIT = int(os.environ.get("CONSTRAINED_LOOKUP_LIMIT", 20))  # candidates requested by a typed lookup
+
+
+class TypeSampling:
+    """
+    Sample-then-constrain annotation of large tables.
+
+    The first sample_chunks chunks of a table are annotated as usual, and the
+    column type frequencies computed by FeaturesExtractionRevision (_cta, the
+    fraction of the rows whose top candidates have the type) are saved in the
+    typeSample field of the table document. Once the sample is complete, the
+    remaining chunks look up the mentions of a column restricted to its dominant
+    types and with a smaller limit; a mention without typed candidates falls
+    back to the untyped lookup.
+
+    The other chunks of a table claimed while its sample chunks are still TODO or
+    DOING are deferred, i.e. put back at the end of the queue, so that they are
+    annotated with the constraints rather than with untyped lookups.
+    """
+    def __init__(self, table_c, row_c=None, sample_chunks=SAMPLE_CHUNKS, support=SAMPLE_TYPE_SUPPORT, max_types=SAMPLE_MAX_TYPES,
+                 limit=CONSTRAINED_LOOKUP_LIMIT):
+        """
+        Initialize the TypeSampling.
+
+        :param table_c: The table collection.
+        :param row_c: The row collection, None to never defer the chunks waiting for a sample.
+        :param sample_chunks: Chunks of a table (by page) annotated without constraints.
+        :param support: Minimum fraction of the sampled rows covered by a type to constrain the column to it.
+        :param max_types: Maximum number of types of a constrained column.
+        :param limit: Candidates requested by the typed lookups.
+        """
+        self._table_c = table_c
+        self._row_c = row_c
+        self._sample_chunks = sample_chunks
+        self._support = support
+        self._max_types = max_types
+        self.limit = limit
+        self._constraints = {}  # (datasetName, tableName) -> constraints of the tables with a complete sample
+        self._stats = {"sampledChunks": 0, "constrainedChunks": 0, "deferredChunks": 0, "typedMentions": 0, "fallbacks": 0}
+        self._lock = threading.Lock()  # the samples are recorded by the storage thread of the pipelined mode
+
+    def is_sample(self, metadata):
+        return metadata["page"] <= self._sample_chunks
+
+    def record_sample(self, metadata, cta, n_rows):
+        """
+        Saves the column types of a sample chunk in its table document, once per page.
+
+        :param metadata: Metadata of the chunk.
+        :param cta: Column type frequencies of the chunk (FeaturesExtractionRevision._cta).
+        :param n_rows: Rows of the chunk.
+        """
+        sample = {
+            "page": metadata["page"],
+            "rows": n_rows,
+            # pairs rather than a dictionary, type ids can contain dots
+            "cta": {id_col: sorted(freqs.items(), key=lambda item: item[1], reverse=True)[:50] for id_col, freqs in cta.items()}
+        }
+        self._table_c.update_one(
+            {"datasetName": metadata["datasetName"], "tableName": metadata["tableName"], "typeSample.page": {"$ne": metadata["page"]}},
+            {"$push": {"typeSample": sample}}
+        )
+        with self._lock:
+            self._stats["sampledChunks"] += 1
+
+    def get_constraints(self, metadata):
+        """
+        :return: Dictionary id_col -> types the lookups of the column are constrained to,
+                 None if the chunk is part of the sample or the sample is not complete yet.
+        """
+        if self.is_sample(metadata):
+            return None
+        key = (metadata["datasetName"], metadata["tableName"])
+        if key not in self._constraints:
+            table = self._table_c.find_one({"datasetName": key[0], "tableName": key[1]}, {"typeSample": 1})
+            samples = (table or {}).get("typeSample", [])
+            if len({sample["page"] for sample in samples}) < self._sample_chunks:
+                return None
+            if len(self._constraints) >= 10000:
+                self._constraints.clear()
+            self._constraints[key] = self.derive_constraints(samples)
+        return self._constraints[key]
+
+    def is_deferred(self, metadata):
+        """
+        :return: True if the chunk has to wait for the sample of its table: it is not part
+                 of the sample, the sample is not complete and some of its chunks are still
+                 to be annotated. Without pending sample chunks (e.g. they FAILED) the chunk
+                 is annotated with untyped lookups.
+        """
+        if self._row_c is None or self.is_sample(metadata) or self.get_constraints(metadata) is not None:
+            return False
+        pending = self._row_c.count_documents({
+            "datasetName": metadata["datasetName"],
+            "tableName": metadata["tableName"],
+            "page": {"$lte": self._sample_chunks},
+            "status": {"$in": ["TODO", "DOING"]}
+        }, limit=1)
+        if pending == 0:
+            return False
+        with self._lock:
+            self._stats["deferredChunks"] += 1
+        return True
+
+    def derive_constraints(self, samples):
+        """
+        Types of every column weighted by the rows of the sample chunks; a column is
+        constrained to its types covering at least the support, if any.
+        """
+        n_rows = sum(sample["rows"] for sample in samples)
+        support = {}
+        for sample in samples:
+            for id_col, freqs in sample["cta"].items():
+                column = support.setdefault(id_col, {})
+                for id_type, freq in freqs:
+                    column[id_type] = column.get(id_type, 0) + freq * sample["rows"] / max(n_rows, 1)
+        constraints = {}
+        for id_col, column in support.items():
+            types = sorted([id_type for id_type in column if column[id_type] >= self._support], key=column.get, reverse=True)
+            if len(types) > 0:
+                constraints[id_col] = types[:self._max_types]
+        return constraints
+
+    def record_lookup(self, stats):
+        """
+        :param stats: Typed mentions and fallbacks of the Lookup of a constrained chunk.
+        """
+        with self._lock:
+            self._stats["constrainedChunks"] += 1
+            self._stats["typedMentions"] += stats["typedMentions"]
+            self._stats["fallbacks"] += stats["fallbacks"]
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats["fallbackRate"] = round(stats["fallbacks"] / stats["typedMentions"], 4) if stats["typedMentions"] > 0 else None
+        return stats
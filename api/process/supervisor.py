@@ -0,0 +1,155 @@
+import asyncio
+import multiprocessing
+import os
+import signal
+import socket
+import sys
+import time
+
+import redis
+
+from wrapper.ChunkQueue import ChunkQueue
+from wrapper.ChunkLease import ChunkLease
+from wrapper.Database import MongoDBWrapper  # MongoDB database wrapper
+
+
+REDIS_ENDPOINT = os.environ["REDIS_ENDPOINT"]
+REDIS_JOB_DB = int(os.environ["REDIS_JOB_DB"])
+
+POLL_INTERVAL = 0.5  # seconds between two checks of the workers
+REQUEUE_INTERVAL = int(os.environ.get("SUPERVISOR_REQUEUE_INTERVAL", 60))  # seconds between two queue reconciliations
+REAP_INTERVAL = 10  # seconds between two searches of expired leases
+RESTART_DELAY = 1  # minimum seconds between two restarts of the same worker slot
+SHUTDOWN_TIMEOUT = 60  # seconds given to the workers to finish their batch on shutdown
+
+
+def run_worker(shutdown):
+    """
+    Entry point of a worker process of the pool.
+    """
+    # Ctrl-C is handled by the supervisor, which asks the workers to stop
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    from worker import Worker
+    worker = Worker()
+    asyncio.run(worker.run(shutdown))
+
+
+class Supervisor:
+    """
+    Keeps a pool of warm computation workers blocked on the chunk queue, restarts
+    the ones that crash, returns the chunks with an expired lease to the queue and
+    re-queues the TODO chunks missing from the queue (e.g. after a Redis restart).
+    """
+    def __init__(self, n_workers):
+        self._n_workers = n_workers
+        self._context = multiprocessing.get_context("spawn")  # TensorFlow is not fork safe
+        self._shutdown = self._context.Event()
+        self._processes = [None for _ in range(n_workers)]
+        self._started_at = [0 for _ in range(n_workers)]
+        self._job_active = redis.Redis(host=REDIS_ENDPOINT, db=REDIS_JOB_DB)
+        self._queue = ChunkQueue(self._job_active)
+        self._row_c = MongoDBWrapper().get_collection("row")
+        self._lease = ChunkLease(self._row_c, self._queue)
+        self._requeued_at = 0
+        self._reaped_at = 0
+        self._exited = set()  # ids of the exited workers whose clean-up is pending
+        self._stopping = False
+
+    def _start_worker(self, slot):
+        process = self._context.Process(target=run_worker, args=(self._shutdown,), daemon=False)
+        process.start()
+        self._processes[slot] = process
+        self._started_at[slot] = time.time()
+        print(f"Worker slot {slot} started with pid {process.pid}", flush=True)
+
+    def _worker_id(self, process):
+        return f"{socket.gethostname()}-{process.pid}"
+
+    def _check_workers(self):
+        for slot, process in enumerate(self._processes):
+            if process is not None and process.is_alive():
+                continue
+            if process is not None:
+                print(f"Worker slot {slot} (pid {process.pid}) exited with code {process.exitcode}", flush=True)
+                self._exited.add(self._worker_id(process))
+                self._processes[slot] = None
+            if time.time() - self._started_at[slot] >= RESTART_DELAY:
+                self._start_worker(slot)
+        for worker_id in list(self._exited):
+            self._clean_up(worker_id)
+
+    def _clean_up(self, worker_id):
+        """
+        Removes the stats of an exited worker and releases its chunks. On failure the
+        clean-up is retried at the next check; meanwhile the leases of the worker
+        expire and are reaped anyway.
+        """
+        try:
+            self._job_active.hdel("WORKERS", worker_id)
+            self._lease.release_worker(worker_id)
+            self._exited.discard(worker_id)
+        except Exception as e:
+            print(f"Unable to clean up worker {worker_id}, retrying: {e}", flush=True)
+
+    def _requeue(self):
+        """
+        Pushes the TODO chunks again when the queue is empty: claims are conditional
+        on the TODO status, so an id queued twice is processed once.
+        """
+        if time.time() - self._requeued_at < REQUEUE_INTERVAL:
+            return
+        self._requeued_at = time.time()
+        if len(self._queue) > 0:
+            return
+        ids = [row["_id"] for row in self._row_c.find({"status": "TODO"}, {"_id": 1})]
+        if len(ids) > 0:
+            print(f"Re-queued {len(ids)} chunks", flush=True)
+            self._queue.push(ids)
+
+    def _reap(self):
+        if time.time() - self._reaped_at < REAP_INTERVAL:
+            return
+        self._reaped_at = time.time()
+        stats = self._lease.reap()
+        if stats["TODO"] + stats["FAILED"] > 0:
+            print(f"Expired leases: {stats['TODO']} chunks re-queued, {stats['FAILED']} chunks failed", flush=True)
+
+    def _stop(self, signum, frame):
+        self._stopping = True
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+        print("Computation Started!", flush=True)
+        while not self._stopping:
+            self._check_workers()
+            try:
+                self._reap()
+                self._requeue()
+            except Exception as e:
+                print(f"Unable to check the chunks: {e}", flush=True)
+            time.sleep(POLL_INTERVAL)
+        self.shutdown()
+
+    def shutdown(self):
+        print("Stopping the workers", flush=True)
+        self._shutdown.set()
+        deadline = time.time() + SHUTDOWN_TIMEOUT
+        for process in self._processes:
+            if process is not None:
+                process.join(max(deadline - time.time(), 0))
+        for process in self._processes:
+            if process is not None and process.is_alive():
+                process.terminate()
+                process.join()
+            if process is not None:
+                try:
+                    self._job_active.hdel("WORKERS", self._worker_id(process))
+                except Exception as e:
+                    print(f"Unable to remove the stats of worker {self._worker_id(process)}: {e}", flush=True)
+        print("Computation Stopped!", flush=True)
+
+
+if __name__ == "__main__":
+    n_workers = int(sys.argv[1]) if len(sys.argv) > 1 else int(os.environ["MAX_NUMBER_OF_JOB"])
+    Supervisor(n_workers).run()
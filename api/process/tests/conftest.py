@@ -0,0 +1,6 @@
+import os
+import sys
+
+# The worker runs from api/ as python ./process/worker.py, modules are imported from process/
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+os.environ.setdefault("LAMAPI_TOKEN", "test")
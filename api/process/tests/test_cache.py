@@ -0,0 +1,88 @@
+import asyncio
+import json
+
+import wrapper.cache as cache
+from wrapper.cache import LRUCache, TieredCache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+
+class SharedCache:
+    def __init__(self, fail=False):
+        self.data = {}
+        self.fail = fail
+
+    async def get_many(self, keys):
+        if self.fail:
+            raise ConnectionError("Redis unavailable")
+        return {key: self.data[key] for key in keys if key in self.data}
+
+    async def set_many(self, items):
+        if self.fail:
+            raise ConnectionError("Redis unavailable")
+        self.data.update(items)
+
+
+def test_entries_expire_after_the_ttl(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cache.time, "time", clock.time)
+    lru = LRUCache(10, ttl=60)
+    lru.set("a", 1)
+    lru.set("b", 2, expires_at=clock.now + 600)
+    clock.now += 61
+    assert lru.get("a") is None and "a" not in lru
+    assert lru.get("b") == 2
+    assert [key for key, _, _ in lru.items()] == ["b"]
+
+
+def test_set_replaces_the_entry_and_its_expiry(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cache.time, "time", clock.time)
+    lru = LRUCache(10, ttl=60, max_bytes=1000)
+    lru.set("a", "old")
+    clock.now += 50
+    lru.set("a", "new")
+    clock.now += 50
+    assert lru.get("a") == "new"
+    assert len(lru) == 1 and lru.bytes == len(json.dumps("old"))
+
+
+def test_least_recently_used_are_evicted_first():
+    lru = LRUCache(2)
+    lru.set("a", 1)
+    lru.set("b", 2)
+    lru.get("a")
+    lru.set("c", 3)
+    assert "b" not in lru and lru.get("a") == 1 and lru.get("c") == 3
+
+
+def test_size_bound_uses_the_sampled_sizes():
+    value = {"labels": ["x" * 90]}
+    size = len(json.dumps(value, separators=(",", ":")))
+    lru = LRUCache(1000, max_bytes=10 * size)
+    for i in range(40):
+        lru.set(i, value)
+    assert len(lru) == 10 and lru.bytes == 10 * size
+
+
+def test_tiered_cache_fills_the_local_tier_and_ignores_shared_errors():
+    async def main():
+        shared = SharedCache()
+        shared.data["k"] = "v"
+        tiered = TieredCache("test", LRUCache(10), shared)
+        first = await tiered.get_many(["k", "missing"])
+        shared.fail = True
+        second = await tiered.get_many(["k", "missing"])
+        await tiered.set_many({"n": "w"})
+        return first, second, await tiered.get_many(["n"]), tiered.stats()
+
+    first, second, third, stats = asyncio.run(main())
+    assert first == second == {"k": "v"}
+    assert third == {"n": "w"}
+    assert stats["sharedHits"] == 1 and stats["localHits"] == 2 and stats["misses"] == 2 and stats["sharedErrors"] == 2
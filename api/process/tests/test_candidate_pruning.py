@@ -0,0 +1,17 @@
+from phases.candidate_pruning import CandidatePruning
+
+
+def candidates(n):
+    return [{"id": f"Q{i}", "es_score": i} for i in range(n)]
+
+
+def test_keeps_the_best_candidates_in_order():
+    kept = CandidatePruning(top_k=50).prune(candidates(100), 100)
+    assert [candidate["id"] for candidate in kept] == [f"Q{i}" for i in range(50, 100)]
+
+
+def test_candidate_size_caps_top_k():
+    assert len(CandidatePruning(top_k=50).prune(candidates(100), 10)) == 10
+    assert len(CandidatePruning(top_k=0).prune(candidates(100), 30)) == 30
+    assert len(CandidatePruning(top_k=0).prune(candidates(100), 100)) == 100
+    assert len(CandidatePruning(top_k=0).prune(candidates(100), None)) == 100
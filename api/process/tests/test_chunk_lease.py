@@ -0,0 +1,129 @@
+import pytest
+
+import wrapper.ChunkLease as chunk_lease
+from wrapper.ChunkLease import ChunkLease
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+
+class Result:
+    def __init__(self, modified_count):
+        self.modified_count = modified_count
+
+
+class RowCollection:
+    """
+    In-memory row collection supporting the queries and updates of ChunkLease.
+    """
+    def __init__(self, ids):
+        self.documents = {_id: {"_id": _id, "status": "TODO", "retries": 0} for _id in ids}
+
+    def _match(self, document, query):
+        for field, condition in query.items():
+            if field == "$or":
+                if not any(self._match(document, option) for option in condition):
+                    return False
+            elif isinstance(condition, dict):
+                value = document.get(field)
+                if "$exists" in condition and (field in document) != condition["$exists"]:
+                    return False
+                if "$lt" in condition and not (value is not None and value < condition["$lt"]):
+                    return False
+                if "$in" in condition and value not in condition["$in"]:
+                    return False
+            elif document.get(field) != condition:
+                return False
+        return True
+
+    def _update(self, document, update):
+        document.update(update.get("$set", {}))
+        for field in update.get("$unset", {}):
+            document.pop(field, None)
+        for field, value in update.get("$inc", {}).items():
+            document[field] = document.get(field, 0) + value
+
+    def find(self, query, projection=None):
+        return [dict(document) for document in self.documents.values() if self._match(document, query)]
+
+    def find_one_and_update(self, query, update, projection=None, return_document=None):
+        for document in self.documents.values():
+            if self._match(document, query):
+                before = dict(document)
+                self._update(document, update)
+                return dict(document) if return_document else before
+        return None
+
+    def update_one(self, query, update):
+        return Result(int(self.find_one_and_update(query, update) is not None))
+
+    def update_many(self, query, update):
+        matched = [document for document in self.documents.values() if self._match(document, query)]
+        for document in matched:
+            self._update(document, update)
+        return Result(len(matched))
+
+
+class Queue:
+    def __init__(self):
+        self.ids = []
+
+    def push(self, ids):
+        self.ids.extend(ids)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(chunk_lease.time, "time", clock.time)
+    return clock
+
+
+def test_expired_leases_are_reaped_and_renewed_ones_kept(clock):
+    rows, queue = RowCollection(["a", "b"]), Queue()
+    lease = ChunkLease(rows, queue, duration=10, max_retries=3)
+    assert lease.claim("a", "w1")["status"] == "TODO"
+    assert lease.claim("b", "w2") is not None
+    assert lease.claim("a", "w2") is None  # already owned
+
+    clock.now += 8
+    assert lease.renew(["a"], "w1") == 1
+    assert lease.renew(["a"], "w2") == 0  # not its chunk
+    clock.now += 5
+    assert lease.reap() == {"TODO": 1, "FAILED": 0}
+    assert queue.ids == ["b"]
+    assert rows.documents["b"]["status"] == "TODO" and "worker" not in rows.documents["b"]
+    assert rows.documents["a"]["status"] == "DOING"
+
+    # the crashed worker cannot complete the chunk it lost
+    lease.complete("b", "w2", {"time": 1})
+    assert rows.documents["b"]["status"] == "TODO"
+
+
+def test_chunks_fail_after_the_retries(clock):
+    rows, queue = RowCollection(["a"]), Queue()
+    lease = ChunkLease(rows, queue, duration=10, max_retries=1)
+    for expected in ["TODO", "FAILED"]:
+        assert lease.claim("a", "w1") is not None
+        clock.now += 11
+        assert lease.reap() == {"TODO": int(expected == "TODO"), "FAILED": int(expected == "FAILED")}
+    assert rows.documents["a"]["status"] == "FAILED" and rows.documents["a"]["retries"] == 2
+    assert queue.ids == ["a"]
+
+
+def test_deferred_chunks_keep_their_retries(clock):
+    rows, queue = RowCollection(["a"]), Queue()
+    lease = ChunkLease(rows, queue, duration=10, max_retries=1)
+    lease.claim("a", "w1")
+    assert lease.defer("a", "w1") is True
+    assert lease.defer("a", "w1") is False
+    assert rows.documents["a"]["status"] == "TODO" and rows.documents["a"]["retries"] == 0
+    assert queue.ids == ["a"]
+    lease.claim("a", "w1")
+    assert lease.release_worker("w1") == 1
+    assert rows.documents["a"]["retries"] == 1 and rows.documents["a"]["error"] == "worker exited"
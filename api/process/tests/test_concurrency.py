@@ -0,0 +1,74 @@
+import asyncio
+
+import pytest
+
+from wrapper.concurrency import AdaptiveLimiter, CircuitBreaker
+
+
+def test_cancelled_request_keeps_the_limit():
+    async def main():
+        limiter = AdaptiveLimiter(4, 1, 10, target_latency=1)
+
+        async def request(delay):
+            async with limiter.request():
+                await asyncio.sleep(delay)
+
+        slow = asyncio.ensure_future(request(10))
+        await asyncio.sleep(0.01)
+        slow.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await slow
+        return limiter
+
+    limiter = asyncio.run(main())
+    stats = limiter.stats()
+    assert stats["limit"] == 4 and stats["inUse"] == 0
+    assert stats["requests"] == 0 and stats["cancelled"] == 1
+
+
+def test_cancelled_trial_lets_the_next_request_through():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0)
+    breaker.record(False)
+    assert breaker.state == "half-open"
+    assert breaker.allow() is True
+    assert breaker.allow() is False
+    breaker.cancel()
+    assert breaker.allow() is True
+    breaker.record(True)
+    assert breaker.state == "closed"
+
+
+def test_limit_grows_additively_up_to_the_max():
+    limiter = AdaptiveLimiter(4, 1, 5, target_latency=1)
+    for _ in range(4):
+        limiter._in_use += 1
+        limiter.release(0.1)
+    assert 4.9 < limiter.limit < 5  # +1/limit for every fast request: about +1 every limit requests
+    for _ in range(20):
+        limiter._in_use += 1
+        limiter.release(0.1)
+    assert limiter.limit == 5
+
+
+def test_limit_halves_on_errors_and_slow_requests_once_per_window():
+    limiter = AdaptiveLimiter(16, 2, 32, target_latency=1)
+    limiter._in_use += 2
+    limiter.release(0.1, ok=False)
+    limiter.release(0.1, ok=False)  # same window, not decreased again
+    assert limiter.limit == 8
+    limiter._decreased_at = 0
+    limiter._in_use += 1
+    limiter.release(2)
+    assert limiter.limit == 4
+    for _ in range(3):
+        limiter._decreased_at = 0
+        limiter._in_use += 1
+        limiter.release(0.1, ok=False)
+    assert limiter.limit == 2
+    stats = limiter.stats()
+    assert stats["errors"] == 5 and stats["slow"] == 1
+
+
+def test_starting_limit_is_clamped_to_the_bounds():
+    assert AdaptiveLimiter(500, 4, 50, target_latency=1).limit == 50
+    assert AdaptiveLimiter(1, 4, 50, target_latency=1).limit == 4
@@ -0,0 +1,35 @@
+import asyncio
+
+import pytest
+
+from model.candidates import CandidateStore
+from model.row import Row
+from phases.feauturesExtraction import FeauturesExtraction
+
+
+class EmptyLamAPI:
+    async def objects(self, entities):
+        return {}
+
+    async def literals(self, entities):
+        return {}
+
+
+def candidate(id_entity):
+    return {
+        "id": id_entity, "name": f"name {id_entity}", "description": f"description {id_entity}", "types": [],
+        "ambiguity_mention": 0, "corrects_tokens": 0, "ntoken_mention": 1, "ntoken_entity": 2, "length_mention": 4,
+        "length_entity": 8, "popularity": 0, "pos_score": 0, "es_score": 1, "ed_score": 1, "jaccard_score": 1,
+        "jaccardNgram_score": 1
+    }
+
+
+def test_rows_must_share_the_store():
+    rows = []
+    for id_row in range(2):
+        row = Row(id_row, 2, CandidateStore())
+        row.add_ne_cell("alba", "alba beca", [candidate(f"Q{id_row}"), candidate("Q9")], 0, is_subject=True)
+        row.add_ne_cell("beca", "alba beca", [candidate(f"Q{id_row + 2}")], 1)
+        rows.append(row)
+    with pytest.raises(ValueError, match="CandidateStore"):
+        asyncio.run(FeauturesExtraction(rows, EmptyLamAPI()).compute_feautures())
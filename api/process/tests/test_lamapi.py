@@ -0,0 +1,331 @@
+import asyncio
+import time
+
+import pytest
+from aiohttp import web
+from aiohttp_retry import ExponentialRetry
+
+from mock_lamapi import ENDPOINTS, EndpointProfile, MockLamAPI, SyntheticCorpus
+import wrapper.cache as cache
+from wrapper.archive import LamAPIArchive
+from wrapper.cache import LRUCache, TieredCache
+from wrapper.concurrency import EndpointPolicy
+from wrapper.lamAPI import LamAPI, endpoint_policies
+
+
+class MemoryLog:
+    def __init__(self):
+        self.documents = []
+
+    def insert_one(self, document):
+        self.documents.append(document)
+
+
+async def start_mock(app=None, **profiles):
+    """
+    :param app: Function building the application from the MockLamAPI, MockLamAPI.app by default.
+    :return: Tuple (mock, runner, url) of a MockLamAPI served on a free port.
+    """
+    mock = MockLamAPI(SyntheticCorpus(0, 1000), {endpoint: profiles.get(endpoint, EndpointProfile(size=5)) for endpoint in ENDPOINTS})
+    runner = web.AppRunner(app(mock) if app is not None else mock.app())
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = runner.addresses[0][1]
+    return mock, runner, f"http://127.0.0.1:{port}/"
+
+
+def test_requests_share_the_session():
+    async def main():
+        mock, runner, url = await start_mock()
+        log = MemoryLog()
+        lamapi = LamAPI(url, "test", None, log_c=log)
+        try:
+            first = await lamapi.lookup("alba")
+            second = await lamapi.objects(["Q1", "Q2"])
+            third = await lamapi.lookup_many(["alba", "beca"])
+        finally:
+            await lamapi.close()
+            await runner.cleanup()
+        return mock, log, first, second, third
+
+    mock, log, first, second, third = asyncio.run(main())
+    assert "error" not in first and "alba" in first
+    assert "error" not in second and set(second) == {"Q1", "Q2"}
+    assert set(third) == {"alba", "beca"}
+    assert log.documents == []
+    assert mock.requests["lookup"] == 2 and mock.requests["objects"] == 1
+
+
+def test_record_then_replay(tmp_path):
+    path = str(tmp_path / "archive.sqlite")
+
+    async def record():
+        mock, runner, url = await start_mock()
+        archive = LamAPIArchive(path, "record")
+        lamapi = LamAPI(url, "test", None, log_c=MemoryLog(), archive=archive,
+                        lookup_cache=TieredCache("lookup", LRUCache(100)),
+                        entity_caches={"objects": TieredCache("objects", LRUCache(100))})
+        try:
+            lookups = await lamapi.lookup_many(["alba", "beca"], limit=10)
+            objects = await lamapi.objects(["Q1", "Q2"])
+            # answered by the local caches, already in the archive
+            assert await lamapi.lookup_many(["alba"], limit=10) == {"alba": lookups["alba"]}
+            assert await lamapi.objects(["Q1"]) == {"Q1": objects["Q1"]}
+        finally:
+            await lamapi.close()
+            await runner.cleanup()
+            archive.close()
+        return lookups, objects
+
+    async def replay():
+        # nothing listens on the port, every response must come from the archive
+        archive = LamAPIArchive(path, "replay")
+        log = MemoryLog()
+        lamapi = LamAPI("http://127.0.0.1:9/", "test", None, log_c=log, archive=archive)
+        try:
+            lookups = await lamapi.lookup_many(["beca", "alba", "dofa"], limit=10)
+            objects = await lamapi.objects(["Q2", "Q1"])
+        finally:
+            await lamapi.close()
+            archive.close()
+        assert log.documents == []
+        return lookups, objects
+
+    recorded_lookups, recorded_objects = asyncio.run(record())
+    assert set(recorded_lookups) == {"alba", "beca"} and set(recorded_objects) == {"Q1", "Q2"}
+    replayed_lookups, replayed_objects = asyncio.run(replay())
+    assert replayed_lookups == recorded_lookups
+    assert replayed_objects == recorded_objects
+
+
+def get_only(mock):
+    app = web.Application()
+    app.router.add_route("GET", "/lookup/entity-retrieval", mock.lookup)
+    return app
+
+
+def ignored_batch(mock):
+    async def lookup(request):
+        if request.method == "POST":
+            # answers as a lookup without name
+            return web.json_response({"wikidata": {"": []}})
+        return await mock.lookup(request)
+
+    app = web.Application()
+    app.router.add_route("*", "/lookup/entity-retrieval", lookup)
+    return app
+
+
+@pytest.mark.parametrize("app", [get_only, ignored_batch])
+def test_lookups_fall_back_to_single_requests(app):
+    async def main():
+        mock, runner, url = await start_mock(app)
+        lamapi = LamAPI(url, "test", None, log_c=MemoryLog())
+        try:
+            first = await lamapi.lookup_many(["alba", "beca"])
+            batch_lookup = lamapi._batch_lookup
+            second = await lamapi.lookup_many(["dofa"])
+        finally:
+            await lamapi.close()
+            await runner.cleanup()
+        return mock, batch_lookup, first, second
+
+    mock, batch_lookup, first, second = asyncio.run(main())
+    assert batch_lookup is False
+    assert set(first) == {"alba", "beca"} and set(second) == {"dofa"}
+    assert mock.requests["lookup"] == 3
+
+
+def slow_first_objects(mock):
+    async def objects(request):
+        if mock.requests["objects"] == 0:
+            mock.requests["objects"] += 1
+            await asyncio.sleep(10)
+        return await handler(request)
+
+    handler = mock.entity_handler("objects")
+    app = web.Application()
+    app.router.add_route("POST", "/entity/objects", objects)
+    return app
+
+
+def test_cancelled_requests_are_not_successes():
+    async def main():
+        mock, runner, url = await start_mock(slow_first_objects)
+        policies = endpoint_policies()
+        policies["objects"] = EndpointPolicy(timeout=60, failure_threshold=1, reset_timeout=0, hedge=True)
+        for _ in range(20):
+            policies["objects"].latency.add(0.01)
+        lamapi = LamAPI(url, "test", None, log_c=MemoryLog(), policies=policies)
+        try:
+            # the first attempt hangs, the hedged one answers and the first is cancelled
+            hedged = await lamapi.objects(["Q1"])
+            await asyncio.sleep(0.05)
+            limiter = lamapi.limiter.stats()
+
+            # a cancelled half-open trial does not keep the circuit open
+            policies["objects"].hedge = False
+            policies["objects"].breaker.record(False)
+            mock.requests["objects"] = 0
+            trial = asyncio.ensure_future(lamapi.objects(["Q2"]))
+            await asyncio.sleep(0.05)
+            trial.cancel()
+            await asyncio.gather(trial, return_exceptions=True)
+            retried = await lamapi.objects(["Q2"])
+        finally:
+            await lamapi.close()
+            await runner.cleanup()
+        return hedged, limiter, retried, policies["objects"].breaker.state
+
+    hedged, limiter, retried, state = asyncio.run(main())
+    assert set(hedged) == {"Q1"} and set(retried) == {"Q2"}
+    assert limiter["requests"] == 1 and limiter["cancelled"] == 1 and limiter["inUse"] == 0
+    assert state == "closed"
+
+
+def failing_first_objects(status, json_body):
+    """
+    :return: Application answering the first objects request with the status, with a JSON or a text body.
+    """
+    def app(mock):
+        async def objects(request):
+            if mock.requests["objects"] == 0:
+                mock.requests["objects"] += 1
+                if json_body:
+                    return web.json_response({"detail": "overloaded"}, status=status)
+                return web.Response(text="Service Unavailable", status=status)
+            return await handler(request)
+
+        handler = mock.entity_handler("objects")
+        app = web.Application()
+        app.router.add_route("POST", "/entity/objects", objects)
+        return app
+    return app
+
+
+@pytest.mark.parametrize("status,json_body", [(503, False), (429, True), (429, False)])
+def test_failed_responses_are_not_cached(status, json_body):
+    async def main():
+        mock, runner, url = await start_mock(failing_first_objects(status, json_body))
+        cache = TieredCache("objects", LRUCache(100))
+        lamapi = LamAPI(url, "test", None, log_c=MemoryLog(), entity_caches={"objects": cache},
+                        retry_options=ExponentialRetry(attempts=1))
+        try:
+            failed = await lamapi.objects(["Q1", "Q2"])
+            cached = await cache.get_many(["wikidata:Q1", "wikidata:Q2"])
+            retried = await lamapi.objects(["Q1", "Q2"])
+        finally:
+            await lamapi.close()
+            await runner.cleanup()
+        return failed, cached, retried
+
+    failed, cached, retried = asyncio.run(main())
+    assert failed == {} and cached == {}
+    assert set(retried) == {"Q1", "Q2"}
+
+
+def failing_first_batch(status, json_body):
+    """
+    :return: Application answering the first lookup batch with the status, with a JSON or a text body.
+    """
+    def app(mock):
+        failed = []
+
+        async def lookup(request):
+            if request.method == "POST" and len(failed) == 0:
+                failed.append(request)
+                if json_body:
+                    return web.json_response({"detail": "overloaded"}, status=status)
+                return web.Response(text="Service Unavailable", status=status)
+            return await mock.lookup(request)
+
+        app = web.Application()
+        app.router.add_route("*", "/lookup/entity-retrieval", lookup)
+        return app
+    return app
+
+
+@pytest.mark.parametrize("status,json_body", [(503, False), (429, True), (200, False)])
+def test_failed_batches_keep_batching(status, json_body):
+    async def main():
+        mock, runner, url = await start_mock(failing_first_batch(status, json_body))
+        lamapi = LamAPI(url, "test", None, log_c=MemoryLog(), retry_options=ExponentialRetry(attempts=1))
+        try:
+            first = await lamapi.lookup_many(["alba", "beca"])
+            second = await lamapi.lookup_many(["dofa", "elfa"])
+        finally:
+            await lamapi.close()
+            await runner.cleanup()
+        return mock, lamapi._batch_lookup, first, second
+
+    mock, batch_lookup, first, second = asyncio.run(main())
+    assert batch_lookup is True
+    assert set(first) == {"alba", "beca"} and set(second) == {"dofa", "elfa"}
+    # two single lookups after the failed batch, then one batch
+    assert mock.requests["lookup"] == 3
+
+
+def test_recorded_responses_are_written_in_the_background(tmp_path):
+    path = str(tmp_path / "archive.sqlite")
+    archive = LamAPIArchive(path, "record", flush_interval=0.05)
+    archive.put_many("objects", {"wikidata:Q1": {"labels": ["alba"]}})
+    archive.put_many("objects", {"wikidata:Q2": {"labels": ["beca"]}})
+    deadline = time.time() + 5
+    reader = LamAPIArchive(path, "replay")
+    while len(reader.get_many("objects", ["wikidata:Q1", "wikidata:Q2"])) < 2 and time.time() < deadline:
+        time.sleep(0.05)
+    assert reader.get_many("objects", ["wikidata:Q1", "wikidata:Q2"]) == {
+        "wikidata:Q1": {"labels": ["alba"]}, "wikidata:Q2": {"labels": ["beca"]}}
+    archive.put_many("objects", {"wikidata:Q3": {"labels": ["dofa"]}})
+    archive.close()  # writes what is still pending
+    assert reader.get_many("objects", ["wikidata:Q3"]) == {"wikidata:Q3": {"labels": ["dofa"]}}
+    reader.close()
+
+
+def test_concurrent_identical_requests_are_coalesced():
+    async def main():
+        slow = EndpointProfile(latency="fixed:200", size=5)
+        mock, runner, url = await start_mock(lookup=slow, objects=slow)
+        lamapi = LamAPI(url, "test", None, log_c=MemoryLog())
+        try:
+            lookups = await asyncio.gather(*[lamapi.lookup_many(["alba", "beca"], limit=10) for _ in range(3)])
+            objects = await asyncio.gather(*[lamapi.objects(["Q1", "Q2"]) for _ in range(3)],
+                                           lamapi.objects(["Q2", "Q3"]))
+            again = await lamapi.objects(["Q1"])  # nothing in flight, no cache: requested again
+        finally:
+            await lamapi.close()
+            await runner.cleanup()
+        return mock, lookups, objects, again
+
+    mock, lookups, objects, again = asyncio.run(main())
+    assert set(lookups[0]) == {"alba", "beca"} and lookups[0] == lookups[1] == lookups[2]
+    assert objects[0] == objects[1] == objects[2] and objects[3]["Q2"] == objects[0]["Q2"]
+    assert again == {"Q1": objects[0]["Q1"]}
+    # one request for the shared items, one for Q3 alone, one after the first completed
+    assert mock.requests["lookup"] == 1 and mock.requests["objects"] == 3
+
+
+def test_entity_data_is_cached_until_it_expires(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(cache.time, "time", lambda: now[0])
+
+    async def main():
+        mock, runner, url = await start_mock()
+        objects_cache = TieredCache("objects", LRUCache(100, ttl=60))
+        lamapi = LamAPI(url, "test", None, log_c=MemoryLog(), entity_caches={"objects": objects_cache})
+        try:
+            first = await lamapi.objects(["Q1", "Q2"])
+            cached = await lamapi.objects(["Q2", "Q1"])
+            requests = mock.requests["objects"]
+            now[0] += 61
+            expired = await lamapi.objects(["Q1"])
+        finally:
+            await lamapi.close()
+            await runner.cleanup()
+        return mock, requests, first, cached, expired, objects_cache.stats()
+
+    mock, requests, first, cached, expired, stats = asyncio.run(main())
+    assert cached == first and expired == {"Q1": first["Q1"]}
+    assert requests == 1 and mock.requests["objects"] == 2
+    assert stats["localHits"] == 2
@@ -0,0 +1,154 @@
+"""
+Regression test of the feature pipeline (Lookup, FeauturesExtraction, Prediction,
+FeaturesExtractionRevision and Decision) on a fixed chunk. The expected output in
+data/pipeline_baseline.json was produced by the row-by-row implementation that
+preceded the columnar candidates (CandidateStore), with
+
+    PYTHONPATH=<api/process of that tree> python tests/test_pipeline_regression.py > tests/data/pipeline_baseline.json
+
+The prelinking data is not compared: the row-by-row
+implementation stored in it the cta/cpa features computed after the prelinking.
+"""
+import asyncio
+import json
+import os
+import random
+import sys
+
+import numpy as np
+
+from phases.decision import Decision
+from phases.featuresExtractionRevision import FeaturesExtractionRevision
+from phases.feauturesExtraction import FeauturesExtraction
+from phases.lookup import Lookup
+from phases.prediction import Prediction
+import utils.utils as utils
+
+BASELINE = os.path.join(os.path.dirname(__file__), "data", "pipeline_baseline.json")
+METADATA = {"datasetName": "dataset", "tableName": "table", "kgReference": "wikidata", "page": 1}
+ENTITIES = [f"Q{i}" for i in range(80)]
+
+
+def candidates(mention):
+    rng = random.Random(mention)
+    result = []
+    for id_entity in rng.sample(ENTITIES, 9):
+        result.append({
+            "id": id_entity, "name": f"{mention} {id_entity}", "description": f"{mention} described {rng.randint(0, 20)}",
+            "types": [{"id": f"T{rng.randint(0, 4)}"}, {"id": f"T{rng.randint(5, 6)}"}],
+            "ambiguity_mention": rng.random(), "corrects_tokens": rng.random(), "ntoken_mention": 2, "ntoken_entity": 3,
+            "length_mention": len(mention), "length_entity": 12, "popularity": rng.random(), "pos_score": rng.random(),
+            "es_score": rng.random(), "ed_score": round(rng.random(), 3), "jaccard_score": round(rng.random(), 3),
+            "jaccardNgram_score": round(rng.random(), 3)
+        })
+    return result
+
+
+class FixedLamAPI:
+    semaphore = asyncio.Semaphore(10)  # used by the row-by-row implementation
+
+    def __init__(self):
+        rng = random.Random(0)
+        self._objects = {e: {"objects": {o: [f"P{rng.randint(1, 6)}"] for o in rng.sample(ENTITIES, 10)}} for e in ENTITIES}
+        self._literals = {
+            e: {"literals": {
+                "number": {f"P{rng.randint(1, 4)}": [str(rng.randint(1, 40))]},
+                "string": {f"P{rng.randint(5, 7)}": [f"label {rng.randint(0, 10)}"]}
+            }} for e in ENTITIES
+        }
+
+    async def lookup_many(self, mentions, types=None, limit=100):
+        return {mention: candidates(mention) for mention in mentions}
+
+    async def objects(self, entities):
+        return {e: self._objects[e] for e in entities if e in self._objects}
+
+    async def literals(self, entities):
+        return {e: self._literals[e] for e in entities if e in self._literals}
+
+
+class Log:
+    def insert_one(self, document):
+        pass
+
+
+class Collection:
+    def __init__(self):
+        self.documents = []
+
+    def insert_one(self, document):
+        self.documents.append(document)
+
+    def insert_many(self, documents):
+        self.documents.extend(documents)
+
+
+class Model:
+    def __init__(self, seed):
+        self._weights = np.random.RandomState(seed).randn(29) * 0.3
+
+    def predict(self, features):
+        score = 1 / (1 + np.exp(-(np.asarray(features, dtype=np.float64) @ self._weights)))
+        return np.stack([1 - score, score], axis=1)
+
+
+def chunk():
+    rows = [{"idRow": i, "data": [f"mention {i}", f"mention {i % 7}", str(i % 30), f"label {i % 11}"]} for i in range(12)]
+    target = {"SUBJ": 0, "NE": [0, 1], "LIT": [2, 3], "LIT_DATATYPE": {"2": "NUMBER", "3": "STRING"}}
+    return {"datasetName": METADATA["datasetName"], "tableName": METADATA["tableName"], "rows": rows}, target
+
+
+def features(columns):
+    return [np.round(np.asarray(column, dtype=np.float64).reshape(-1, 29), 6).tolist() for column in columns]
+
+
+def normalize(value):
+    """
+    Rounds the floats and turns the numpy values into JSON ones.
+    """
+    if isinstance(value, dict):
+        return {key: normalize(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [normalize(item) for item in value]
+    if isinstance(value, (float, np.floating)):
+        return round(float(value), 6)
+    if isinstance(value, np.integer):
+        return int(value)
+    return value
+
+
+async def run_chunk():
+    data, target = chunk()
+    lamAPI = FixedLamAPI()
+    lookup = Lookup(data, lamAPI, target, Log())
+    await lookup.generate_candidates()
+    rows = lookup.get_rows()
+    first_features = await FeauturesExtraction(rows, lamAPI).compute_feautures()
+    Prediction.compute_batch_prediction([Prediction(rows, first_features, Model(1))], Model(1), "rho")
+    prelinking = utils.get_cea_pre_linking_data(METADATA, rows)
+    revision = FeaturesExtractionRevision(rows)
+    revision_features = revision.compute_features()
+    Prediction(rows, revision_features, Model(2)).compute_prediction("rho'")
+    collections = {name: Collection() for name in ["ceaPrelinking", "cea", "cta", "cpa", "candidateScored"]}
+    Decision(METADATA, prelinking, rows, revision._cta, revision._cpa_pair, collections).store_data()
+    return normalize({
+        "features": features(first_features),
+        "revisionFeatures": features(revision_features),
+        "cta": revision._cta,
+        "cpa": revision._cpa,
+        "cea": collections["cea"].documents,
+        "ctaDocuments": collections["cta"].documents,
+        "cpaDocuments": collections["cpa"].documents
+    })
+
+
+def test_matches_the_row_by_row_implementation():
+    with open(BASELINE) as f:
+        expected = json.load(f)
+    result = json.loads(json.dumps(asyncio.run(run_chunk())))
+    for key in expected:
+        assert result[key] == expected[key], key
+
+
+if __name__ == "__main__":
+    json.dump(asyncio.run(run_chunk()), sys.stdout, sort_keys=True)
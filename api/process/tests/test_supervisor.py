@@ -0,0 +1,63 @@
+import os
+
+for name, value in {"REDIS_ENDPOINT": "localhost", "REDIS_JOB_DB": "0", "MONGO_ENDPOINT": "localhost:27017",
+                    "MONGO_INITDB_ROOT_USERNAME": "test", "MONGO_INITDB_ROOT_PASSWORD": "test",
+                    "MONGO_DBNAME": "test"}.items():
+    os.environ.setdefault(name, value)
+
+from supervisor import Supervisor
+
+
+class ExitedProcess:
+    pid = 42
+    exitcode = 1
+
+    def is_alive(self):
+        return False
+
+
+class FlakyLease:
+    def __init__(self, failures):
+        self.failures = failures
+        self.released = []
+
+    def release_worker(self, worker_id):
+        if self.failures > 0:
+            self.failures -= 1
+            raise ConnectionError("Mongo unavailable")
+        self.released.append(worker_id)
+        return 1
+
+
+class Stats:
+    def __init__(self):
+        self.removed = []
+
+    def hdel(self, key, field):
+        self.removed.append(field)
+
+
+def make_supervisor(lease):
+    s = Supervisor.__new__(Supervisor)
+    s._processes = [ExitedProcess()]
+    s._started_at = [0]
+    s._exited = set()
+    s._job_active = Stats()
+    s._lease = lease
+    s._start_worker = lambda slot: s._processes.__setitem__(slot, None)
+    return s
+
+
+def test_failed_clean_up_is_retried_and_the_slot_restarted():
+    lease = FlakyLease(failures=1)
+    s = make_supervisor(lease)
+    worker_id = s._worker_id(ExitedProcess())
+
+    s._check_workers()  # the release fails, the slot is restarted anyway
+    assert s._processes == [None]
+    assert s._exited == {worker_id}
+    assert lease.released == []
+
+    s._check_workers()
+    assert s._exited == set()
+    assert lease.released == [worker_id]
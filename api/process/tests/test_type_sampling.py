@@ -0,0 +1,42 @@
+from phases.type_sampling import TypeSampling
+
+
+class Tables:
+    def __init__(self):
+        self.samples = []
+
+    def find_one(self, query, projection):
+        return {"typeSample": self.samples}
+
+
+class Rows:
+    def __init__(self, statuses):
+        self.statuses = statuses  # page -> status
+
+    def count_documents(self, query, limit=0):
+        pending = [page for page, status in self.statuses.items()
+                   if page <= query["page"]["$lte"] and status in query["status"]["$in"]]
+        return min(len(pending), limit or len(pending))
+
+
+def metadata(page):
+    return {"datasetName": "D", "tableName": "T", "page": page}
+
+
+def test_chunks_wait_for_the_sample_of_their_table():
+    tables, rows = Tables(), Rows({1: "DOING", 2: "TODO", 3: "TODO"})
+    sampling = TypeSampling(tables, rows, sample_chunks=1)
+    assert not sampling.is_deferred(metadata(1))
+    assert sampling.is_deferred(metadata(2))
+
+    tables.samples = [{"page": 1, "rows": 10, "cta": {"0": [["Q5", 0.9]]}}]
+    rows.statuses[1] = "DONE"
+    assert not sampling.is_deferred(metadata(2))
+    assert sampling.get_constraints(metadata(3)) == {"0": ["Q5"]}
+    assert sampling.stats()["deferredChunks"] == 1
+
+
+def test_chunks_are_not_deferred_when_the_sample_failed():
+    sampling = TypeSampling(Tables(), Rows({1: "FAILED", 2: "TODO"}), sample_chunks=1)
+    assert not sampling.is_deferred(metadata(2))
+    assert sampling.get_constraints(metadata(2)) is None
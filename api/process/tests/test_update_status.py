@@ -0,0 +1,91 @@
+import importlib.util
+import os
+
+path = os.path.join(os.path.dirname(__file__), "..", "..", "utils", "update_status.py")
+spec = importlib.util.spec_from_file_location("update_status", path)
+update_status = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(update_status)
+
+
+class Collection:
+    """
+    In-memory stand-in of the collections used by update_status: equality filters,
+    $set updates and the aggregations grouping the tables by status.
+    """
+    def __init__(self, documents=None, grouped=None):
+        self.documents = documents or []
+        self._grouped = grouped  # result of the aggregation of the chunks by table
+
+    def _match(self, query):
+        return [document for document in self.documents if all(document.get(key) == value for key, value in query.items())]
+
+    def find(self, query):
+        return self._match(query)
+
+    def find_one(self, query):
+        documents = self._match(query)
+        return documents[0] if len(documents) > 0 else None
+
+    def _set(self, document, values):
+        for key, value in values.items():
+            target = document
+            *parents, name = key.split(".")
+            for parent in parents:
+                target = target.setdefault(parent, {})
+            target[name] = value
+
+    def update_one(self, query, update):
+        for document in self._match(query)[:1]:
+            self._set(document, update["$set"])
+
+    def update_many(self, query, update):
+        for document in self._match(query):
+            self._set(document, update["$set"])
+
+    def aggregate(self, pipeline):
+        if self._grouped is not None:
+            return self._grouped
+        counts = {}
+        for document in self._match(pipeline[0]["$match"]):
+            counts[document["status"]] = counts.get(document["status"], 0) + 1
+        return [{"_id": status, "count": count} for status, count in counts.items()]
+
+
+def chunks(job, table, **status):
+    return {"_id": {"datasetName": "d", "tableName": table, "idJob": job}, "status": status}
+
+
+def run(grouped):
+    row_c = Collection([{"idJob": "j", "state": "READY"}], grouped)
+    table_c = Collection([{"datasetName": "d", "tableName": table, "idJob": "j", "status": "TODO"} for table in ["t1", "t2"]])
+    job_c = Collection([{"_id": "j", "startTime": 0, "startTimeComputation": None}])
+    dataset_c = Collection([{"datasetName": "d"}])
+    update_status.update_status(row_c, table_c, job_c, dataset_c)
+    return row_c, table_c, job_c, dataset_c
+
+
+def test_table_status():
+    assert update_status.table_status(1, 0, 3, 2) == "TODO"
+    assert update_status.table_status(0, 1, 3, 2) == "DOING"
+    assert update_status.table_status(0, 0, 3, 2) == "FAILED"
+    assert update_status.table_status(0, 0, 3, 0) == "DONE"
+
+
+def test_all_chunks_failed():
+    row_c, table_c, job_c, dataset_c = run([chunks("j", "t1", FAILED=2), chunks("j", "t2", FAILED=1)])
+    assert [table["status"] for table in table_c.documents] == ["FAILED", "FAILED"]
+    job = job_c.documents[0]
+    assert job["%"] == 0 and job["active"] is False
+    assert job["status"] == {"TODO": 0, "DOING": 0, "DONE": 0, "FAILED": 2}
+    assert row_c.documents[0]["state"] == "EXIT"
+    assert dataset_c.documents[0]["process"] == "DONE" and dataset_c.documents[0]["status"]["FAILED"] == 2
+
+
+def test_failed_chunks_count_in_the_totals():
+    row_c, table_c, job_c, dataset_c = run([chunks("j", "t1", DONE=3, FAILED=1), chunks("j", "t2", TODO=1, DONE=3)])
+    assert table_c.documents[0]["status"] == "FAILED"
+    assert table_c.documents[0]["taskStatus"] == {"TODO": 0, "DOING": 0, "DONE": 3, "FAILED": 1}
+    job = job_c.documents[0]
+    assert job["%"] == 0.75 and job["active"] is True
+    assert row_c.documents[0]["state"] == "READY"
+    assert dataset_c.documents[0]["process"] == "DOING"
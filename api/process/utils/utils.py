@@ -30,6 +30,20 @@ def word2ngrams(text, n=None):
     return [text[i:i+n] for i in range(len(text)-n+1)]
 
 
+def guess_datatype(value):
+    """ Datatype of a cell: NUMBER, DATETIME (year-month-day) or STRING. """
+    value = str(value).strip()
+    try:
+        float(value.replace(",", ""))
+        return "NUMBER"
+    except ValueError:
+        pass
+    parts = value.replace("/", "-").split("-")
+    if len(parts) == 3 and all(part.isdigit() for part in parts):
+        return "DATETIME"
+    return "STRING"
+
+
 def get_ngrams(text, n=3):
     ngrams = set()
     for token in text.split(" "):
@@ -87,11 +101,11 @@ def get_cea_pre_linking_data(metadata, rows):
         winning_candidates =  []
         cea = {}
         for cell in row.get_cells():
-            candidates = cell.candidates()
+            rho = cell.scores("rho")
             wc = []
-            for candidate in cell.candidates():
-                if (candidates[0]["rho"] - candidate["rho"]) < THRESHOLD:
-                    wc.append(candidate.copy())
+            for index in range(cell.n_candidates()):
+                if (rho[0] - rho[index]) < THRESHOLD:
+                    wc.append(cell.candidate(index))
             
             if len(wc) == 1:
                 cea[str(cell._id_col)] = wc[0]["id"]
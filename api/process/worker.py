@@ -0,0 +1,551 @@
+import asyncio
+import copy
+import json
+import os
+import socket
+import threading
+import time
+import traceback
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import redis
+import redis.asyncio
+from keras.models import load_model
+
+import utils.utils as utils
+from phases.data_preparation import DataPreparation
+from phases.featuresExtractionRevision import FeaturesExtractionRevision
+from phases.feauturesExtraction import FeauturesExtraction
+from phases.lookup import Lookup
+from phases.prelookup import PreLookup
+from phases.candidate_pruning import CandidatePruning
+from phases.type_sampling import TypeSampling, SAMPLE_CONSTRAIN, SAMPLE_DEFER_DELAY
+from phases.prediction import Prediction
+from phases.decision import Decision
+from wrapper.lamAPI import LamAPI, endpoint_policies, CONCURRENCY_MIN, CONCURRENCY_MAX, TARGET_LATENCY
+from wrapper.lamAPISnapshot import LamAPISnapshot
+from wrapper.Database import MongoDBWrapper  # MongoDB database wrapper
+from wrapper.ChunkQueue import ChunkQueue
+from wrapper.ChunkLease import ChunkLease, Heartbeat
+from wrapper.LogSink import LogSink
+from wrapper.archive import LamAPIArchive, MODES as LAMAPI_MODES
+from wrapper.concurrency import AdaptiveLimiter, RedisTokenBucket
+from wrapper.cache import LRUCache, RedisCache, TieredCache, load_snapshot, save_snapshot
+
+
+REDIS_ENDPOINT = os.environ["REDIS_ENDPOINT"]
+REDIS_JOB_DB = int(os.environ["REDIS_JOB_DB"])
+REDIS_CACHE_DB = int(os.environ.get("REDIS_CACHE_DB", REDIS_JOB_DB))
+LAMAPI_HOST = os.environ["LAMAPI_ENDPOINT"]
+LAMAPI_TOKEN = os.environ["LAMAPI_TOKEN"]
+
+PN_NEURAL_PATH = "./process/ml_models/Linker_PN_100.h5"
+RN_NEURAL_PATH = "./process/ml_models/Linker_RN_100.h5"
+
+QUEUE_BLOCK_TIMEOUT = int(os.environ.get("QUEUE_BLOCK_TIMEOUT", 1))  # seconds an idle worker blocks on the chunk queue
+STATS_WINDOW = 60  # seconds considered for the recent chunks/s rate
+STATS_KEY = "WORKERS"  # Redis hash holding the throughput of every worker
+BATCH_MAX_CHUNKS = int(os.environ.get("BATCH_MAX_CHUNKS", 4))  # chunks claimed together by a worker
+BATCH_MAX_ROWS = int(os.environ.get("BATCH_MAX_ROWS", 100))  # row budget of a batch
+PIPELINE_MODE = os.environ.get("PIPELINE_MODE", "0") == "1"  # overlap the stages of consecutive batches
+PIPELINE_QUEUE_SIZE = int(os.environ.get("PIPELINE_QUEUE_SIZE", 1))  # batches waiting between two stages
+LOOKUP_CACHE_SIZE = int(os.environ.get("LOOKUP_CACHE_SIZE", 10000))  # lookup results kept in memory by a worker
+LOOKUP_CACHE_TTL = int(os.environ.get("LOOKUP_CACHE_TTL", 7 * 24 * 3600))  # seconds a cached lookup result is valid
+LOOKUP_CACHE_SHARED = os.environ.get("LOOKUP_CACHE_SHARED", "1") == "1"  # share the lookup results through Redis
+LAMAPI_CONCURRENCY = int(os.environ.get("LAMAPI_CONCURRENCY", 50))  # starting concurrency of the LamAPI requests
+LAMAPI_RATE_LIMIT = float(os.environ.get("LAMAPI_RATE_LIMIT", 0))  # requests per second shared by all the workers, 0 for no limit
+LAMAPI_RATE_BURST = float(os.environ.get("LAMAPI_RATE_BURST", 0)) or None
+LAMAPI_MODE = os.environ.get("LAMAPI_MODE", "live")  # live, record or replay the LamAPI responses
+LAMAPI_ARCHIVE = os.environ.get("LAMAPI_ARCHIVE", "./lamapi_archive.sqlite")  # archive of the record and replay modes
+PRELOOKUP = os.environ.get("PRELOOKUP", "1") == "1"  # resolve the mentions of a whole table once, in the background
+LAMAPI_SNAPSHOT = os.environ.get("LAMAPI_SNAPSHOT")  # local KG snapshot used instead of LamAPI, {kg} is replaced by the KG
+ENTITY_ENDPOINTS = ["objects", "literals", "types", "predicates", "labels"]  # LamAPI entity endpoints with a cache
+ENTITY_CACHE_SIZE = int(os.environ.get("ENTITY_CACHE_SIZE", 50000))  # entities kept in memory for each endpoint
+ENTITY_CACHE_MAX_MB = int(os.environ.get("ENTITY_CACHE_MAX_MB", 1024))  # memory of the entity caches, split among the endpoints
+ENTITY_CACHE_TTL = int(os.environ.get("ENTITY_CACHE_TTL", 30 * 24 * 3600))  # seconds a cached entity is valid
+ENTITY_CACHE_SHARED = os.environ.get("ENTITY_CACHE_SHARED", "1") == "1"  # share the entity data through Redis
+ENTITY_CACHE_SNAPSHOT = os.environ.get("ENTITY_CACHE_SNAPSHOT")  # file used to warm the entity caches at start-up
+
+
+class Throughput:
+    """
+    Keeps track of the chunks and rows processed by a worker.
+    """
+    def __init__(self, window=STATS_WINDOW):
+        self._window = window
+        self._start = time.time()
+        self._events = deque()
+        self._lock = threading.Lock()  # chunks are added by the storage thread of the pipelined mode
+        self.chunks = 0
+        self.rows = 0
+
+    def add(self, n_rows):
+        now = time.time()
+        with self._lock:
+            self.chunks += 1
+            self.rows += n_rows
+            self._events.append(now)
+            self._trim(now)
+
+    def _trim(self, now):
+        while self._events and now - self._events[0] > self._window:
+            self._events.popleft()
+
+    def to_dict(self):
+        now = time.time()
+        with self._lock:
+            self._trim(now)
+            chunks, rows, recent_chunks = self.chunks, self.rows, len(self._events)
+        uptime = max(now - self._start, 1e-6)
+        recent = min(uptime, self._window)
+        return {
+            "chunks": chunks,
+            "rows": rows,
+            "uptime": round(uptime, 2),
+            "chunksPerSecond": round(chunks / uptime, 4),
+            "recentChunksPerSecond": round(recent_chunks / recent, 4),
+            "updatedAt": now
+        }
+
+
+class Chunk:
+    """
+    A row document claimed by a worker and the state of its pipeline.
+    """
+    def __init__(self, data):
+        self.data = data
+        self.id = data["_id"]
+        self.metadata = {
+            "datasetName": data["datasetName"],
+            "tableName": data["tableName"],
+            "kgReference": data["kgReference"],
+            "page": data["page"]
+        }
+        self.target = data["target"]
+        self.obj_row_update = {"status": "DONE", "time": None}
+        self.rows = None
+        self.features = None
+        self.revision = None
+        self.cea_prelinking_data = None
+        self.pruning_audit = None
+
+
+class Worker:
+    """
+    Long-running computation worker.
+
+    Models, the MongoDB wrapper and the LamAPI clients are created once and reused
+    for every chunk claimed from the row collection.
+    """
+    def __init__(self, worker_id=None):
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+        self._pn_model = load_model(PN_NEURAL_PATH)
+        self._rn_model = load_model(RN_NEURAL_PATH)
+        self._job_active = redis.Redis(host=REDIS_ENDPOINT, db=REDIS_JOB_DB)
+        self._queue = ChunkQueue(self._job_active)
+
+        # Initialize MongoDB wrapper and get collections for different data models
+        self._mongoDBWrapper = MongoDBWrapper()
+        self._log_c = LogSink(self._mongoDBWrapper.get_collection("log"))  # buffered, written in bulk
+        self._row_c = self._mongoDBWrapper.get_collection("row")
+        self._table_c = self._mongoDBWrapper.get_collection("table")
+        self._lease = ChunkLease(self._row_c, self._queue)
+        self._collections = {
+            "ceaPrelinking": self._mongoDBWrapper.get_collection("ceaPrelinking"),
+            "cea": self._mongoDBWrapper.get_collection("cea"),
+            "cta": self._mongoDBWrapper.get_collection("cta"),
+            "cpa": self._mongoDBWrapper.get_collection("cpa"),
+            "candidateScored": self._mongoDBWrapper.get_collection("candidateScored")
+        }
+        self._lamAPIs = {}
+        self._prelooked = set()  # tables whose pre-lookup was already attempted by this worker
+        self._prelookup_tasks = set()
+        self._pruning = CandidatePruning()
+        self._sampling = TypeSampling(self._table_c, self._row_c) if SAMPLE_CONSTRAIN else None
+        if LAMAPI_MODE not in LAMAPI_MODES:
+            raise ValueError(f"Invalid LAMAPI_MODE {LAMAPI_MODE}, expected one of {LAMAPI_MODES}")
+        self._lamAPI_archive = LamAPIArchive(LAMAPI_ARCHIVE, LAMAPI_MODE) if LAMAPI_MODE != "live" else None
+        # in record and replay mode every response goes through the archive: the shared caches and the
+        # snapshot would answer requests the archive never sees, or serve responses missing from it
+        archived = self._lamAPI_archive is not None
+        self._cache_snapshot = ENTITY_CACHE_SNAPSHOT if not archived else None
+
+        # one client for the shared caches and the rate limiter, closed by close()
+        self._cache_redis = redis.asyncio.Redis(host=REDIS_ENDPOINT, db=REDIS_CACHE_DB)
+        self._lookup_cache = TieredCache(
+            "lookup",
+            LRUCache(LOOKUP_CACHE_SIZE, LOOKUP_CACHE_TTL),
+            RedisCache(self._cache_redis, "LOOKUP", LOOKUP_CACHE_TTL) if LOOKUP_CACHE_SHARED and not archived else None
+        )
+        # one concurrency limit, one set of circuit breakers (and optionally one request rate shared
+        # with the other workers) for all the LamAPI clients
+        self._lamAPI_limiter = AdaptiveLimiter(LAMAPI_CONCURRENCY, CONCURRENCY_MIN, CONCURRENCY_MAX, TARGET_LATENCY)
+        self._lamAPI_policies = endpoint_policies()
+        self._lamAPI_rate_limiter = None
+        if LAMAPI_RATE_LIMIT > 0:
+            self._lamAPI_rate_limiter = RedisTokenBucket(self._cache_redis, "LAMAPI_RATE", LAMAPI_RATE_LIMIT, LAMAPI_RATE_BURST)
+        endpoint_max_bytes = ENTITY_CACHE_MAX_MB * 1024 * 1024 // len(ENTITY_ENDPOINTS)
+        self._entity_caches = {
+            endpoint: TieredCache(
+                endpoint,
+                LRUCache(ENTITY_CACHE_SIZE, ENTITY_CACHE_TTL, endpoint_max_bytes),
+                RedisCache(self._cache_redis, f"ENTITY:{endpoint}", ENTITY_CACHE_TTL) if ENTITY_CACHE_SHARED and not archived else None
+            )
+            for endpoint in ENTITY_ENDPOINTS
+        }
+        if self._cache_snapshot:
+            try:
+                print(f"Loaded {load_snapshot(self._cache_snapshot, self._entity_caches)} cached entities", flush=True)
+            except Exception as e:
+                print(f"Unable to load the entity cache snapshot: {e}", flush=True)
+        self.throughput = Throughput()
+
+    def get_lamAPI(self, kg_reference):
+        if kg_reference not in self._lamAPIs and LAMAPI_SNAPSHOT:
+            self._lamAPIs[kg_reference] = LamAPISnapshot(LAMAPI_SNAPSHOT.format(kg=kg_reference), kg=kg_reference)
+        elif kg_reference not in self._lamAPIs:
+            self._lamAPIs[kg_reference] = LamAPI(LAMAPI_HOST, LAMAPI_TOKEN, self._mongoDBWrapper, kg=kg_reference,
+                                                    lookup_cache=self._lookup_cache, entity_caches=self._entity_caches,
+                                                    limiter=self._lamAPI_limiter, rate_limiter=self._lamAPI_rate_limiter,
+                                                    policies=self._lamAPI_policies, archive=self._lamAPI_archive,
+                                                    log_c=self._log_c)
+        return self._lamAPIs[kg_reference]
+
+    async def close(self):
+        """
+        Close the sessions of the LamAPI clients and of the shared caches.
+        """
+        for task in self._prelookup_tasks:
+            task.cancel()
+        await asyncio.gather(*self._prelookup_tasks, return_exceptions=True)
+        for lamAPI in self._lamAPIs.values():
+            await lamAPI.close()
+        self._lamAPIs = {}
+        if self._cache_snapshot:
+            try:
+                save_snapshot(self._cache_snapshot, self._entity_caches)
+            except Exception as e:
+                print(f"Unable to save the entity cache snapshot: {e}", flush=True)
+        await self._cache_redis.aclose()
+        if self._lamAPI_archive is not None:
+            self._lamAPI_archive.close()
+        self._log_c.close()
+
+    def claim_chunk(self, timeout=None):
+        """
+        Pops chunk ids from the queue until one of them is still TODO and leases it to this worker.
+        Ids of chunks already claimed or deleted are skipped.
+        """
+        while True:
+            _id = self._queue.pop(timeout)
+            if _id is None:
+                return None
+            data = self._lease.claim(_id, self.worker_id)
+            if data is not None:
+                return data
+
+    def claim_chunks(self, timeout=None):
+        """
+        Claims up to BATCH_MAX_CHUNKS chunks, stopping as soon as BATCH_MAX_ROWS rows are reached.
+        Only the first claim blocks (at most timeout seconds) waiting for the queue.
+
+        In sample-then-constrain mode the chunks waiting for the sample of their table are
+        deferred, and the claim stops at the first one: the queue may hold only those.
+        """
+        chunks = []
+        n_rows = 0
+        while len(chunks) < BATCH_MAX_CHUNKS and n_rows < BATCH_MAX_ROWS:
+            data = self.claim_chunk(timeout if len(chunks) == 0 else None)
+            if data is None:
+                break
+            chunk = Chunk(data)
+            if self._sampling is not None and self._sampling.is_deferred(chunk.metadata):
+                self._lease.defer(chunk.id, self.worker_id)
+                if len(chunks) == 0:
+                    time.sleep(SAMPLE_DEFER_DELAY)  # do not spin on the deferred chunks
+                break
+            chunks.append(chunk)
+            n_rows += len(data["rows"])
+        return chunks
+
+    async def _run_stage(self, chunks, stage):
+        """
+        Runs an async stage for every chunk concurrently. Chunks whose stage
+        raises are logged and removed from the rest of the batch.
+        """
+        results = await asyncio.gather(*[stage(chunk) for chunk in chunks], return_exceptions=True)
+        alive = []
+        for chunk, result in zip(chunks, results):
+            if isinstance(result, Exception):
+                self._log_failure(chunk, result)
+            else:
+                alive.append(chunk)
+        return alive
+
+    def _log_failure(self, chunk, error):
+        """
+        Logs the error of a chunk and gives the chunk back to the queue (or marks it FAILED).
+        """
+        self._log_c.insert_one({
+            "datasetName": chunk.metadata["datasetName"],
+            "tableName": chunk.metadata["tableName"],
+            "error": str(error),
+            "stackTrace": "".join(traceback.format_exception(type(error), error, error.__traceback__))
+        })
+        self._lease.release(chunk.id, self.worker_id, str(error))
+
+    async def _prepare_table(self, chunks):
+        """
+        Column analysis and normalization of the chunks of the same table, done once on their rows.
+        """
+        data = chunks[0].data
+        rows_data = [row for chunk in chunks for row in chunk.data["rows"]]
+        dp = DataPreparation(data["header"], rows_data, self.get_lamAPI(data["kgReference"]))
+        column_metadata, target = await dp.compute_datatype(data["column"], data["target"])
+        if target["SUBJ"] is not None:
+            column_metadata[str(target["SUBJ"])] = "SUBJ"
+        for chunk in chunks:
+            chunk.target = copy.deepcopy(target)
+            chunk.obj_row_update["column"] = dict(column_metadata)
+            chunk.obj_row_update["metadata"] = {
+                "column": [{"idColumn": int(id_col), "tag": column_metadata[id_col]} for id_col in column_metadata]
+            }
+            chunk.obj_row_update["target"] = chunk.target
+        dp.rows_normalization()
+
+    async def _prepare(self, chunks):
+        tables = {}
+        for chunk in chunks:
+            key = (chunk.metadata["datasetName"], chunk.metadata["tableName"], chunk.metadata["kgReference"])
+            tables.setdefault(key, []).append(chunk)
+        results = await asyncio.gather(*[self._prepare_table(group) for group in tables.values()], return_exceptions=True)
+        alive = []
+        for group, result in zip(tables.values(), results):
+            if isinstance(result, Exception):
+                for chunk in group:
+                    self._log_failure(chunk, result)
+            else:
+                alive.extend(group)
+        return alive
+
+    async def _extract(self, chunks):
+        """
+        I/O bound stage: column analysis, lookups and feature extraction, run
+        concurrently for all the chunks of the batch.
+        """
+        lookup_caches = {}
+
+        async def lookup(chunk):
+            kg_reference = chunk.metadata["kgReference"]
+            cache = lookup_caches.setdefault(kg_reference, {})
+            audit = self._pruning.audit()
+            constraints = None
+            if self._sampling is not None:
+                constraints = await asyncio.to_thread(self._sampling.get_constraints, chunk.metadata)
+            l = Lookup(chunk.data, self.get_lamAPI(kg_reference), chunk.target, self._log_c, kg_reference, chunk.data["candidateSize"], cache,
+                       self._pruning, audit, constraints, self._sampling.limit if self._sampling is not None else None)
+            await l.generate_candidates()
+            chunk.rows = l.get_rows()
+            chunk.pruning_audit = l.pruning_audit if audit else None
+            if constraints is not None:
+                self._sampling.record_lookup(l.constraint_stats)
+
+        async def feature_extraction(chunk):
+            chunk.features = await FeauturesExtraction(chunk.rows, self.get_lamAPI(chunk.metadata["kgReference"])).compute_feautures()
+
+        chunks = await self._prepare(chunks)
+        # the untyped pre-lookup would be wasted on the tables whose lookups are type-constrained
+        if PRELOOKUP and not LAMAPI_SNAPSHOT and self._sampling is None:
+            self._start_prelookups(chunks)
+        chunks = await self._run_stage(chunks, lookup)
+        chunks = await self._run_stage(chunks, feature_extraction)
+        return chunks
+
+    def _start_prelookups(self, chunks):
+        """
+        Starts in the background the pre-lookup of the tables of the batch not seen
+        before by this worker. The lookups of the chunks do not wait for it: they are
+        served by the lookup cache once the pre-lookup stored their mentions, and
+        otherwise only share the request of a mention the pre-lookup is fetching at
+        the same time (single-flight of LamAPI.lookup_many).
+        """
+        for chunk in chunks:
+            key = (chunk.metadata["datasetName"], chunk.metadata["tableName"])
+            if key in self._prelooked:
+                continue
+            if len(self._prelooked) >= 10000:
+                self._prelooked.clear()
+            self._prelooked.add(key)
+            prelookup = PreLookup(self._table_c, self._row_c, self.get_lamAPI(chunk.metadata["kgReference"]), self.worker_id)
+            task = asyncio.create_task(self._prelookup(prelookup, key, list(chunk.target["NE"])))
+            self._prelookup_tasks.add(task)
+            task.add_done_callback(self._prelookup_tasks.discard)
+
+    async def _prelookup(self, prelookup, key, ne_columns):
+        try:
+            n_mentions = await prelookup.run(*key, ne_columns)
+            if n_mentions is not None:
+                print(f"Pre-lookup of {key[0]}/{key[1]}: {n_mentions} mentions", flush=True)
+        except Exception as e:
+            print(f"Pre-lookup of {key[0]}/{key[1]} failed: {e}", flush=True)
+
+    def _infer(self, chunks):
+        """
+        CPU bound stage: one model.predict per model for the whole batch and the revision of the features.
+        """
+        if len(chunks) == 0:
+            return chunks
+        try:
+            predictions = [Prediction(chunk.rows, chunk.features, self._pn_model) for chunk in chunks]
+            Prediction.compute_batch_prediction(predictions, self._pn_model, "rho")
+            for chunk in chunks:
+                chunk.cea_prelinking_data = utils.get_cea_pre_linking_data(chunk.metadata, chunk.rows)
+                chunk.revision = FeaturesExtractionRevision(chunk.rows)
+                chunk.features = chunk.revision.compute_features()
+            predictions = [Prediction(chunk.rows, chunk.features, self._rn_model) for chunk in chunks]
+            Prediction.compute_batch_prediction(predictions, self._rn_model, "rho'")
+            for chunk in chunks:
+                if chunk.pruning_audit is not None:
+                    self._pruning.record_audit(chunk.rows, chunk.pruning_audit)
+        except Exception as e:
+            for chunk in chunks:
+                self._log_failure(chunk, e)
+            return []
+        return chunks
+
+    def _store(self, chunks, start):
+        """
+        Storage stage: decisions and status of every chunk. The time of a chunk
+        is its share (by rows) of the time elapsed since the batch was claimed.
+        """
+        execution_time = time.time() - start
+        n_rows = sum(len(chunk.data["rows"]) for chunk in chunks)
+        for chunk in chunks:
+            try:
+                revision = chunk.revision
+                storage = Decision(chunk.metadata, chunk.cea_prelinking_data, chunk.rows, revision._cta, revision._cpa_pair, self._collections)
+                storage.store_data()
+                if self._sampling is not None and self._sampling.is_sample(chunk.metadata):
+                    self._sampling.record_sample(chunk.metadata, revision._cta, len(chunk.data["rows"]))
+                chunk.obj_row_update["time"] = round(execution_time * len(chunk.data["rows"]) / max(n_rows, 1), 2)
+                self._lease.complete(chunk.id, self.worker_id, chunk.obj_row_update)
+                self.throughput.add(len(chunk.data["rows"]))
+            except Exception as e:
+                self._log_failure(chunk, e)
+        print("End", flush=True)
+
+    async def process_batch(self, chunks):
+        """
+        Pushes a batch of chunks through the pipeline: lookups and feature extraction run
+        concurrently for all the chunks, inference runs as one model.predict per model.
+        Every chunk gets its own status update.
+        """
+        start = time.time()
+        chunks = await self._extract(chunks)
+        chunks = self._infer(chunks)
+        self._store(chunks, start)
+
+    def publish_stats(self):
+        stats = self.throughput.to_dict()
+        stats["candidatePruning"] = self._pruning.stats()
+        if self._sampling is not None:
+            stats["typeSampling"] = self._sampling.stats()
+        stats["lamAPI"] = self._lamAPI_limiter.stats()
+        stats["lamAPIEndpoints"] = {endpoint: policy.stats() for endpoint, policy in self._lamAPI_policies.items()}
+        stats["lookupCache"] = self._lookup_cache.stats()
+        if self._lamAPI_archive is not None:
+            stats["lamAPIArchive"] = {"mode": LAMAPI_MODE, **self._lamAPI_archive.stats}
+        stats["entityCache"] = {endpoint: cache.stats() for endpoint, cache in self._entity_caches.items()}
+        try:
+            self._job_active.hset(STATS_KEY, self.worker_id, json.dumps(stats))
+        except redis.exceptions.ConnectionError as e:
+            print(f"Unable to publish worker stats: {e}", flush=True)
+
+    async def run_once(self, timeout=QUEUE_BLOCK_TIMEOUT):
+        chunks = await asyncio.to_thread(self.claim_chunks, timeout)
+        if len(chunks) == 0:
+            return False
+        with Heartbeat(self._lease, [chunk.id for chunk in chunks], self.worker_id):
+            await self.process_batch(chunks)
+        return True
+
+    async def run_pipeline(self, shutdown=None):
+        """
+        Pipelined mode: claiming, I/O bound extraction, inference and storage run as
+        separate stages connected by bounded queues, so the lookups of a batch overlap
+        with the inference and the storage of the previous ones.
+
+        If a stage fails the other stages are cancelled, the chunks not stored yet are
+        given back to the queue and the error is raised.
+        """
+        claimed = asyncio.Queue(PIPELINE_QUEUE_SIZE)
+        extracted = asyncio.Queue(PIPELINE_QUEUE_SIZE)
+        inferred = asyncio.Queue(PIPELINE_QUEUE_SIZE)
+        loop = asyncio.get_running_loop()
+        cpu_executor = ThreadPoolExecutor(max_workers=1)
+        store_executor = ThreadPoolExecutor(max_workers=1)
+        in_flight = {}  # heartbeat -> chunks claimed and not stored yet
+
+        async def claim():
+            while shutdown is None or not shutdown.is_set():
+                chunks = await asyncio.to_thread(self.claim_chunks, QUEUE_BLOCK_TIMEOUT)
+                if len(chunks) == 0:
+                    continue
+                heartbeat = Heartbeat(self._lease, [chunk.id for chunk in chunks], self.worker_id)
+                heartbeat.__enter__()
+                in_flight[heartbeat] = chunks
+                await claimed.put((chunks, time.time(), heartbeat))
+            await claimed.put(None)
+
+        async def extract():
+            while (item := await claimed.get()) is not None:
+                chunks, start, heartbeat = item
+                chunks = await self._extract(chunks)
+                await extracted.put((chunks, start, heartbeat))
+            await extracted.put(None)
+
+        async def infer():
+            while (item := await extracted.get()) is not None:
+                chunks, start, heartbeat = item
+                chunks = await loop.run_in_executor(cpu_executor, self._infer, chunks)
+                await inferred.put((chunks, start, heartbeat))
+            await inferred.put(None)
+
+        async def store():
+            while (item := await inferred.get()) is not None:
+                chunks, start, heartbeat = item
+                await loop.run_in_executor(store_executor, self._store, chunks, start)
+                heartbeat.__exit__(None, None, None)
+                del in_flight[heartbeat]
+                self.publish_stats()
+
+        stages = [asyncio.ensure_future(stage()) for stage in (claim, extract, infer, store)]
+        try:
+            done, _ = await asyncio.wait(stages, return_when=asyncio.FIRST_EXCEPTION)
+            for stage in done:
+                stage.result()  # raises the error of a failed stage
+        finally:
+            for stage in stages:
+                stage.cancel()
+            await asyncio.gather(*stages, return_exceptions=True)
+            # wait for the batch being inferred or stored, then give back what is left
+            await asyncio.to_thread(cpu_executor.shutdown)
+            await asyncio.to_thread(store_executor.shutdown)
+            for heartbeat, chunks in in_flight.items():
+                heartbeat.__exit__(None, None, None)
+                for chunk in chunks:
+                    self._lease.release(chunk.id, self.worker_id, "worker pipeline stopped")
+
+    async def run(self, shutdown=None):
+        print(f"Worker {self.worker_id} started", flush=True)
+        try:
+            if PIPELINE_MODE:
+                await self.run_pipeline(shutdown)
+            else:
+                while shutdown is None or not shutdown.is_set():
+                    if await self.run_once():
+                        self.publish_stats()
+        finally:
+            await self.close()
+        print(f"Worker {self.worker_id} stopped", flush=True)
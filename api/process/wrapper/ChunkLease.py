@@ -0,0 +1,158 @@
+import os
+import threading
+import time
+
+from pymongo import ReturnDocument
+
+LEASE_DURATION = int(os.environ.get("LEASE_DURATION", 300))  # seconds a claimed chunk is owned by a worker
+LEASE_MAX_RETRIES = int(os.environ.get("LEASE_MAX_RETRIES", 3))  # attempts before a chunk is marked FAILED
+
+
+class ChunkLease:
+    """
+    Ownership of the chunks (documents of the row collection) claimed by the workers.
+
+    A claimed chunk carries the id of its worker and a lease expiry. Workers renew the
+    lease while they process the chunk; chunks whose lease expired (e.g. the worker
+    crashed) are returned to TODO, up to LEASE_MAX_RETRIES times, then marked FAILED.
+    """
+    def __init__(self, row_c, queue, duration=LEASE_DURATION, max_retries=LEASE_MAX_RETRIES):
+        """
+        Initialize the ChunkLease.
+
+        :param row_c: The row collection.
+        :param queue: ChunkQueue where released chunks are pushed back.
+        :param duration: Seconds of validity of a lease.
+        :param max_retries: Number of releases after which a chunk is considered poisoned.
+        """
+        self._row_c = row_c
+        self._queue = queue
+        self.duration = duration
+        self._max_retries = max_retries
+
+    def claim(self, _id, worker_id):
+        """
+        Claim a TODO chunk.
+
+        :return: The chunk document or None if it is not TODO anymore.
+        """
+        return self._row_c.find_one_and_update(
+            {"_id": _id, "status": "TODO"},
+            {"$set": {"status": "DOING", "worker": worker_id, "leaseExpiresAt": time.time() + self.duration}}
+        )
+
+    def renew(self, ids, worker_id):
+        """
+        Extend the lease of the chunks still owned by the worker.
+
+        :return: Number of renewed leases.
+        """
+        return self._row_c.update_many(
+            {"_id": {"$in": list(ids)}, "status": "DOING", "worker": worker_id},
+            {"$set": {"leaseExpiresAt": time.time() + self.duration}}
+        ).modified_count
+
+    def complete(self, _id, worker_id, update):
+        """
+        Mark a chunk as DONE, storing the fields in update.
+        """
+        self._row_c.update_one(
+            {"_id": _id, "worker": worker_id},
+            {"$set": {**update, "status": "DONE"}, "$unset": {"leaseExpiresAt": ""}}
+        )
+
+    def defer(self, _id, worker_id):
+        """
+        Return a chunk owned by the worker to TODO, at the end of the queue, without
+        counting it as a retry.
+
+        :return: True if the chunk was deferred.
+        """
+        result = self._row_c.update_one(
+            {"_id": _id, "status": "DOING", "worker": worker_id},
+            {"$set": {"status": "TODO"}, "$unset": {"worker": "", "leaseExpiresAt": ""}}
+        )
+        if result.modified_count == 0:
+            return False
+        self._queue.push([_id])
+        return True
+
+    def release(self, _id, worker_id=None, error=None):
+        """
+        Return a DOING chunk to TODO (and to the queue), or mark it FAILED when it
+        exhausted its retries. Without worker_id only expired leases are released.
+
+        :return: The new status of the chunk, None if it was not released.
+        """
+        query = {"_id": _id, "status": "DOING"}
+        if worker_id is not None:
+            query["worker"] = worker_id
+        else:
+            query["$or"] = [{"leaseExpiresAt": {"$lt": time.time()}}, {"leaseExpiresAt": {"$exists": False}}]
+
+        update = {"$set": {"status": "TODO"}, "$inc": {"retries": 1}, "$unset": {"worker": "", "leaseExpiresAt": ""}}
+        if error is not None:
+            update["$set"]["error"] = error
+        chunk = self._row_c.find_one_and_update(query, update, {"retries": 1}, return_document=ReturnDocument.AFTER)
+        if chunk is None:
+            return None
+        if chunk["retries"] > self._max_retries:
+            self._row_c.update_one({"_id": _id, "status": "TODO"}, {"$set": {"status": "FAILED"}})
+            return "FAILED"
+        self._queue.push([_id])
+        return "TODO"
+
+    def release_worker(self, worker_id):
+        """
+        Release every chunk owned by a worker, e.g. after its process exited.
+
+        :return: Number of released chunks.
+        """
+        owned = self._row_c.find({"status": "DOING", "worker": worker_id}, {"_id": 1})
+        return sum(self.release(chunk["_id"], worker_id, "worker exited") is not None for chunk in owned)
+
+    def reap(self):
+        """
+        Release every chunk whose lease expired.
+
+        :return: Dictionary with the number of chunks returned to TODO and marked FAILED.
+        """
+        stats = {"TODO": 0, "FAILED": 0}
+        expired = self._row_c.find({
+            "status": "DOING",
+            "$or": [{"leaseExpiresAt": {"$lt": time.time()}}, {"leaseExpiresAt": {"$exists": False}}]
+        }, {"_id": 1})
+        for chunk in expired:
+            status = self.release(chunk["_id"], error="lease expired")
+            if status is not None:
+                stats[status] += 1
+        return stats
+
+
+class Heartbeat:
+    """
+    Renews the leases of a set of chunks from a background thread, so that the
+    leases are kept alive also during CPU bound phases that block the event loop.
+    """
+    def __init__(self, lease, ids, worker_id):
+        self._lease = lease
+        self._ids = list(ids)
+        self._worker_id = worker_id
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        interval = max(self._lease.duration / 3, 1)
+        while not self._stop.wait(interval):
+            try:
+                self._lease.renew(self._ids, self._worker_id)
+            except Exception as e:
+                print(f"Unable to renew the leases: {e}", flush=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self._stop.set()
+        self._thread.join()
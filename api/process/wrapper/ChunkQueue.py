@@ -0,0 +1,54 @@
+from bson.objectid import ObjectId
+
+QUEUE_KEY = "CHUNKS"  # Redis list holding the ids of the chunks to process
+
+
+class ChunkQueue:
+    """
+    Work queue of the chunks (documents of the row collection) waiting to be processed.
+
+    The API pushes the ids of the stored chunks, the workers pop them and claim the
+    corresponding document by _id, so no worker has to scan the row collection.
+    """
+    def __init__(self, redis_client, key=QUEUE_KEY):
+        """
+        Initialize the ChunkQueue.
+
+        :param redis_client: Redis client used to store the queue.
+        :param key: Name of the Redis list.
+        """
+        self._redis = redis_client
+        self._key = key
+
+    def push(self, ids):
+        """
+        Append chunk ids to the queue.
+
+        :param ids: Iterable of ObjectId (or their string representation).
+        :return: Length of the queue after the push.
+        """
+        ids = [str(_id) for _id in ids]
+        if len(ids) == 0:
+            return len(self)
+        return self._redis.rpush(self._key, *ids)
+
+    def pop(self, timeout=None):
+        """
+        Remove the first chunk id from the queue.
+
+        :param timeout: Seconds to block waiting for an id, None to return immediately.
+        :return: ObjectId of the chunk or None if the queue is empty.
+        """
+        if timeout is None:
+            value = self._redis.lpop(self._key)
+        else:
+            result = self._redis.blpop([self._key], timeout=timeout)
+            value = result[1] if result is not None else None
+        if value is None:
+            return None
+        if isinstance(value, bytes):
+            value = value.decode()
+        return ObjectId(value)
+
+    def __len__(self):
+        return self._redis.llen(self._key)
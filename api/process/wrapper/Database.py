@@ -33,6 +33,7 @@ class MongoDBWrapper:
             
         c = self.get_collection('row')
         c.create_index([('state', 1)])
+        c.create_index([('status', 1)])
         c.create_index([('datasetName', 1)])
         c.create_index([('datasetName', 1), ('tableName', 1)])
 
@@ -0,0 +1,101 @@
+import os
+import random
+import threading
+import time
+from collections import deque
+
+LOG_FLUSH_INTERVAL = float(os.environ.get("LOG_FLUSH_INTERVAL", 2))  # seconds between two bulk writes of the logs
+LOG_BUFFER_SIZE = int(os.environ.get("LOG_BUFFER_SIZE", 10000))  # records kept in memory, the oldest are dropped
+LOG_RATE_LIMIT = int(os.environ.get("LOG_RATE_LIMIT", 100))  # records per error type written every minute
+LOG_SAMPLE_RATE = float(os.environ.get("LOG_SAMPLE_RATE", 0.01))  # fraction of the records written beyond the rate limit
+
+RATE_WINDOW = 60  # seconds of the rate limit window
+
+
+class LogSink:
+    """
+    Non-blocking replacement of the insert_one of the log collection.
+
+    Records are buffered in memory and written with insert_many from a background
+    thread, so a burst of errors (e.g. a LamAPI outage) never blocks the event loop
+    on MongoDB. Each error type is written at most rate_limit times per minute,
+    beyond that only a sample is kept; the number of dropped records is written
+    as a summary record of type "dropped".
+    """
+    def __init__(self, collection, flush_interval=LOG_FLUSH_INTERVAL, buffer_size=LOG_BUFFER_SIZE,
+                 rate_limit=LOG_RATE_LIMIT, sample_rate=LOG_SAMPLE_RATE):
+        """
+        Initialize the LogSink.
+
+        :param collection: The log collection.
+        :param flush_interval: Seconds between two writes.
+        :param buffer_size: Maximum number of records waiting to be written.
+        :param rate_limit: Records of the same type written every minute before sampling.
+        :param sample_rate: Fraction of the records kept beyond the rate limit.
+        """
+        self._collection = collection
+        self._flush_interval = flush_interval
+        self._rate_limit = rate_limit
+        self._sample_rate = sample_rate
+        self._buffer = deque(maxlen=buffer_size)
+        self._lock = threading.Lock()
+        self._window_start = time.time()
+        self._window_counts = {}
+        self._dropped = {}
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _error_type(self, record):
+        return str(record.get("type") or record.get("error") or "generic")[:100]
+
+    def insert_one(self, record):
+        """
+        Queue a record, returns immediately.
+        """
+        error_type = self._error_type(record)
+        with self._lock:
+            if time.time() - self._window_start > RATE_WINDOW:
+                self._window_start = time.time()
+                self._window_counts = {}
+            count = self._window_counts.get(error_type, 0) + 1
+            self._window_counts[error_type] = count
+            if count > self._rate_limit and random.random() >= self._sample_rate:
+                self._dropped[error_type] = self._dropped.get(error_type, 0) + 1
+                return
+            if len(self._buffer) == self._buffer.maxlen:
+                dropped_type = self._error_type(self._buffer[0])
+                self._dropped[dropped_type] = self._dropped.get(dropped_type, 0) + 1
+            self._buffer.append(record)
+            if len(self._buffer) >= self._buffer.maxlen // 2:
+                self._wake.set()
+
+    def flush(self):
+        with self._lock:
+            records = list(self._buffer)
+            self._buffer.clear()
+            if len(self._dropped) > 0:
+                records.append({"type": "dropped", "counts": self._dropped, "time": time.time()})
+                self._dropped = {}
+        if len(records) == 0:
+            return
+        try:
+            self._collection.insert_many(records, ordered=False)
+        except Exception as e:
+            print(f"Unable to write {len(records)} log records: {e}", flush=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self._flush_interval)
+            self._wake.clear()
+            self.flush()
+
+    def close(self):
+        """
+        Write the pending records and stop the background thread.
+        """
+        self._stop.set()
+        self._wake.set()
+        self._thread.join()
+        self.flush()
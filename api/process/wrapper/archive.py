@@ -0,0 +1,125 @@
+import json
+import os
+import sqlite3
+import threading
+import zlib
+
+MODES = ["live", "record", "replay"]
+ARCHIVE_FLUSH_INTERVAL = float(os.environ.get("LAMAPI_ARCHIVE_FLUSH_INTERVAL", 1))  # seconds between two writes of the recorded responses
+ARCHIVE_FLUSH_SIZE = 5000  # recorded responses that trigger a write before the interval
+
+
+class LamAPIArchive:
+    """
+    On-disk archive of LamAPI responses, stored per item (the candidates of a
+    mention, the data of an entity, ...) in SQLite as compressed JSON, so a run
+    can be replayed offline whatever the batching of its requests.
+
+    In record mode the responses of LamAPI are saved, in replay mode they are
+    served from the archive and LamAPI is never contacted; items missing from
+    the archive are treated as missing from the LamAPI response.
+
+    Recorded responses are buffered and written in one transaction by a background
+    thread, so recording never blocks the event loop on SQLite.
+    """
+    def __init__(self, path, mode, flush_interval=ARCHIVE_FLUSH_INTERVAL):
+        """
+        Initialize the LamAPIArchive.
+
+        :param path: Path of the SQLite file, shared by the workers.
+        :param mode: "record" or "replay".
+        :param flush_interval: Seconds between two writes of the recorded responses.
+        """
+        if mode not in ("record", "replay"):
+            raise ValueError(f"Invalid archive mode: {mode}")
+        self.mode = mode
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS response (endpoint TEXT, key TEXT, value BLOB, PRIMARY KEY (endpoint, key))"
+        )
+        self._db.commit()
+        self.stats = {"hits": 0, "misses": 0, "recorded": 0}
+        self._flush_interval = flush_interval
+        self._pending = {}  # (endpoint, key) -> value recorded and not written yet
+        self._pending_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        if mode == "record":
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    @property
+    def replay(self):
+        return self.mode == "replay"
+
+    def get_many(self, endpoint, keys):
+        """
+        :return: Dictionary with the keys found in the archive.
+        """
+        found = {}
+        keys = list(keys)
+        with self._lock:
+            for i in range(0, len(keys), 500):
+                batch = keys[i:i + 500]
+                rows = self._db.execute(
+                    f"SELECT key, value FROM response WHERE endpoint = ? AND key IN ({','.join('?' * len(batch))})",
+                    [endpoint, *batch]
+                )
+                for key, value in rows:
+                    found[key] = json.loads(zlib.decompress(value))
+            self.stats["hits"] += len(found)
+            self.stats["misses"] += len(keys) - len(found)
+        return found
+
+    def put_many(self, endpoint, items):
+        """
+        Queue items to be written, returns immediately.
+        """
+        if len(items) == 0:
+            return
+        with self._pending_lock:
+            for key, value in items.items():
+                self._pending[(endpoint, key)] = value
+            if len(self._pending) >= ARCHIVE_FLUSH_SIZE:
+                self._wake.set()
+        self.stats["recorded"] += len(items)
+
+    def flush(self):
+        with self._pending_lock:
+            pending = self._pending
+            self._pending = {}
+        if len(pending) == 0:
+            return
+        rows = [(endpoint, key, zlib.compress(json.dumps(value).encode())) for (endpoint, key), value in pending.items()]
+        try:
+            with self._lock:
+                self._db.executemany("INSERT OR REPLACE INTO response (endpoint, key, value) VALUES (?, ?, ?)", rows)
+                self._db.commit()
+        except Exception:
+            with self._pending_lock:
+                self._pending = {**pending, **self._pending}  # retried at the next write
+            raise
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self._flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Unable to write the LamAPI archive: {e}", flush=True)
+
+    def close(self):
+        """
+        Write the pending responses and close the archive.
+        """
+        if self._thread is not None:
+            self._stop.set()
+            self._wake.set()
+            self._thread.join()
+        self.flush()
+        with self._lock:
+            self._db.close()
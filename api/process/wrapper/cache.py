@@ -0,0 +1,224 @@
+import gzip
+import json
+import os
+import time
+import zlib
+from collections import OrderedDict
+
+_MISSING = object()
+SIZE_SAMPLE_EVERY = 16  # values measured by an LRUCache, one every SIZE_SAMPLE_EVERY insertions
+
+
+class LRUCache:
+    """
+    In-process cache bounded by number of entries (and optionally by the size of
+    the values), with a time to live. Serializing every value would cost as much as
+    caching it, so the size of a value is its JSON length for one insertion every
+    SIZE_SAMPLE_EVERY and the moving average of the measured sizes for the others.
+    """
+    def __init__(self, max_size, ttl=None, max_bytes=None):
+        """
+        Initialize the LRUCache.
+
+        :param max_size: Maximum number of entries, the least recently used are evicted first.
+        :param ttl: Seconds after which an entry expires (None to never expire).
+        :param max_bytes: Maximum total size of the values (None for no limit).
+        """
+        self._max_size = max_size
+        self._ttl = ttl
+        self._max_bytes = max_bytes
+        self._data = OrderedDict()
+        self._sizes = {}
+        self._inserts = 0
+        self._mean_size = 0
+        self.bytes = 0
+
+    def get(self, key, default=None):
+        item = self._data.get(key)
+        if item is None:
+            return default
+        value, expires_at = item
+        if expires_at is not None and expires_at < time.time():
+            self._remove(key)
+            return default
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key, value, expires_at=None):
+        if expires_at is None and self._ttl is not None:
+            expires_at = time.time() + self._ttl
+        if key in self._data:
+            self._remove(key)
+        self._data[key] = (value, expires_at)
+        if self._max_bytes is not None:
+            self._sizes[key] = self._size(value)
+            self.bytes += self._sizes[key]
+        while len(self._data) > self._max_size or (self._max_bytes is not None and self.bytes > self._max_bytes and len(self._data) > 1):
+            self._remove(next(iter(self._data)))
+
+    def _size(self, value):
+        """
+        :return: Estimated size of a value.
+        """
+        self._inserts += 1
+        if self._inserts % SIZE_SAMPLE_EVERY != 1:
+            return self._mean_size
+        size = len(json.dumps(value, separators=(",", ":")))
+        self._mean_size = size if self._inserts == 1 else round(0.9 * self._mean_size + 0.1 * size)
+        return size
+
+    def _remove(self, key):
+        del self._data[key]
+        self.bytes -= self._sizes.pop(key, 0)
+
+    def items(self):
+        """
+        :return: List of (key, value, expires_at) of the entries not expired, least recently used first.
+        """
+        now = time.time()
+        return [(key, value, expires_at) for key, (value, expires_at) in self._data.items()
+                if expires_at is None or expires_at >= now]
+
+    def __contains__(self, key):
+        return self.get(key, _MISSING) is not _MISSING
+
+    def __len__(self):
+        return len(self._data)
+
+
+class RedisCache:
+    """
+    Cache shared by all the workers, stored in Redis as compressed JSON with a time to live.
+    """
+    def __init__(self, client, prefix, ttl=None):
+        """
+        Initialize the RedisCache.
+
+        :param client: redis.asyncio client, closed by its owner.
+        :param prefix: Prefix of the Redis keys.
+        :param ttl: Seconds after which an entry expires (None to never expire).
+        """
+        self._client = client
+        self._prefix = prefix
+        self._ttl = ttl
+
+    def _key(self, key):
+        return f"{self._prefix}:{key}"
+
+    async def get_many(self, keys):
+        """
+        :return: Dictionary with the keys found in the cache.
+        """
+        if len(keys) == 0:
+            return {}
+        values = await self._client.mget([self._key(key) for key in keys])
+        return {key: json.loads(zlib.decompress(value)) for key, value in zip(keys, values) if value is not None}
+
+    async def set_many(self, items):
+        if len(items) == 0:
+            return
+        async with self._client.pipeline(transaction=False) as pipe:
+            for key, value in items.items():
+                pipe.set(self._key(key), zlib.compress(json.dumps(value).encode()), ex=self._ttl)
+            await pipe.execute()
+
+
+class TieredCache:
+    """
+    Two-tier cache: an in-process LRU in front of an optional shared store.
+    Errors of the shared store are counted and treated as misses.
+    """
+    def __init__(self, name, local, shared=None):
+        """
+        Initialize the TieredCache.
+
+        :param name: Name used in the statistics.
+        :param local: LRUCache of the process.
+        :param shared: Optional RedisCache shared by the workers.
+        """
+        self.name = name
+        self._local = local
+        self._shared = shared
+        self._stats = {"localHits": 0, "sharedHits": 0, "misses": 0, "sharedErrors": 0}
+
+    async def get_many(self, keys):
+        """
+        :return: Dictionary with the keys found in one of the tiers.
+        """
+        found = {}
+        missing = []
+        for key in keys:
+            value = self._local.get(key, _MISSING)
+            if value is _MISSING:
+                missing.append(key)
+            else:
+                found[key] = value
+        self._stats["localHits"] += len(found)
+
+        if self._shared is not None and len(missing) > 0:
+            try:
+                shared_found = await self._shared.get_many(missing)
+            except Exception:
+                self._stats["sharedErrors"] += 1
+                shared_found = {}
+            for key, value in shared_found.items():
+                self._local.set(key, value)
+            found.update(shared_found)
+            self._stats["sharedHits"] += len(shared_found)
+
+        self._stats["misses"] += len(keys) - len(found)
+        return found
+
+    async def set_many(self, items):
+        for key, value in items.items():
+            self._local.set(key, value)
+        if self._shared is not None:
+            try:
+                await self._shared.set_many(items)
+            except Exception:
+                self._stats["sharedErrors"] += 1
+
+    def stats(self):
+        stats = dict(self._stats)
+        total = stats["localHits"] + stats["sharedHits"] + stats["misses"]
+        stats["hitRate"] = round((stats["localHits"] + stats["sharedHits"]) / total, 4) if total > 0 else None
+        stats["localSize"] = len(self._local)
+        stats["localBytes"] = self._local.bytes
+        return stats
+
+
+def save_snapshot(path, caches):
+    """
+    Write the in-process entries of the caches to a gzipped JSON file, used to warm
+    the caches of the next workers. The file is replaced atomically.
+
+    :param path: Path of the snapshot.
+    :param caches: Dictionary name -> TieredCache.
+    """
+    snapshot = {name: cache._local.items() for name, cache in caches.items()}
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with gzip.open(tmp_path, "wt") as f:
+        json.dump(snapshot, f)
+    os.replace(tmp_path, path)
+
+
+def load_snapshot(path, caches):
+    """
+    Load in the in-process tier of the caches the entries of a snapshot that are not expired.
+
+    :return: Number of loaded entries.
+    """
+    if not os.path.exists(path):
+        return 0
+    with gzip.open(path, "rt") as f:
+        snapshot = json.load(f)
+    now = time.time()
+    loaded = 0
+    for name, items in snapshot.items():
+        if name not in caches:
+            continue
+        for key, value, expires_at in items:
+            if expires_at is None or expires_at >= now:
+                caches[name]._local.set(key, value, expires_at)
+                loaded += 1
+    return loaded
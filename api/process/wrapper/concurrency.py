@@ -0,0 +1,278 @@
+import asyncio
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+
+
+class AdaptiveLimiter:
+    """
+    Concurrency limit of the requests to a service, adjusted with AIMD from the
+    observed latency and errors: the limit grows by one every limit successful
+    requests and is multiplied by decrease when a request fails or is slower
+    than target_latency (at most once per target_latency seconds).
+    """
+    def __init__(self, initial, min_limit, max_limit, target_latency, decrease=0.5):
+        """
+        Initialize the AdaptiveLimiter.
+
+        :param initial: Starting limit.
+        :param min_limit: Lower bound of the limit.
+        :param max_limit: Upper bound of the limit.
+        :param target_latency: Seconds above which a request signals overload.
+        :param decrease: Multiplicative decrease of the limit on overload.
+        """
+        self.limit = float(min(max(initial, min_limit), max_limit))
+        self._min_limit = min_limit
+        self._max_limit = max_limit
+        self._target_latency = target_latency
+        self._decrease = decrease
+        self._in_use = 0
+        self._waiters = deque()
+        self._decreased_at = 0
+        self._stats = {"requests": 0, "errors": 0, "slow": 0, "cancelled": 0}
+
+    async def acquire(self):
+        while self._in_use >= int(self.limit):
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                if waiter.done() and not waiter.cancelled():
+                    self._wake()  # pass the slot on
+                raise
+        self._in_use += 1
+
+    def release(self, latency, ok=True, cancelled=False):
+        """
+        Release a slot, updating the limit with the outcome of the request.
+
+        :param latency: Seconds taken by the request.
+        :param ok: False if the request failed.
+        :param cancelled: True if the request was cancelled (e.g. the loser of a hedged request),
+                          the slot is released without updating the limit.
+        """
+        self._in_use -= 1
+        if cancelled:
+            self._stats["cancelled"] += 1
+        else:
+            self._update(latency, ok)
+        for _ in range(int(self.limit) - self._in_use):
+            if not self._wake():
+                break
+
+    def _update(self, latency, ok):
+        self._stats["requests"] += 1
+        if not ok:
+            self._stats["errors"] += 1
+        elif latency > self._target_latency:
+            self._stats["slow"] += 1
+
+        if ok and latency <= self._target_latency:
+            self.limit = min(self.limit + 1 / self.limit, self._max_limit)
+        elif time.time() - self._decreased_at > self._target_latency:
+            self.limit = max(self.limit * self._decrease, self._min_limit)
+            self._decreased_at = time.time()
+
+    def _wake(self):
+        while len(self._waiters) > 0:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return True
+        return False
+
+    @asynccontextmanager
+    async def request(self):
+        """
+        Hold a slot for the duration of a request. The request is considered
+        failed if it raises or if the caller sets ok to False on the yielded sample;
+        a cancelled request does not change the limit.
+        """
+        await self.acquire()
+        sample = RequestSample()
+        start = time.time()
+        cancelled = False
+        try:
+            yield sample
+        except asyncio.CancelledError:
+            cancelled = True
+            raise
+        except Exception:
+            sample.ok = False
+            raise
+        finally:
+            self.release(time.time() - start, sample.ok, cancelled)
+
+    def stats(self):
+        return {**self._stats, "limit": round(self.limit, 2), "inUse": self._in_use}
+
+
+class RequestSample:
+    def __init__(self):
+        self.ok = True
+
+
+# Refills the bucket from the elapsed time and takes a token if available,
+# otherwise returns the milliseconds to wait for the next one.
+TOKEN_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or burst
+local ts = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(now - ts, 0) * rate)
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = math.ceil((1 - tokens) / rate * 1000)
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 60)
+return wait
+"""
+
+
+class RedisTokenBucket:
+    """
+    Request rate shared by all the worker processes through a token bucket in Redis.
+    If Redis is not reachable requests are not limited.
+    """
+    def __init__(self, client, key, rate, burst=None):
+        """
+        Initialize the RedisTokenBucket.
+
+        :param client: redis.asyncio client.
+        :param key: Redis key of the bucket.
+        :param rate: Requests per second.
+        :param burst: Maximum number of tokens, defaults to one second of requests.
+        """
+        self._key = key
+        self._rate = rate
+        self._burst = burst or max(rate, 1)
+        self._script = client.register_script(TOKEN_BUCKET_SCRIPT)
+        self.errors = 0
+
+    async def acquire(self):
+        while True:
+            try:
+                wait = await self._script(keys=[self._key], args=[self._rate, self._burst, time.time()])
+            except Exception:
+                self.errors += 1
+                return
+            if wait == 0:
+                return
+            await asyncio.sleep(wait / 1000)
+
+
+class CircuitBreaker:
+    """
+    Fails fast while a service is unhealthy: after failure_threshold consecutive
+    failures the circuit opens and requests are rejected for reset_timeout seconds,
+    then a single trial request is let through (half-open) and its outcome closes
+    or re-opens the circuit.
+    """
+    def __init__(self, failure_threshold, reset_timeout):
+        self._failure_threshold = failure_threshold
+        self._reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at = None
+        self._trial = False
+        self.rejected = 0
+
+    @property
+    def state(self):
+        if self._opened_at is None:
+            return "closed"
+        if time.time() - self._opened_at >= self._reset_timeout:
+            return "half-open"
+        return "open"
+
+    def allow(self):
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half-open" and not self._trial:
+            self._trial = True
+            return True
+        self.rejected += 1
+        return False
+
+    def record(self, ok):
+        if ok:
+            self._failures = 0
+            self._opened_at = None
+        else:
+            self._failures += 1
+            if self._opened_at is not None or self._failures >= self._failure_threshold:
+                self._opened_at = time.time()
+        self._trial = False
+
+    def cancel(self):
+        """
+        Forget a request cancelled before its outcome was known, so a cancelled
+        half-open trial lets the next request through.
+        """
+        self._trial = False
+
+
+class LatencyTracker:
+    """
+    Latencies of the most recent successful requests.
+    """
+    def __init__(self, window=200, min_samples=20):
+        self._latencies = deque(maxlen=window)
+        self._min_samples = min_samples
+
+    def add(self, latency):
+        self._latencies.append(latency)
+
+    def percentile(self, q):
+        """
+        :return: The q quantile of the recent latencies, None if there are too few samples.
+        """
+        if len(self._latencies) < self._min_samples:
+            return None
+        latencies = sorted(self._latencies)
+        return latencies[min(int(q * len(latencies)), len(latencies) - 1)]
+
+
+class EndpointPolicy:
+    """
+    Timeout, circuit breaker and hedging settings of an endpoint of a service.
+    """
+    def __init__(self, timeout, failure_threshold, reset_timeout, hedge=False, hedge_quantile=0.95):
+        """
+        Initialize the EndpointPolicy.
+
+        :param timeout: Seconds after which a request is abandoned.
+        :param failure_threshold: Consecutive failures that open the circuit.
+        :param reset_timeout: Seconds the circuit stays open.
+        :param hedge: True to send a duplicate of the requests slower than the hedge_quantile latency.
+        :param hedge_quantile: Latency quantile after which a request is hedged.
+        """
+        self.timeout = timeout
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        self.latency = LatencyTracker()
+        self.hedge = hedge
+        self.hedge_quantile = hedge_quantile
+        self.hedged = 0
+
+    def hedge_delay(self):
+        """
+        :return: Seconds after which a duplicate request is sent, None to not hedge.
+        """
+        if not self.hedge:
+            return None
+        return self.latency.percentile(self.hedge_quantile)
+
+    def stats(self):
+        p95 = self.latency.percentile(0.95)
+        return {
+            "circuit": self.breaker.state,
+            "rejected": self.breaker.rejected,
+            "hedged": self.hedged,
+            "p95": round(p95, 3) if p95 is not None else None
+        }
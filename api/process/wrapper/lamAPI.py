@@ -1,8 +1,13 @@
 import os
 import aiohttp
 import asyncio
+import hashlib
+import json
+import time
 import traceback
+import utils.utils as utils
 from wrapper.URLs import URLs
+from wrapper.concurrency import AdaptiveLimiter, EndpointPolicy
 from aiohttp_retry import RetryClient, ExponentialRetry
 
 
@@ -12,17 +17,97 @@ headers = {
 
 LAMAPI_TOKEN = os.environ["LAMAPI_TOKEN"]
 
+# Adaptive concurrency of the requests
+CONCURRENCY_MIN = int(os.environ.get("LAMAPI_CONCURRENCY_MIN", 4))
+CONCURRENCY_MAX = int(os.environ.get("LAMAPI_CONCURRENCY_MAX", 200))
+
+# Connection pool of the shared session, by default as large as the concurrency limit can grow
+MAX_CONNECTIONS = int(os.environ.get("LAMAPI_MAX_CONNECTIONS", CONCURRENCY_MAX))
+MAX_CONNECTIONS_PER_HOST = int(os.environ.get("LAMAPI_MAX_CONNECTIONS_PER_HOST", MAX_CONNECTIONS))
+DNS_CACHE_TTL = int(os.environ.get("LAMAPI_DNS_CACHE_TTL", 300))
+
+# requests above the connections to the LamAPI host would only wait in the pool, unseen by the limiter
+CONCURRENCY_MAX = min(CONCURRENCY_MAX, MAX_CONNECTIONS, MAX_CONNECTIONS_PER_HOST)
+TARGET_LATENCY = float(os.environ.get("LAMAPI_TARGET_LATENCY", 5))  # seconds above which LamAPI is considered overloaded
+
+LOOKUP_BATCH_SIZE = int(os.environ.get("LAMAPI_LOOKUP_BATCH_SIZE", 50))  # mentions per lookup request
+
+ENDPOINTS = ["lookup", "labels", "objects", "predicates", "types", "literals", "literal_recognizer", "column_analysis"]
+
+_MISSING = object()
+
+
+def _endpoint_setting(endpoint, name, default):
+    # LAMAPI_<ENDPOINT>_<NAME> overrides LAMAPI_<NAME>
+    return os.environ.get(f"LAMAPI_{endpoint.upper()}_{name}", os.environ.get(f"LAMAPI_{name}", default))
+
+
+def endpoint_policies():
+    """
+    :return: Dictionary endpoint -> EndpointPolicy with the timeout, circuit breaker and hedging settings of the environment.
+    """
+    return {
+        endpoint: EndpointPolicy(
+            timeout=float(_endpoint_setting(endpoint, "TIMEOUT", 60)),
+            failure_threshold=int(_endpoint_setting(endpoint, "BREAKER_THRESHOLD", 5)),
+            reset_timeout=float(_endpoint_setting(endpoint, "BREAKER_RESET", 30)),
+            hedge=_endpoint_setting(endpoint, "HEDGE", "0") == "1",
+            hedge_quantile=float(_endpoint_setting(endpoint, "HEDGE_QUANTILE", 0.95))
+        )
+        for endpoint in ENDPOINTS
+    }
+
 
 class LamAPI():
-    def __init__(self, LAMAPI_HOST, client_key, database, response_format="json", kg="wikidata", max_concurrent_requests=50) -> None:
+    def __init__(self, LAMAPI_HOST, client_key, database, response_format="json", kg="wikidata", max_concurrent_requests=50,
+                 max_connections=MAX_CONNECTIONS, max_connections_per_host=MAX_CONNECTIONS_PER_HOST, dns_cache_ttl=DNS_CACHE_TTL,
+                 lookup_cache=None, entity_caches=None, limiter=None, rate_limiter=None, policies=None, archive=None, log_c=None,
+                 retry_options=None) -> None:
         self.format = response_format
         self.database = database
         base_url = LAMAPI_HOST
         self._url = URLs(base_url, response_format=response_format)
         self.client_key = client_key
         self.kg = kg
-        # Initialize the semaphore with the max_concurrent_requests limit
-        self.semaphore = asyncio.Semaphore(max_concurrent_requests)
+        self.limiter = limiter or AdaptiveLimiter(max_concurrent_requests, CONCURRENCY_MIN, CONCURRENCY_MAX, TARGET_LATENCY)
+        self._rate_limiter = rate_limiter  # optional RedisTokenBucket shared by the workers
+        self._policies = policies or endpoint_policies()  # endpoint -> EndpointPolicy
+        # One long-lived session (and connection pool) shared by all the requests
+        self._session = None  # RetryClient wrapping _client_session
+        self._client_session = None
+        self._max_connections = max_connections
+        self._max_connections_per_host = max_connections_per_host
+        self._dns_cache_ttl = dns_cache_ttl
+        self._retry_options = retry_options or ExponentialRetry(attempts=3, start_timeout=3, max_timeout=10)
+        self._batch_lookup = True  # set to False if LamAPI does not accept lookup batches
+        self._lookup_cache = lookup_cache  # TieredCache of the lookup results, optional
+        self._entity_caches = entity_caches or {}  # endpoint -> TieredCache of the entity data, optional
+        self._in_flight = {}  # request key -> future of the pending request
+        self._archive = archive  # LamAPIArchive recording or replaying the responses, optional
+        self._log_c = log_c if log_c is not None else database.get_collection("log")  # e.g. a LogSink
+
+    def _get_session(self):
+        # RetryClient has no closed attribute, the state is the one of the wrapped ClientSession
+        if self._session is None or self._client_session.closed:
+            connector = aiohttp.TCPConnector(
+                ssl=False,
+                limit=self._max_connections,
+                limit_per_host=self._max_connections_per_host,
+                ttl_dns_cache=self._dns_cache_ttl,
+                use_dns_cache=True
+            )
+            self._client_session = aiohttp.ClientSession(connector=connector)
+            self._session = RetryClient(client_session=self._client_session, retry_options=self._retry_options)
+        return self._session
+
+    async def close(self):
+        """
+        Close the shared session and its connection pool.
+        """
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+            self._client_session = None
 
     async def __to_format(self, response):
         content_type = response.headers.get('Content-Type', '')
@@ -38,38 +123,91 @@ class LamAPI():
             else:
                 raise Exception("Sorry, Invalid format!")
         
-        return {}
+        return None
+
+    async def __submit_get(self, endpoint, url, params):
+        return await self.__submit("GET", endpoint, url, params)
 
-    async def __submit_get(self, url, params):
+    async def __submit_post(self, endpoint, url, params, json_data, with_status=False):
+        return await self.__submit("POST", endpoint, url, params, json_data, with_status)
+
+    async def __submit(self, method, endpoint, url, params, json_data=None, with_status=False):
+        """
+        :param with_status: Return a tuple (HTTP status, result), the status is None if no response was received.
+        :return: The JSON answer of LamAPI, or a dictionary with an error key if the request failed,
+                 LamAPI answered with a non-2xx status or with a body that is not JSON.
+        """
+        policy = self._policies[endpoint]
+        if not policy.breaker.allow():
+            error = {"error": f"LamAPI circuit open for {endpoint}"}
+            return (None, error) if with_status else error
+        start = time.time()
         try:
-            retry_options = ExponentialRetry(attempts=3, start_timeout=3, max_timeout=10)
-            timeout = aiohttp.ClientTimeout(total=1000)  # Adjusted timeout
-            async with self.semaphore:
-                async with RetryClient(connector=aiohttp.TCPConnector(ssl=False), retry_options=retry_options) as session:
-                    async with session.get(url, headers=headers, params=params, timeout=timeout) as response:
-                        return await self.__to_format(response)
+            hedge_delay = policy.hedge_delay()
+            if hedge_delay is None:
+                ok, status, result = await self.__attempt(method, url, params, json_data, policy.timeout)
+            else:
+                ok, status, result = await self.__hedged(policy, hedge_delay, method, url, params, json_data)
+        except asyncio.CancelledError:
+            policy.breaker.cancel()
+            raise
         except Exception as e:
-            self.__log_error("GET", url, params, str(e))
-            return {"error": str(e)}  # Return a structured error message.
+            policy.breaker.record(False)
+            self.__log_error(method, url, params, str(e), json_data)
+            error = {"error": str(e)}  # Return a structured error message.
+            return (None, error) if with_status else error
+        policy.breaker.record(ok)
+        if ok:
+            policy.latency.add(time.time() - start)
+        if not 200 <= status < 300 or result is None:
+            # never an empty answer: callers cache the answers of LamAPI
+            error_message = f"LamAPI status {status}" if not 200 <= status < 300 else "LamAPI answer is not JSON"
+            self.__log_error(method, url, params, error_message, json_data)
+            result = {"error": error_message}
+        return (status, result) if with_status else result
 
-    async def __submit_post(self, url, params, json_data):
+    async def __attempt(self, method, url, params, json_data, timeout):
+        """
+        :return: Tuple (ok, HTTP status, result), ok is False if LamAPI is overloaded or failed.
+        """
+        if self._rate_limiter is not None:
+            await self._rate_limiter.acquire()
+        async with self.limiter.request() as sample:
+            async with self._get_session().request(method, url, headers=headers, params=params, json=json_data,
+                                                   timeout=aiohttp.ClientTimeout(total=timeout)) as response:
+                sample.ok = response.status < 500 and response.status != 429
+                return sample.ok, response.status, await self.__to_format(response)
+
+    async def __hedged(self, policy, hedge_delay, method, url, params, json_data):
+        """
+        Send a duplicate of the request if it takes longer than hedge_delay and
+        return the first successful answer.
+        """
+        first = asyncio.ensure_future(self.__attempt(method, url, params, json_data, policy.timeout))
+        done, _ = await asyncio.wait({first}, timeout=hedge_delay)
+        if first in done:
+            return first.result()
+
+        policy.hedged += 1
+        pending = {first, asyncio.ensure_future(self.__attempt(method, url, params, json_data, policy.timeout))}
         try:
-            retry_options = ExponentialRetry(attempts=3, start_timeout=3, max_timeout=10)
-            timeout = aiohttp.ClientTimeout(total=60)  # Adjusted timeout
-            async with self.semaphore:
-                async with RetryClient(connector=aiohttp.TCPConnector(ssl=False), retry_options=retry_options) as session:
-                    async with session.post(url, headers=headers, params=params, json=json_data, timeout=timeout) as response:
-                        return await self.__to_format(response)
-        except Exception as e:
-            self.__log_error("POST", url, params, str(e), json_data)
-            return {"error": str(e)}  # Return a structured error message.
+            while True:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None and task.result()[0]:
+                        return task.result()
+                if len(pending) == 0:
+                    return task.result()
+        finally:
+            for task in pending:
+                task.cancel()
 
     def __log_error(self, method, url, params, error_message, json_data=None):
         # Use a generic or specific error type based on the exception.
         error_type = "timeout" if "TimeoutError" in error_message else "generic"
         traceback_info = traceback.format_exc()
 
-        self.database.get_collection("log").insert_one({
+        self._log_c.insert_one({
             "type": error_type,
             "method": method,
             "url": url,
@@ -86,8 +224,10 @@ class LamAPI():
         params = {
             'token': self.client_key
         }
-        result = await self.__submit_post(self._url.literal_recognizer_url(), params, json_data)
+        result = await self._archived_request("literal_recognizer", self._url.literal_recognizer_url(), params, json_data)
         freq_data = {}
+        if "error" in result:
+            return freq_data
         for cell in result:
             item = result[cell]
             if item["datatype"] == "STRING" and item["datatype"] == item["classification"]:
@@ -107,57 +247,133 @@ class LamAPI():
         params = {
             'token': self.client_key
         }
-        return await self.__submit_post(self._url.column_analysis_url(), params, json_data)
+        return await self._archived_request("column_analysis", self._url.column_analysis_url(), params, json_data)
+
+    async def _archived_request(self, endpoint, url, params, json_data):
+        """
+        POST request archived as a whole, keyed by the digest of its body.
+        """
+        key = hashlib.sha1(json.dumps(json_data, sort_keys=True).encode()).hexdigest()
+        response = {}
+
+        async def fetch(keys):
+            nonlocal response
+            response = await self.__submit_post(endpoint, url, params, json_data)
+            if not isinstance(response, dict) or "error" in response:
+                return {}
+            return {key: response}
+
+        return (await self._archived(endpoint, {key: key}, fetch)).get(key, response)
 
     async def labels(self, entities):
-        params = {
-            'token': self.client_key,
-            'kg': self.kg
-        }
-        json_data = {
-            'json': entities
-        }
-        return await self.__submit_post(self._url.entities_labels(), params, json_data)
+        return await self._entities_data("labels", self._url.entities_labels_url(), entities)
 
     async def objects(self, entities):
-        params = {
-            'token': self.client_key,
-            'kg': self.kg
-        }
-        json_data = {
-            'json': entities
-        }
-        return await self.__submit_post(self._url.entities_objects_url(), params, json_data)
+        return await self._entities_data("objects", self._url.entities_objects_url(), entities)
 
     async def predicates(self, entities):
-        params = {
-            'token': self.client_key,
-            'kg': self.kg
-        }
-        json_data = {
-            'json': entities
-        }
-        return await self.__submit_post(self._url.entities_predicates_url(), params, json_data)
+        return await self._entities_data("predicates", self._url.entities_predicates_url(), entities)
 
     async def types(self, entities):
-        params = {
-            'token': self.client_key,
-            'kg': self.kg
-        }
-        json_data = {
-            'json': entities
-        }
-        return await self.__submit_post(self._url.entities_types_url(), params, json_data)
+        return await self._entities_data("types", self._url.entities_types_url(), entities)
 
     async def literals(self, entities):
+        return await self._entities_data("literals", self._url.entities_literals_url(), entities)
+
+    async def _entities_data(self, endpoint, url, entities):
+        """
+        Data of the entities from one of the entity endpoints. Concurrent requests
+        of the same entity are coalesced.
+
+        :return: Dictionary entity id -> data, entities without data are missing.
+        """
+        keys = {entity: (endpoint, self.kg, entity) for entity in dict.fromkeys(entities)}
+        results = await self._single_flight(keys, lambda missing: self._fetch_entities_data(endpoint, url, missing))
+        return {entity: data for entity, data in results.items() if data}
+
+    async def _fetch_entities_data(self, endpoint, url, entities):
+        """
+        Entities are first searched in the cache of the endpoint (keyed by KG and
+        entity id), the others are requested to LamAPI; entities missing from a
+        successful response are cached as empty, so they are not requested again.
+        """
         params = {
             'token': self.client_key,
             'kg': self.kg
         }
-        json_data = {
-            'json': entities
-        }
-        return await self.__submit_post(self._url.entities_literals_url(), params, json_data)
+        cache = self._entity_caches.get(endpoint)
+        results = {}
+        keys = {entity: f"{self.kg}:{entity}" for entity in entities}
+        if cache is not None:
+            cached = await cache.get_many(list(keys.values()))
+            results = {entity: cached[keys[entity]] for entity in entities if keys[entity] in cached}
+
+        missing = [entity for entity in entities if entity not in results]
+        if len(missing) > 0:
+            async def fetch(missing):
+                fetched = await self.__submit_post(endpoint, url, params, {'json': missing})
+                if not isinstance(fetched, dict) or "error" in fetched:
+                    return {}
+                return {entity: fetched.get(entity, {}) for entity in missing}
+
+            fetched = await self._archived(endpoint, {entity: keys[entity] for entity in missing}, fetch)
+            if cache is not None:
+                await cache.set_many({keys[entity]: data for entity, data in fetched.items()})
+            results.update(fetched)
+        return results
+
+    async def _archived(self, endpoint, keys, fetch):
+        """
+        Fetch items through the archive: in replay mode the items come from the
+        archive only, in record mode the fetched items are saved to it.
+
+        :param keys: Dictionary item -> key of the item in the archive.
+        :param fetch: Function fetching a list of items from LamAPI, returns a dictionary item -> value.
+        :return: Dictionary item -> value, items without a value are missing.
+        """
+        if self._archive is None:
+            return await fetch(list(keys))
+        if self._archive.replay:
+            found = await asyncio.to_thread(self._archive.get_many, endpoint, list(keys.values()))
+            return {item: found[key] for item, key in keys.items() if key in found}
+        results = await fetch(list(keys))
+        self._archive.put_many(endpoint, {keys[item]: value for item, value in results.items()})
+        return results
+
+    async def _single_flight(self, keys, fetch):
+        """
+        Coalesce identical concurrent requests: items whose key is already being
+        fetched await the pending request, the others are fetched with a single
+        call of fetch, which returns a dictionary item -> value.
+
+        :param keys: Dictionary item -> key identifying the request of the item.
+        :return: Dictionary item -> value, items without a value are missing.
+        """
+        loop = asyncio.get_running_loop()
+        owned = []
+        pending = {}
+        for item, key in keys.items():
+            if key in self._in_flight:
+                pending[item] = self._in_flight[key]
+            else:
+                self._in_flight[key] = loop.create_future()
+                owned.append(item)
+
+        results = {}
+        if len(owned) > 0:
+            try:
+                results = await fetch(owned)
+            finally:
+                # waiters of a failed fetch see the items as missing
+                for item in owned:
+                    future = self._in_flight.pop(keys[item])
+                    if not future.done():
+                        future.set_result(results.get(item, _MISSING))
+
+        if len(pending) > 0:
+            values = await asyncio.gather(*pending.values())
+            results.update({item: value for item, value in zip(pending, values) if value is not _MISSING})
+        return results
 
     async def lookup(self, string, ngrams=False, fuzzy=False, types=None, limit=100, ids=None):
         # Convert boolean values to strings
@@ -177,8 +393,90 @@ class LamAPI():
         if types_str is not None:
             params['types'] = types_str
             
-        result = await self.__submit_get(self._url.lookup_url(), params)
+        result = await self.__submit_get("lookup", self._url.lookup_url(), params)
         if len(result) > 1:
             result = {"wikidata": result}
 
         return result
+
+    def _lookup_key(self, mention, ngrams, fuzzy, types, limit):
+        types_str = ' '.join(sorted(types)) if types else ''
+        return f"{self.kg}:{limit}:{types_str}:{int(ngrams)}{int(fuzzy)}:{utils.clean_str(mention)}"
+
+    async def lookup_many(self, mentions, ngrams=False, fuzzy=False, types=None, limit=100, batch_size=None):
+        """
+        Lookup of many mentions. Mentions are first searched in the lookup cache
+        (keyed by normalized mention, KG, limit and types), the others are packed
+        in POST requests of at most batch_size mentions. Concurrent lookups of the
+        same mention are coalesced.
+
+        :return: Dictionary mention -> candidates, mentions without an answer are missing.
+        """
+        keys = {mention: ("lookup", self._lookup_key(mention, ngrams, fuzzy, types, limit), mention)
+                for mention in dict.fromkeys(mentions)}
+        return await self._single_flight(
+            keys, lambda missing: self._cached_lookups(missing, ngrams, fuzzy, types, limit, batch_size)
+        )
+
+    async def _cached_lookups(self, mentions, ngrams, fuzzy, types, limit, batch_size=None):
+        results = {}
+        keys = {}
+        if self._lookup_cache is not None:
+            keys = {mention: self._lookup_key(mention, ngrams, fuzzy, types, limit) for mention in mentions}
+            cached = await self._lookup_cache.get_many(list(set(keys.values())))
+            results = {mention: cached[keys[mention]] for mention in mentions if keys[mention] in cached}
+
+        missing = [mention for mention in mentions if mention not in results]
+        if len(missing) > 0:
+            types_str = ' '.join(sorted(types)) if types else ''
+            fetched = await self._archived(
+                "lookup",
+                {mention: f"{self.kg}:{limit}:{types_str}:{int(ngrams)}{int(fuzzy)}:{mention}" for mention in missing},
+                lambda missing: self._fetch_lookups(missing, ngrams, fuzzy, types, limit, batch_size)
+            )
+            if self._lookup_cache is not None:
+                await self._lookup_cache.set_many({keys[mention]: candidates for mention, candidates in fetched.items()})
+            results.update(fetched)
+        return results
+
+    async def _fetch_lookups(self, mentions, ngrams, fuzzy, types, limit, batch_size=None):
+        """
+        Lookup of many mentions, packed in POST requests of at most batch_size mentions.
+        Mentions are looked up one by one when the batch endpoint is not available.
+        """
+        batch_size = batch_size or LOOKUP_BATCH_SIZE
+        params = {
+            'token': LAMAPI_TOKEN,
+            'ngrams': 'true' if ngrams else 'false',
+            'fuzzy': 'true' if fuzzy else 'false',
+            'kg': self.kg,
+            'limit': limit
+        }
+        if types is not None:
+            params['types'] = ' '.join(types)
+
+        async def submit_batch(batch):
+            status, result = await self.__submit_post("lookup", self._url.lookup_url(), params, {'json': batch}, with_status=True)
+            if status in (404, 405):
+                self._batch_lookup = False  # the endpoint does not accept POST requests
+                return {}
+            if not isinstance(result, dict) or "error" in result:
+                return {}  # transient: the batch support is decided from successful JSON answers only
+            found = {mention: result[mention] for mention in batch if mention in result}
+            if len(found) == 0:
+                self._batch_lookup = False  # the endpoint ignores the batch, e.g. answers a lookup without name
+            return found
+
+        results = {}
+        if self._batch_lookup:
+            batches = [mentions[i:i + batch_size] for i in range(0, len(mentions), batch_size)]
+            for result in await asyncio.gather(*[submit_batch(batch) for batch in batches]):
+                results.update(result)
+
+        missing = [mention for mention in mentions if mention not in results]
+        if len(missing) > 0:
+            single_results = await asyncio.gather(*[self.lookup(mention, ngrams, fuzzy, types, limit) for mention in missing])
+            for mention, result in zip(missing, single_results):
+                if mention in result:
+                    results[mention] = result[mention]
+        return results
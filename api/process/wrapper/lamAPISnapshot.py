@@ -0,0 +1,235 @@
+"""
+LamAPI backend answering from a local snapshot of a KG, for batch annotation
+against a frozen dump without HTTP calls.
+
+The snapshot is a SQLite file with the data of every entity (compressed JSON)
+and a prebuilt FTS5 index of its labels. Build it from a JSON Lines file with
+one entity per line, from api/process:
+
+    python -m wrapper.lamAPISnapshot --input wikidata.jsonl --output wikidata.sqlite
+
+    {"id": "Q220", "name": "Rome", "description": "capital of Italy", "aliases": ["Roma"],
+     "popularity": 0.98, "types": [{"id": "Q515", "name": "city"}],
+     "objects": {"Q38": ["P17"]}, "literals": {"number": {"P1082": ["+2872800"]}},
+     "predicates": {"P17": ["Q38"]}}
+"""
+import argparse
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import zlib
+
+import utils.metrics as metrics
+import utils.utils as utils
+
+SNAPSHOT_MMAP_SIZE = int(os.environ.get("LAMAPI_SNAPSHOT_MMAP_MB", 1024)) * 1024 * 1024  # bytes of the snapshot memory mapped
+
+ENTITY_FIELDS = ["objects", "literals", "types", "predicates", "labels"]
+
+
+def _pack(value):
+    return zlib.compress(json.dumps(value).encode())
+
+
+def _unpack(value):
+    return json.loads(zlib.decompress(value))
+
+
+class LamAPISnapshot:
+    """
+    Same interface as LamAPI, answered from a local KG snapshot.
+    """
+    def __init__(self, path, kg="wikidata", mmap_size=SNAPSHOT_MMAP_SIZE) -> None:
+        """
+        Initialize the LamAPISnapshot.
+
+        :param path: Path of the snapshot built with build_snapshot.
+        :param kg: Name of the KG of the snapshot.
+        :param mmap_size: Bytes of the snapshot memory mapped.
+        """
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"KG snapshot not found: {path}")
+        self.kg = kg
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+        self._db.execute(f"PRAGMA mmap_size={mmap_size}")
+
+    async def close(self):
+        with self._lock:
+            self._db.close()
+
+    def _query(self, sql, params=()):
+        with self._lock:
+            return self._db.execute(sql, params).fetchall()
+
+    def _entities(self, field, entities):
+        result = {}
+        entities = list(dict.fromkeys(entities))
+        for i in range(0, len(entities), 500):
+            batch = entities[i:i + 500]
+            rows = self._query(f"SELECT id, {field} FROM entity WHERE id IN ({','.join('?' * len(batch))})", batch)
+            for entity, value in rows:
+                if value is not None:
+                    result[entity] = {field: _unpack(value)} if field != "labels" else _unpack(value)
+        return result
+
+    async def labels(self, entities):
+        return await asyncio.to_thread(self._entities, "labels", entities)
+
+    async def objects(self, entities):
+        return await asyncio.to_thread(self._entities, "objects", entities)
+
+    async def predicates(self, entities):
+        return await asyncio.to_thread(self._entities, "predicates", entities)
+
+    async def types(self, entities):
+        return await asyncio.to_thread(self._entities, "types", entities)
+
+    async def literals(self, entities):
+        return await asyncio.to_thread(self._entities, "literals", entities)
+
+    def _candidates(self, mention, fuzzy=False, types=None, limit=100):
+        """
+        Candidates of a mention: entities with the mention as label first, then the
+        best matches of the label index, with the features LamAPI computes.
+        """
+        mention_norm = utils.clean_str(mention)
+        tokens = [token.replace('"', '') for token in mention_norm.split(" ") if token.replace('"', '') != ""]
+        if len(tokens) == 0:
+            return []
+        suffix = "*" if fuzzy else ""
+        match = " OR ".join(f'"{token}"{suffix}' for token in tokens)
+        rows = self._query(
+            "SELECT id, min(score) AS best FROM (SELECT id, bm25(label_index) AS score FROM label_index "
+            "WHERE label_index MATCH ? ORDER BY score LIMIT ?) GROUP BY id ORDER BY best",
+            (match, (limit * 5 if types else limit) * 2)
+        )
+        exact = [entity for (entity,) in self._query("SELECT id FROM label WHERE label = ? LIMIT ?", (mention_norm, limit))]
+        scores = {entity: -score for entity, score in rows}
+        ranked = list(dict.fromkeys(exact + [entity for entity, _ in rows]))
+        if len(ranked) == 0:
+            return []
+
+        data = {}
+        for i in range(0, len(ranked), 500):
+            batch = ranked[i:i + 500]
+            for entity, name, description, popularity, entity_types in self._query(
+                f"SELECT id, name, description, popularity, types FROM entity WHERE id IN ({','.join('?' * len(batch))})", batch
+            ):
+                data[entity] = (name, description, popularity, _unpack(entity_types) if entity_types is not None else [])
+        if types:
+            types = set(types)
+            ranked = [entity for entity in ranked if entity in data and any(t["id"] in types for t in data[entity][3])]
+        ranked = [entity for entity in ranked if entity in data][:limit]
+
+        max_score = max(list(scores.values()) + [1e-9])
+        mention_tokens = set(tokens)
+        candidates = []
+        for position, entity in enumerate(ranked):
+            name, description, popularity, entity_types = data[entity]
+            name_norm = utils.clean_str(name)
+            name_tokens = set(name_norm.split(" "))
+            candidates.append({
+                "id": entity,
+                "name": name,
+                "description": description or "",
+                "types": entity_types,
+                "ambiguity_mention": round(len(exact) / len(ranked), 3),
+                "corrects_tokens": round(len(mention_tokens & name_tokens) / len(mention_tokens), 3),
+                "ntoken_mention": len(tokens),
+                "ntoken_entity": len(name_tokens),
+                "length_mention": len(mention_norm),
+                "length_entity": len(name_norm),
+                "popularity": popularity or 0,
+                "pos_score": round(position / len(ranked), 3),
+                "es_score": round(max(scores.get(entity, max_score), 0) / max_score, 3),
+                "ed_score": round(1 - metrics.edit_distance(mention_norm, name_norm), 3),
+                "jaccard_score": round(metrics.compute_similarity_between_string_token_based(mention_norm, name_norm), 3),
+                "jaccardNgram_score": round(metrics.compute_similarity_between_string(mention_norm, name_norm, 3), 3)
+            })
+        return candidates
+
+    async def lookup(self, string, ngrams=False, fuzzy=False, types=None, limit=100, ids=None):
+        return {string: await asyncio.to_thread(self._candidates, string, fuzzy, types, limit)}
+
+    async def lookup_many(self, mentions, ngrams=False, fuzzy=False, types=None, limit=100, batch_size=None):
+        def lookup_all():
+            return {mention: self._candidates(mention, fuzzy, types, limit) for mention in dict.fromkeys(mentions)}
+        return await asyncio.to_thread(lookup_all)
+
+    async def literal_recognizer(self, column):
+        freq_data = {}
+        for cell in column:
+            datatype = utils.guess_datatype(cell)
+            datatype = "ENTITY" if datatype == "STRING" else datatype
+            freq_data[datatype] = freq_data.get(datatype, 0) + 1
+        return freq_data
+
+    async def column_analysis(self, columns):
+        """
+        Columns whose cells are mostly numbers or dates are LIT, the others NE.
+        """
+        result = {}
+        for id_col, column in enumerate(columns):
+            datatypes = [utils.guess_datatype(cell) for cell in column if str(cell).strip().lower() not in ("", "nan")]
+            datatype = max(set(datatypes), key=datatypes.count) if len(datatypes) > 0 else "STRING"
+            result[str(id_col)] = {"tag": "NE" if datatype == "STRING" else "LIT", "datatype": datatype}
+        return result
+
+
+def build_snapshot(input_path, output_path, batch_size=10000):
+    """
+    Build a snapshot from a JSON Lines file with one entity per line.
+
+    :return: Number of entities in the snapshot.
+    """
+    db = sqlite3.connect(output_path)
+    db.execute("PRAGMA journal_mode=OFF")
+    db.execute("PRAGMA synchronous=OFF")
+    db.execute(
+        "CREATE TABLE IF NOT EXISTS entity (id TEXT PRIMARY KEY, name TEXT, description TEXT, popularity REAL, "
+        "objects BLOB, literals BLOB, types BLOB, predicates BLOB, labels BLOB)"
+    )
+    db.execute("CREATE TABLE IF NOT EXISTS label (label TEXT, id TEXT)")
+    db.execute("CREATE VIRTUAL TABLE IF NOT EXISTS label_index USING fts5(label, id UNINDEXED)")
+
+    def write(entities, labels):
+        db.executemany("INSERT OR REPLACE INTO entity VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", entities)
+        db.executemany("INSERT INTO label VALUES (?, ?)", labels)
+        db.executemany("INSERT INTO label_index VALUES (?, ?)", labels)
+        db.commit()
+
+    count = 0
+    entities, labels = [], []
+    with open(input_path) as f:
+        for line in f:
+            if line.strip() == "":
+                continue
+            item = json.loads(line)
+            names = list(dict.fromkeys([item.get("name") or ""] + item.get("aliases", [])))
+            item.setdefault("labels", {"name": item.get("name"), "aliases": item.get("aliases", [])})
+            entities.append((
+                item["id"], item.get("name"), item.get("description"), item.get("popularity", 0),
+                *[_pack(item[field]) if field in item else None for field in ENTITY_FIELDS]
+            ))
+            labels.extend((utils.clean_str(name), item["id"]) for name in names if name != "")
+            count += 1
+            if len(entities) >= batch_size:
+                write(entities, labels)
+                entities, labels = [], []
+    write(entities, labels)
+    db.execute("CREATE INDEX IF NOT EXISTS label_label ON label (label)")
+    db.execute("INSERT INTO label_index(label_index) VALUES ('optimize')")
+    db.commit()
+    db.close()
+    return count
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build a KG snapshot for LAMAPI_SNAPSHOT")
+    parser.add_argument("--input", required=True, help="JSON Lines file with one entity per line")
+    parser.add_argument("--output", required=True, help="SQLite file of the snapshot")
+    args = parser.parse_args()
+    print(f"{build_snapshot(args.input, args.output)} entities written to {args.output}")